@@ -6,6 +6,7 @@ from prometheus_client import CollectorRegistry, Gauge
 from app.classes.models.management import HelpersManagement, HelpersWebhooks
 from app.classes.models.servers import HelperServers
 from app.classes.shared.helpers import Helpers
+from app.classes.shared.webhook_dispatcher import WebhookDispatcher
 
 logger = logging.getLogger(__name__)
 
@@ -43,6 +44,9 @@ class ManagementController:
     def get_latest_hosts_stats():
         return HelpersManagement.get_latest_hosts_stats()
 
+    def get_hosts_history(self, hours, max_points=None):
+        return self.management_helper.get_hosts_history(hours, max_points)
+
     @staticmethod
     def set_crafty_api_key(key):
         HelpersManagement.set_secret_api_key(key)
@@ -247,11 +251,15 @@ class ManagementController:
     # **********************************************************************************
     @staticmethod
     def create_webhook(data):
-        return HelpersWebhooks.create_webhook(data)
+        webhook_id = HelpersWebhooks.create_webhook(data)
+        WebhookDispatcher().invalidate(data["server_id"])
+        return webhook_id
 
     @staticmethod
     def modify_webhook(webhook_id, data):
         HelpersWebhooks.modify_webhook(webhook_id, data)
+        # The webhook may have moved to another server
+        WebhookDispatcher().invalidate()
 
     @staticmethod
     def get_webhook_by_id(webhook_id):
@@ -264,7 +272,9 @@ class ManagementController:
     @staticmethod
     def delete_webhook(webhook_id):
         HelpersWebhooks.delete_webhook(webhook_id)
+        WebhookDispatcher().invalidate()
 
     @staticmethod
     def delete_webhook_by_server(server_id):
         HelpersWebhooks.delete_webhooks_by_server(server_id)
+        WebhookDispatcher().invalidate(server_id)
@@ -8,6 +8,7 @@ from app.classes.models.server_permissions import (
 from app.classes.models.users import HelperUsers, ApiKeys
 from app.classes.models.roles import HelperRoles
 from app.classes.models.servers import HelperServers
+from app.classes.shared.permission_matrix import PermissionMatrix
 
 logger = logging.getLogger(__name__)
 
@@ -104,8 +105,7 @@ class ServerPermsController:
 
     @staticmethod
     def get_user_permissions_mask(user_id: str, server_id: str):
-        user = HelperUsers.get_user_model(user_id)
-        return PermissionsServers.get_user_permissions_mask(user, server_id)
+        return PermissionMatrix().get_mask(user_id, server_id)
 
     @staticmethod
     def get_authorized_servers_stats_from_roles(user_id):
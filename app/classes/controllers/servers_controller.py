@@ -13,6 +13,8 @@ from app.classes.shared.server import ServerInstance
 from app.classes.shared.console import Console
 from app.classes.shared.helpers import Helpers
 from app.classes.shared.main_models import DatabaseShortcuts
+from app.classes.shared.permission_matrix import PermissionMatrix
+from app.classes.shared.status_snapshot import StatusSnapshotCache
 
 from app.classes.minecraft.stats import Stats
 
@@ -106,13 +108,14 @@ class ServersController(metaclass=Singleton):
 
         return ret
 
-    def get_history_stats(self, server_id, hours):
+    def get_history_stats(self, server_id, hours, max_points=None):
         srv = ServersController().get_server_instance_by_id(server_id)
-        return srv.stats_helper.get_history_stats(server_id, hours)
+        return srv.stats_helper.get_history_stats(server_id, hours, max_points)
 
     @staticmethod
     def update_unloaded_server(server_obj):
         ret = HelperServers.update_server(server_obj)
+        StatusSnapshotCache().invalidate(server_obj.server_id)
         return ret
 
     @staticmethod
@@ -260,23 +263,10 @@ class ServersController(metaclass=Singleton):
 
     @staticmethod
     def get_authorized_servers(user_id):
-        server_ids = []
-        server_data: t.List[t.Dict[str, t.Any]] = []
-        user_roles = HelperUsers.user_role_query(user_id)
-        for user in user_roles:
-            role_servers = PermissionsServers.get_role_servers_from_role_id(
-                user.role_id
-            )
-            for role in role_servers:
-                if role.server_id.server_id not in server_ids:
-                    server_ids.append(role.server_id.server_id)
-                    server_data.append(
-                        ServersController().get_server_instance_by_id(
-                            role.server_id.server_id
-                        )
-                    )
-
-        return server_data
+        return [
+            ServersController().get_server_instance_by_id(server_id)
+            for server_id in PermissionMatrix().get_server_ids(user_id)
+        ]
 
     @staticmethod
     def get_authorized_users(server_id: str):
@@ -1,4 +1,5 @@
 import struct
+import asyncio
 import socket
 import base64
 import json
@@ -120,6 +121,43 @@ def get_code_format(format_name):
     return ""
 
 
+def status_request(ip, port) -> bytes:
+    host = ip.encode("utf-8")
+    data = b""  # wiki.vg/Server_List_Ping
+    data += b"\x00"  # packet ID
+    data += b"\x04"  # protocol variant
+    data += struct.pack(">b", len(host)) + host
+    data += struct.pack(">H", port)
+    data += b"\x01"  # next state
+    data = struct.pack(">b", len(data)) + data
+    return data + b"\x01\x00"  # handshake + status ping
+
+
+def unpack_var_int(data: bytes, offset: int = 0):
+    """Returns the VarInt at offset and the offset right after it"""
+    i = 0
+    j = 0
+    while True:
+        if offset >= len(data):
+            raise ValueError("var_int truncated")
+        k = data[offset]
+        offset += 1
+        i |= (k & 0x7F) << (j * 7)
+        j += 1
+        if j > 5:
+            raise ValueError("var_int too big")
+        if not k & 0x80:
+            return i, offset
+
+
+def parse_status(data: bytes):
+    logger.debug(f"Server reports this data on ping: {data}")
+    try:
+        return Server(json.loads(data))
+    except KeyError:
+        return {}
+
+
 # For the rest of requests see wiki.vg/Protocol
 def ping(ip, port):
     def read_var_int():
@@ -149,15 +187,7 @@ def ping(ip, port):
         return False
 
     try:
-        host = ip.encode("utf-8")
-        data = b""  # wiki.vg/Server_List_Ping
-        data += b"\x00"  # packet ID
-        data += b"\x04"  # protocol variant
-        data += struct.pack(">b", len(host)) + host
-        data += struct.pack(">H", port)
-        data += b"\x01"  # next state
-        data = struct.pack(">b", len(data)) + data
-        sock.sendall(data + b"\x01\x00")  # handshake + status ping
+        sock.sendall(status_request(ip, port))
         length = read_var_int()  # full packet length
         if length < 10:
             return not length < 0
@@ -171,15 +201,44 @@ def ping(ip, port):
                 return False
 
             data += chunk
-        logger.debug(f"Server reports this data on ping: {data}")
-        try:
-            return Server(json.loads(data))
-        except KeyError:
-            return {}
+        return parse_status(data)
     finally:
         sock.close()
 
 
+async def ping_async(ip, port):
+    """
+    Same as ping, on asyncio streams. The whole status packet is read at
+    once and parsed from memory. Callers put the deadline on it.
+    """
+    try:
+        reader, writer = await asyncio.open_connection(ip, port)
+    except (OSError, ValueError):
+        return False
+
+    try:
+        writer.write(status_request(ip, port))
+        await writer.drain()
+        # The length prefix is at most 5 bytes, served from the stream buffer
+        prefix = b""
+        while True:
+            prefix += await reader.readexactly(1)
+            if not prefix[-1] & 0x80 or len(prefix) >= 5:
+                break
+        length, _ = unpack_var_int(prefix)  # full packet length
+        if length < 10:
+            return True
+
+        packet = await reader.readexactly(length)
+        _, offset = unpack_var_int(packet)  # packet type, 0 for pings
+        length, offset = unpack_var_int(packet, offset)  # string length
+        return parse_status(packet[offset : offset + length])
+    except (asyncio.IncompleteReadError, OSError, ValueError):
+        return False
+    finally:
+        writer.close()
+
+
 # For the rest of requests see wiki.vg/Protocol
 def ping_bedrock(ip, port):
     rand = random.Random()
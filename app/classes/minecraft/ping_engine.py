@@ -0,0 +1,161 @@
+import time
+import asyncio
+import logging
+import threading
+import typing as t
+
+from prometheus_client import Histogram
+
+from app.classes.minecraft.mc_ping import ping_async, ping_bedrock
+from app.classes.shared.singleton import Singleton
+
+logger = logging.getLogger(__name__)
+
+PING_ROUND_SECONDS = Histogram(
+    "crafty_ping_round_seconds",
+    "Time taken to ping every watched server once",
+)
+
+# (ip, port, bedrock)
+PingTarget = t.Tuple[str, int, bool]
+
+
+class PingEngine(metaclass=Singleton):
+    """
+    Pings servers from one asyncio loop running on its own thread.
+
+    Every server someone asked about is pinged again every interval seconds,
+    all of them at once and under one shared deadline, so a hung or starting
+    server no longer holds a thread for the whole timeout. Callers get the
+    latest result and only wait for a ping of their own the first time they
+    ask, or when the last result is out of date and no ping is on its way.
+
+    Targets nobody asked about for idle_timeout seconds are dropped.
+    """
+
+    interval = 5
+    timeout = 5
+    idle_timeout = 60
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loop = None
+        # target -> when it was last asked for
+        self.targets: t.Dict[PingTarget, float] = {}
+        # target -> (when the ping finished, ping result)
+        self.results: t.Dict[PingTarget, t.Tuple[float, t.Any]] = {}
+        # target -> ping currently running
+        self.running: t.Dict[PingTarget, asyncio.Task] = {}
+
+    def ping(self, ip, port, bedrock: bool = False):
+        """
+        Latest ping result of ip:port, in the same shape as mc_ping.ping or
+        mc_ping.ping_bedrock return it
+        """
+        target = (ip, int(port), bedrock)
+        now = time.monotonic()
+        self.targets[target] = now
+        result = self.results.get(target)
+        if result is not None and (
+            now - result[0] < self.interval or target in self.running
+        ):
+            # While a new ping is on its way the previous answer still does
+            return result[1]
+
+        future = asyncio.run_coroutine_threadsafe(
+            self.ping_target(target), self.get_loop()
+        )
+        try:
+            return future.result(self.timeout + 1)
+        except Exception as e:
+            logger.debug(f"Ping of {ip}:{port} failed: {e}")
+            return False
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.run, daemon=True, name="mc_ping").start()
+        return self.loop
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.create_task(self.refresh())
+        self.loop.run_forever()
+
+    async def refresh(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.ping_round(self.get_stale_targets())
+            except Exception as e:
+                logger.error(f"Unable to ping servers: {e}")
+
+    def get_stale_targets(self) -> t.List[PingTarget]:
+        now = time.monotonic()
+        # ping() adds targets from other threads, work on a copy
+        targets = list(self.targets.items())
+        for target, asked in targets:
+            if now - asked > self.idle_timeout:
+                self.targets.pop(target, None)
+                self.results.pop(target, None)
+        # Skips whatever a caller had pinged in the meantime
+        return [
+            target
+            for target, asked in targets
+            if now - asked <= self.idle_timeout
+            and now - self.results.get(target, (0, None))[0] >= self.interval / 2
+        ]
+
+    async def ping_round(self, targets: t.List[PingTarget]):
+        if not targets:
+            return
+        start = time.perf_counter()
+        tasks = [self.start_ping(target) for target in targets]
+        # One deadline for the whole round, whatever is left is given up on
+        _done, pending = await asyncio.wait(tasks, timeout=self.timeout)
+        for task in pending:
+            task.cancel()
+        PING_ROUND_SECONDS.observe(time.perf_counter() - start)
+
+    async def ping_target(self, target: PingTarget):
+        task = self.start_ping(target)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.timeout)
+        except asyncio.TimeoutError:
+            task.cancel()
+            return False
+        except asyncio.CancelledError:
+            if task.cancelled():
+                # Given up on by the round it was part of
+                return False
+            raise
+
+    def start_ping(self, target: PingTarget) -> asyncio.Task:
+        # Asking twice for the same server while it is being pinged shares
+        # the ping that is already running
+        task = self.running.get(target)
+        if task is None:
+            task = self.loop.create_task(self.run_ping(target))
+            self.running[target] = task
+        return task
+
+    async def run_ping(self, target: PingTarget):
+        ip, port, bedrock = target
+        result = False
+        try:
+            if bedrock:
+                # RakNet pings are short blocking UDP exchanges
+                result = await self.loop.run_in_executor(None, ping_bedrock, ip, port)
+            else:
+                result = await ping_async(ip, port)
+        except asyncio.CancelledError:
+            logger.debug(f"Ping of {ip}:{port} timed out")
+            raise
+        except Exception as e:
+            logger.debug(f"Unable to ping {ip}:{port}: {e}")
+        finally:
+            self.running.pop(target, None)
+            # A ping that did not finish in time counts as no answer
+            self.results[target] = (time.monotonic(), result)
+        return result
@@ -6,11 +6,16 @@ import datetime
 import base64
 import typing as t
 
-from app.classes.minecraft.mc_ping import ping
-from app.classes.models.management import HostStats
+from app.classes.minecraft.ping_engine import PingEngine
+from app.classes.models.management import (
+    HostStats,
+    HostStatsRollup,
+    HOST_ROLLUP_METRICS,
+)
 from app.classes.models.servers import HelperServers
 from app.classes.shared.null_writer import NullWriter
 from app.classes.shared.helpers import Helpers
+from app.classes.shared.stats_rollups import StatsRollups
 
 with redirect_stderr(NullWriter()):
     import psutil
@@ -233,7 +238,7 @@ class Stats:
 
         logger.debug(f"Pinging {internal_ip} on port {server_port}")
         if HelperServers.get_server_type_by_id(server_id) != "minecraft-bedrock":
-            int_mc_ping = ping(internal_ip, int(server_port))
+            int_mc_ping = PingEngine().ping(internal_ip, server_port)
 
             ping_data = {}
 
@@ -319,8 +324,10 @@ class Stats:
         stats_to_send = self.get_node_stats()
         node_stats = stats_to_send["node_stats"]
 
+        now = datetime.datetime.now()
         HostStats.insert(
             {
+                HostStats.time: now,
                 HostStats.boot_time: node_stats.get("boot_time", "Unknown"),
                 HostStats.cpu_usage: round(node_stats.get("cpu_usage", 0), 2),
                 HostStats.cpu_cores: node_stats.get("cpu_count", 0),
@@ -332,10 +339,25 @@ class Stats:
                 HostStats.disk_json: node_stats.get("disk_data", "{}"),
             }
         ).execute()
+        StatsRollups.add_samples(
+            HostStatsRollup,
+            [
+                (
+                    now,
+                    {
+                        "cpu_usage": node_stats.get("cpu_usage", 0),
+                        "mem_percent": node_stats.get("mem_percent", 0),
+                    },
+                )
+            ],
+            HOST_ROLLUP_METRICS,
+        )
 
         # delete old data
         max_age = self.helper.get_setting("history_max_age")
-        now = datetime.datetime.now()
         minimum_to_exist = now - datetime.timedelta(days=max_age)
 
         HostStats.delete().where(HostStats.time < minimum_to_exist).execute()
+        HostStatsRollup.delete().where(
+            HostStatsRollup.bucket < minimum_to_exist
+        ).execute()
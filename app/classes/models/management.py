@@ -18,6 +18,7 @@ from app.classes.models.servers import Servers
 from app.classes.models.server_permissions import PermissionsServers
 from app.classes.shared.helpers import Helpers
 from app.classes.shared.websocket_manager import WebSocketManager
+from app.classes.shared.stats_rollups import StatsRollups
 
 logger = logging.getLogger(__name__)
 auth_logger = logging.getLogger("audit_log")
@@ -57,6 +58,26 @@ class HostStats(BaseModel):
         table_name = "host_stats"
 
 
+class HostStatsRollup(BaseModel):
+    id = AutoField()
+    resolution = IntegerField()
+    bucket = DateTimeField()
+    samples = IntegerField(default=0)
+    cpu_usage_min = FloatField(default=0)
+    cpu_usage_max = FloatField(default=0)
+    cpu_usage_avg = FloatField(default=0)
+    mem_percent_min = FloatField(default=0)
+    mem_percent_max = FloatField(default=0)
+    mem_percent_avg = FloatField(default=0)
+
+    class Meta:
+        table_name = "host_stats_rollup"
+        indexes = ((("resolution", "bucket"), True),)
+
+
+HOST_ROLLUP_METRICS = ("cpu_usage", "mem_percent")
+
+
 # **********************************************************************************
 #                                   Webhooks Class
 # **********************************************************************************
@@ -111,6 +132,15 @@ class Backups(BaseModel):
     max_backups = IntegerField(default=0)
     server_id = ForeignKeyField(Servers, backref="backups_server")
     compress = BooleanField(default=False)
+    # Threads compressing files, 0 picks one based on the cpu count
+    worker_count = IntegerField(default=0)
+    # "full" writes a complete archive every time, "incremental" only stores
+    # what changed in a content addressed chunk store, see SnapshotStore
+    backup_type = CharField(default="full")
+    # Archive written by full backups, see BackupFormats
+    archive_format = CharField(default="zip")
+    # None uses the default level of the format's codec
+    compression_level = IntegerField(null=True)
     shutdown = BooleanField(default=False)
     before = CharField(default="")
     after = CharField(default="")
@@ -136,6 +166,30 @@ class HelpersManagement:
         query = HostStats.select().order_by(HostStats.id.desc()).get()
         return model_to_dict(query)
 
+    def get_hosts_history(self, num_hours, max_points=None):
+        """
+        Host stats of the last num_hours, raw samples if they fit into
+        max_points and otherwise the finest rollup that does
+        """
+        if max_points is None:
+            max_points = StatsRollups.default_max_points
+        resolution = StatsRollups.pick_resolution(
+            num_hours,
+            max_points,
+            self.helper.get_setting("stats_update_frequency_seconds"),
+        )
+        max_age = datetime.datetime.now() - datetime.timedelta(hours=num_hours)
+        if resolution:
+            return StatsRollups.get_history(
+                HostStatsRollup, resolution, max_age, HOST_ROLLUP_METRICS, "time"
+            )
+        return list(
+            HostStats.select()
+            .where(HostStats.time > max_age)
+            .order_by(HostStats.time)
+            .dicts()
+        )
+
     # **********************************************************************************
     #                                   Audit_Log Methods
     # **********************************************************************************
@@ -363,6 +417,10 @@ class HelpersManagement:
                     "max_backups": backup.max_backups,
                     "server_id": backup.server_id_id,
                     "compress": backup.compress,
+                    "worker_count": backup.worker_count,
+                    "backup_type": backup.backup_type,
+                    "archive_format": backup.archive_format,
+                    "compression_level": backup.compression_level,
                     "shutdown": backup.shutdown,
                     "before": backup.before,
                     "after": backup.after,
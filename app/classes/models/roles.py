@@ -12,6 +12,7 @@ from playhouse.shortcuts import model_to_dict
 
 from app.classes.models.base_model import BaseModel
 from app.classes.shared.helpers import Helpers
+from app.classes.shared.permission_matrix import PermissionMatrix
 
 logger = logging.getLogger(__name__)
 
@@ -86,10 +87,14 @@ class HelperRoles:
 
     @staticmethod
     def update_role(role_id, up_data):
-        return Roles.update(up_data).where(Roles.role_id == role_id).execute()
+        updated = Roles.update(up_data).where(Roles.role_id == role_id).execute()
+        PermissionMatrix().invalidate_role(role_id)
+        return updated
 
     def remove_role(self, role_id):
-        return Roles.delete().where(Roles.role_id == role_id).execute()
+        removed = Roles.delete().where(Roles.role_id == role_id).execute()
+        PermissionMatrix().invalidate_role(role_id)
+        return removed
 
     @staticmethod
     def role_id_exists(role_id) -> bool:
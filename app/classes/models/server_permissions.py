@@ -5,14 +5,16 @@ from peewee import (
     ForeignKeyField,
     CharField,
     CompositeKey,
+    DoesNotExist,
     JOIN,
 )
 
 from app.classes.models.base_model import BaseModel
 from app.classes.models.servers import Servers
 from app.classes.models.roles import Roles
-from app.classes.models.users import UserRoles, HelperUsers, ApiKeys, Users
+from app.classes.models.users import UserRoles, ApiKeys, Users
 from app.classes.shared.permission_helper import PermissionHelper
+from app.classes.shared.permission_matrix import PermissionMatrix
 
 logger = logging.getLogger(__name__)
 
@@ -47,9 +49,11 @@ class EnumPermissionsServer(Enum):
 class PermissionsServers:
     @staticmethod
     def get_or_create(role_id, server, permissions_mask):
-        return RoleServers.get_or_create(
+        role_server = RoleServers.get_or_create(
             role_id=role_id, server_id=server, permissions=permissions_mask
         )
+        PermissionMatrix().invalidate_role(role_id)
+        return role_server
 
     @staticmethod
     def get_permissions_list():
@@ -90,6 +94,38 @@ class PermissionsServers:
             )
         ]
 
+    # **********************************************************************************
+    #                                   Permission Matrix Loaders
+    # **********************************************************************************
+    @staticmethod
+    def load_user_permissions(user_id):
+        try:
+            user = Users.select(Users.superuser).where(Users.user_id == user_id).get()
+        except DoesNotExist:
+            return None
+        roles = (
+            UserRoles.select(UserRoles.role_id)
+            .where(UserRoles.user_id == user_id)
+            .order_by(UserRoles.role_id)
+        )
+        return user.superuser, [str(role.role_id_id) for role in roles]
+
+    @staticmethod
+    def load_role_permissions(role_id):
+        try:
+            role_name = (
+                Roles.select(Roles.role_name).where(Roles.role_id == role_id).get()
+            ).role_name
+        except DoesNotExist:
+            role_name = ""
+        role_servers = RoleServers.select(
+            RoleServers.server_id, RoleServers.permissions
+        ).where(RoleServers.role_id == role_id)
+        return role_name, {
+            str(role_server.server_id_id): role_server.permissions
+            for role_server in role_servers
+        }
+
     # **********************************************************************************
     #                                   Role_Servers Methods
     # **********************************************************************************
@@ -134,6 +170,7 @@ class PermissionsServers:
                 RoleServers.permissions: rs_permissions,
             }
         ).execute()
+        PermissionMatrix().invalidate_role(role_id)
         return servers
 
     @staticmethod
@@ -182,44 +219,38 @@ class PermissionsServers:
         RoleServers.update(permissions=permissions_mask).where(
             RoleServers.role_id == role_id, RoleServers.server_id == server_id
         ).execute()
+        PermissionMatrix().invalidate_role(role_id)
 
     @staticmethod
     def delete_roles_permissions(
         role_id: t.Union[str, int], removed_servers: t.Sequence[t.Union[str, int]]
     ):
-        return (
+        removed = (
             RoleServers.delete()
             .where(RoleServers.role_id == role_id)
             .where(RoleServers.server_id.in_(removed_servers))
             .execute()
         )
+        PermissionMatrix().invalidate_role(role_id)
+        return removed
 
     @staticmethod
     def remove_roles_of_server(server_id):
-        return RoleServers.delete().where(RoleServers.server_id == server_id).execute()
+        removed = (
+            RoleServers.delete().where(RoleServers.server_id == server_id).execute()
+        )
+        PermissionMatrix().invalidate_all()
+        return removed
 
     @staticmethod
     def get_user_id_permissions_mask(user_id, server_id: str):
-        user = HelperUsers.get_user_model(user_id)
-        return PermissionsServers.get_user_permissions_mask(user, server_id)
+        return PermissionMatrix().get_mask(user_id, server_id)
 
     @staticmethod
     def get_user_permissions_mask(user: Users, server_id: str):
         if user.superuser:
-            permissions_mask = "1" * len(EnumPermissionsServer)
-        else:
-            roles_list = HelperUsers.get_user_roles_id(user.user_id)
-            role_server = (
-                RoleServers.select()
-                .where(RoleServers.role_id.in_(roles_list))
-                .where(RoleServers.server_id == server_id)
-                .execute()
-            )
-            try:
-                permissions_mask = role_server[0].permissions
-            except IndexError:
-                permissions_mask = "0" * len(EnumPermissionsServer)
-        return permissions_mask
+            return "1" * len(EnumPermissionsServer)
+        return PermissionMatrix().get_mask(user.user_id, server_id)
 
     @staticmethod
     def get_server_user_list(server_id):
@@ -242,8 +273,9 @@ class PermissionsServers:
 
     @staticmethod
     def get_user_id_permissions_list(user_id, server_id: str):
-        user = HelperUsers.get_user_model(user_id)
-        return PermissionsServers.get_user_permissions_list(user, server_id)
+        return PermissionsServers.get_permissions(
+            PermissionMatrix().get_mask(user_id, server_id)
+        )
 
     @staticmethod
     def get_user_permissions_list(user: Users, server_id: str):
@@ -263,20 +295,15 @@ class PermissionsServers:
 
     @staticmethod
     def get_api_key_permissions_list(key: ApiKeys, server_id: str):
-        user = HelperUsers.get_user(key.user_id)
-        if user["superuser"] and key.full_access:
+        user_id = key.user_id_id
+        superuser = PermissionMatrix().is_superuser(user_id)
+        if superuser and key.full_access:
             return PermissionsServers.get_permissions_list()
-        roles_list = HelperUsers.get_user_roles_id(user["user_id"])
-        role_server = (
-            RoleServers.select()
-            .where(RoleServers.role_id.in_(roles_list))
-            .where(RoleServers.server_id == server_id)
-            .execute()
+        user_permissions_mask = (
+            PermissionMatrix().get_role_masks(user_id).get(str(server_id))
         )
-        try:
-            user_permissions_mask = role_server[0].permissions
-        except:
-            if user["superuser"]:
+        if user_permissions_mask is None:
+            if superuser:
                 user_permissions_mask = "11111111"
             else:
                 user_permissions_mask = "00000000"
@@ -286,3 +313,10 @@ class PermissionsServers:
         )
         permissions_list = PermissionsServers.get_permissions(permissions_mask)
         return permissions_list
+
+
+PermissionMatrix().set_loaders(
+    PermissionsServers.load_user_permissions,
+    PermissionsServers.load_role_permissions,
+    len(EnumPermissionsServer),
+)
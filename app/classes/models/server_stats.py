@@ -1,12 +1,19 @@
 import os
+import time
 import logging
 import datetime
+import threading
+import typing as t
 from datetime import timedelta
 
+from prometheus_client import Gauge, Histogram
+from playhouse.shortcuts import model_to_dict
+
 from app.classes.models.servers import Servers, HelperServers
 from app.classes.shared.helpers import Helpers
-from app.classes.shared.main_models import DatabaseShortcuts
 from app.classes.shared.migration import MigrationManager
+from app.classes.shared.singleton import Singleton
+from app.classes.shared.stats_rollups import StatsRollups
 
 
 try:
@@ -20,7 +27,6 @@ try:
         BooleanField,
         IntegerField,
         FloatField,
-        DoesNotExist,
     )
 
 except ModuleNotFoundError as e:
@@ -30,29 +36,58 @@ logger = logging.getLogger(__name__)
 peewee_logger = logging.getLogger("peewee")
 peewee_logger.setLevel(logging.INFO)
 
+STATS_FLUSH_SECONDS = Histogram(
+    "crafty_stats_flush_seconds",
+    "Time taken to write the buffered samples of one server stats database",
+)
+STATS_QUEUE_DEPTH = Gauge(
+    "crafty_stats_queue_depth", "Server stats samples waiting to be written"
+)
+
 
 # **********************************************************************************
 #                                   Servers Stats Class
 # **********************************************************************************
-class ServerStats(Model):
-    stats_id = AutoField()
+class ServerStatsDetails(Model):
+    """
+    Descriptive values of the samples. They rarely change, so a row is only
+    written when one of them does and samples refer to it.
+    """
+
+    id = AutoField()
     created = DateTimeField(default=datetime.datetime.now)
-    server_id = ForeignKeyField(Servers, backref="server", index=True)
     started = CharField(default="")
-    running = BooleanField(default=False)
-    cpu = FloatField(default=0)
-    mem = FloatField(default=0)
-    mem_percent = FloatField(default=0)
     world_name = CharField(default="")
     world_size = CharField(default="")
     server_port = IntegerField(default=25565)
     int_ping_results = CharField(default="")
-    online = IntegerField(default=0)
-    max = IntegerField(default=0)
     players = CharField(default="")
     desc = CharField(default="Unable to Connect")
-    icon = CharField(default="")
+    icon = CharField(null=True)
     version = CharField(default="")
+
+    class Meta:
+        table_name = "server_stats_details"
+
+
+class ServerStats(Model):
+    stats_id = AutoField()
+    created = DateTimeField(default=datetime.datetime.now, index=True)
+    server_id = ForeignKeyField(Servers, backref="server", index=True)
+    running = BooleanField(default=False)
+    cpu = FloatField(default=0)
+    mem = FloatField(default=0)
+    mem_percent = FloatField(default=0)
+    online = IntegerField(default=0)
+    max = IntegerField(default=0)
+    details = ForeignKeyField(ServerStatsDetails, null=True)
+
+    class Meta:
+        table_name = "server_stats"
+
+
+class ServerStatsState(Model):
+    server_id = CharField(primary_key=True)
     updating = BooleanField(default=False)
     waiting_start = BooleanField(default=False)
     first_run = BooleanField(default=True)
@@ -60,7 +95,47 @@ class ServerStats(Model):
     importing = BooleanField(default=False)
 
     class Meta:
-        table_name = "server_stats"
+        table_name = "server_stats_state"
+
+
+SAMPLE_FIELDS = ("running", "cpu", "mem", "mem_percent", "online", "max")
+DETAIL_FIELDS = (
+    "started",
+    "world_name",
+    "world_size",
+    "server_port",
+    "int_ping_results",
+    "players",
+    "desc",
+    "icon",
+    "version",
+)
+STATE_FIELDS = ("updating", "waiting_start", "first_run", "crashed", "importing")
+
+
+class ServerStatsRollup(Model):
+    id = AutoField()
+    resolution = IntegerField()
+    bucket = DateTimeField()
+    samples = IntegerField(default=0)
+    cpu_min = FloatField(default=0)
+    cpu_max = FloatField(default=0)
+    cpu_avg = FloatField(default=0)
+    mem_percent_min = FloatField(default=0)
+    mem_percent_max = FloatField(default=0)
+    mem_percent_avg = FloatField(default=0)
+    online_min = FloatField(default=0)
+    online_max = FloatField(default=0)
+    online_avg = FloatField(default=0)
+
+    class Meta:
+        table_name = "server_stats_rollup"
+        indexes = ((("resolution", "bucket"), True),)
+
+
+ROLLUP_METRICS = ("cpu", "mem_percent", "online")
+# Seconds between two raw samples, see ServerInstance.record_server_stats
+SAMPLE_INTERVAL = 30
 
 
 # **********************************************************************************
@@ -98,7 +173,11 @@ class HelperServerStats:
             )
             helper_stats.db_path = db_file
             migration_manager = MigrationManager(self.database, helper_stats)
-            migration_manager.up()  # Automatically runs migrations
+            done = migration_manager.up()  # Automatically runs migrations
+            if "20240524_split_server_stats" in done:
+                # Give back the space of the descriptive columns
+                self.database.execute_sql("VACUUM")
+                self.database.close()
         except Exception as ex:
             logger.warning(
                 f"Error try to look for the db_stats files for server : {ex}"
@@ -143,54 +222,75 @@ class HelperServerStats:
         self.database.close()
         return server_data
 
-    def get_history_stats(self, server_id, num_hours):
+    def get_history_stats(self, server_id, num_hours, max_points=None):
+        """
+        Stats of the last num_hours, raw samples if they fit into max_points
+        and otherwise the finest rollup that does
+        """
+        if max_points is None:
+            max_points = StatsRollups.default_max_points
+        resolution = StatsRollups.pick_resolution(
+            num_hours, max_points, SAMPLE_INTERVAL
+        )
         self.database.connect(reuse_if_open=True)
         max_age = datetime.datetime.now() - timedelta(hours=num_hours)
-        query_stats = (
-            ServerStats.select()
-            .where(ServerStats.created > max_age)
-            .where(ServerStats.server_id == server_id)
-            # .order_by(ServerStats.created.desc())
-            .execute(self.database)
-        )
-        server_stats = []
-        for stat in query_stats:
-            server_stats.append(DatabaseShortcuts.get_data_obj(stat))
+        if resolution:
+            server_stats = StatsRollups.get_history(
+                ServerStatsRollup,
+                resolution,
+                max_age,
+                ROLLUP_METRICS,
+                "created",
+                self.database,
+            )
+        else:
+            server_stats = list(
+                ServerStats.select(
+                    ServerStats.created,
+                    ServerStats.server_id,
+                    *[getattr(ServerStats, field) for field in SAMPLE_FIELDS],
+                )
+                .where(ServerStats.created > max_age)
+                .where(ServerStats.server_id == server_id)
+                .order_by(ServerStats.created)
+                .dicts()
+                .execute(self.database)
+            )
         self.database.close()
         return server_stats
 
     def insert_server_stats(self, server_stats):
-        self.database.connect(reuse_if_open=True)
         server_id = server_stats.get("id", 0)
 
         if server_id == 0:
             logger.warning("Stats saving failed with error: Server unknown (id = 0)")
             return
 
-        ServerStats.insert(
+        StatsWriter().submit(
+            self.database.database,
             {
-                ServerStats.server_id: server_stats.get("id", 0),
-                ServerStats.started: server_stats.get("started", ""),
-                ServerStats.running: server_stats.get("running", False),
-                ServerStats.cpu: server_stats.get("cpu", 0),
-                ServerStats.mem: server_stats.get("mem", 0),
-                ServerStats.mem_percent: server_stats.get("mem_percent", 0),
-                ServerStats.world_name: server_stats.get("world_name", ""),
-                ServerStats.world_size: server_stats.get("world_size", ""),
-                ServerStats.server_port: server_stats.get("server_port", 0),
-                ServerStats.int_ping_results: server_stats.get(
-                    "int_ping_results", False
-                ),
-                ServerStats.online: server_stats.get("online", False),
-                ServerStats.max: server_stats.get("max", False),
-                ServerStats.players: server_stats.get("players", False),
-                ServerStats.desc: server_stats.get("desc", False),
-                ServerStats.icon: server_stats.get("icon", None),
-                ServerStats.version: server_stats.get("version", False),
-            }
-        ).execute(self.database)
+                "created": datetime.datetime.now(),
+                "server_id": server_stats.get("id", 0),
+                "started": server_stats.get("started", ""),
+                "running": server_stats.get("running", False),
+                "cpu": server_stats.get("cpu", 0),
+                "mem": server_stats.get("mem", 0),
+                "mem_percent": server_stats.get("mem_percent", 0),
+                "world_name": server_stats.get("world_name", ""),
+                "world_size": server_stats.get("world_size", ""),
+                "server_port": server_stats.get("server_port", 0),
+                "int_ping_results": server_stats.get("int_ping_results", False),
+                "online": server_stats.get("online", False),
+                "max": server_stats.get("max", False),
+                "players": server_stats.get("players", False),
+                "desc": server_stats.get("desc", False),
+                "icon": server_stats.get("icon", None),
+                "version": server_stats.get("version", False),
+            },
+        )
 
-        self.database.close()
+    def discard_pending_stats(self):
+        StatsWriter().forget(self.database.database)
 
     def remove_old_stats(self, last_week):
         self.database.connect(reuse_if_open=True)
@@ -200,157 +300,137 @@ class HelperServerStats:
         )
         self.database.close()
 
-    def get_latest_server_stats(self):
+    def build_stats(self, sample: ServerStats, details=None) -> dict:
+        """Puts a sample back together with its details and the server state"""
+        stats = model_to_dict(sample, exclude=[ServerStats.details])
+        if details is None:
+            details = (
+                ServerStatsDetails.select()
+                .where(ServerStatsDetails.id == sample.details_id)
+                .first(self.database)
+            )
+        if details is None:
+            details = ServerStatsDetails()
+        for field in DETAIL_FIELDS:
+            stats[field] = getattr(details, field)
+        state = self.get_state()
+        for field in STATE_FIELDS:
+            stats[field] = getattr(state, field)
+        return stats
+
+    def get_latest_stats(self) -> dict:
+        """
+        Latest sample, including the ones the writer has yet to flush. A server
+        without any sample gets the defaults.
+        """
+        row = StatsWriter().get_latest_pending(self.database.database)
         self.database.connect(reuse_if_open=True)
-        latest = (
-            ServerStats.select()
-            .where(ServerStats.server_id == self.server_id)
-            .order_by(ServerStats.created.desc())
-            .limit(1)
-            .get(self.database)
-        )
-
-        self.database.close()
         try:
-            return DatabaseShortcuts.get_data_obj(latest)
-        except IndexError:
-            return {}
+            if row is not None:
+                sample = ServerStats(
+                    created=row["created"],
+                    server_id=self.server_id,
+                    **{field: row[field] for field in SAMPLE_FIELDS},
+                )
+                details = ServerStatsDetails(
+                    **{field: row[field] for field in DETAIL_FIELDS}
+                )
+                return self.build_stats(sample, details)
+
+            sample = (
+                ServerStats.select()
+                .where(ServerStats.server_id == self.server_id)
+                .order_by(ServerStats.created.desc())
+                .limit(1)
+                .first(self.database)
+            )
+            if sample is None:
+                sample = ServerStats(server_id=self.server_id)
+            return self.build_stats(sample)
+        finally:
+            self.database.close()
+
+    def get_latest_server_stats(self):
+        return self.get_latest_stats()
 
     def get_server_stats(self):
-        self.database.connect(reuse_if_open=True)
-        stats = (
-            ServerStats.select()
-            .where(ServerStats.server_id == self.server_id)
-            .order_by(ServerStats.created.desc())
-            .limit(1)
-            .first(self.database)
-        )
-        self.database.close()
-        return DatabaseShortcuts.get_data_obj(stats)
+        return self.get_latest_stats()
 
     def server_id_exists(self):
         if not HelperServers.get_server_data_by_id(self.server_id):
             return False
         return True
 
-    def sever_crashed(self):
+    # **********************************************************************************
+    #                                   Server State
+    # **********************************************************************************
+    def get_state(self) -> ServerStatsState:
         self.database.connect(reuse_if_open=True)
-        ServerStats.update(crashed=True).where(
-            ServerStats.server_id == self.server_id
-        ).execute(self.database)
-        self.database.close()
+        state = (
+            ServerStatsState.select()
+            .where(ServerStatsState.server_id == self.server_id)
+            .first(self.database)
+        )
+        # Nothing has been set yet, everything is at its default
+        return state or ServerStatsState(server_id=self.server_id)
+
+    def set_state(self, **values):
+        if self.server_id is None:
+            return
 
-    def set_import(self):
         self.database.connect(reuse_if_open=True)
-        ServerStats.update(importing=True).where(
-            ServerStats.server_id == self.server_id
+        ServerStatsState.insert(server_id=self.server_id, **values).on_conflict(
+            conflict_target=[ServerStatsState.server_id], update=values
         ).execute(self.database)
         self.database.close()
 
+    def get_state_value(self, field: str):
+        try:
+            return getattr(self.get_state(), field)
+        finally:
+            self.database.close()
+
+    def sever_crashed(self):
+        self.set_state(crashed=True)
+
+    def set_import(self):
+        self.set_state(importing=True)
+
     def finish_import(self):
-        self.database.connect(reuse_if_open=True)
-        ServerStats.update(importing=False).where(
-            ServerStats.server_id == self.server_id
-        ).execute(self.database)
-        self.database.close()
+        self.set_state(importing=False)
 
     def get_import_status(self):
-        self.database.connect(reuse_if_open=True)
-        import_status = (
-            ServerStats.select()
-            .where(ServerStats.server_id == self.server_id)
-            .get(self.database)
-        )
-        self.database.close()
-        return import_status.importing
+        return self.get_state_value("importing")
 
     def server_crash_reset(self):
-        if self.server_id is None:
-            return
-
-        self.database.connect(reuse_if_open=True)
-        ServerStats.update(crashed=False).where(
-            ServerStats.server_id == self.server_id
-        ).execute(self.database)
-        self.database.close()
+        self.set_state(crashed=False)
 
     def is_crashed(self):
-        self.database.connect(reuse_if_open=True)
-        svr: ServerStats = (
-            ServerStats.select()
-            .where(ServerStats.server_id == self.server_id)
-            .get(self.database)
-        )
-        self.database.close()
-        return svr.crashed
+        return self.get_state_value("crashed")
 
     def set_update(self, value):
-        if self.server_id is None:
-            return
-
-        self.database.connect(reuse_if_open=True)
-        try:
-            # Checks if server even exists
-            ServerStats.select().where(ServerStats.server_id == self.server_id).execute(
-                self.database
-            )
-        except DoesNotExist as ex:
-            logger.error(f"Database entry not found! {ex}")
-            self.database.close()
-            return
-
-        ServerStats.update(updating=value).where(
-            ServerStats.server_id == self.server_id
-        ).execute(self.database)
-        self.database.close()
+        self.set_state(updating=value)
 
     def get_update_status(self):
-        self.database.connect(reuse_if_open=True)
-        update_status = (
-            ServerStats.select()
-            .where(ServerStats.server_id == self.server_id)
-            .get(self.database)
-        )
-        self.database.close()
-        return update_status.updating
+        return self.get_state_value("updating")
 
     def set_first_run(self):
-        self.database.connect(reuse_if_open=True)
         # Sets first run to false
-        try:
-            # Checks if server even exists
-            ServerStats.select().where(ServerStats.server_id == self.server_id).execute(
-                self.database
-            )
-        except Exception as ex:
-            logger.error(f"Database entry not found! {ex}")
-            self.database.close()
-            return
-        ServerStats.update(first_run=False).where(
-            ServerStats.server_id == self.server_id
-        ).execute(self.database)
-        self.database.close()
+        self.set_state(first_run=False)
 
     def get_first_run(self):
-        self.database.connect(reuse_if_open=True)
-        first_run = (
-            ServerStats.select()
-            .where(ServerStats.server_id == self.server_id)
-            .get(self.database)
-        )
-        self.database.close()
-        return first_run.first_run
+        return self.get_state_value("first_run")
 
     def get_ttl_without_player(self):
         self.database.connect(reuse_if_open=True)
         last_stat = (
-            ServerStats.select()
+            ServerStats.select(ServerStats.created)
             .where(ServerStats.server_id == self.server_id)
             .order_by(ServerStats.created.desc())
             .first(self.database)
         )
         last_stat_with_player = (
-            ServerStats.select()
+            ServerStats.select(ServerStats.created)
             .where(ServerStats.server_id == self.server_id)
             .where(ServerStats.online > 0)
             .order_by(ServerStats.created.desc())
@@ -364,27 +444,196 @@ class HelperServerStats:
         return (time_limit == -1) or (ttl_no_players > time_limit)
 
     def set_waiting_start(self, value):
-        self.database.connect(reuse_if_open=True)
-        try:
-            # Checks if server even exists
-            ServerStats.select().where(ServerStats.server_id == self.server_id).execute(
-                self.database
-            )
-        except DoesNotExist as ex:
-            logger.error(f"Database entry not found! {ex}")
-            self.database.close()
-            return
-        ServerStats.update(waiting_start=value).where(
-            ServerStats.server_id == self.server_id
-        ).execute(self.database)
-        self.database.close()
+        self.set_state(waiting_start=value)
 
     def get_waiting_start(self):
-        self.database.connect(reuse_if_open=True)
-        waiting_start = (
-            ServerStats.select()
-            .where(ServerStats.server_id == self.server_id)
-            .get(self.database)
+        return self.get_state_value("waiting_start")
+
+
+# **********************************************************************************
+#                                   Stats Writer
+# **********************************************************************************
+class StatsWriter(metaclass=Singleton):
+    """
+    Buffers server stats samples and writes them in one transaction per
+    stats database every flush_interval seconds.
+
+    The writer thread keeps its connections open instead of opening and
+    closing the database for every sample, and old samples are removed by an
+    hourly sweep rather than after every insert.
+    """
+
+    flush_interval = 60
+    sweep_interval = 60 * 60
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Held while writing, flush() is also called from the shutdown thread
+        # and the details below belong to whoever holds it
+        self.flush_lock = threading.Lock()
+        # database file -> buffered rows
+        self.pending: t.Dict[str, t.List[dict]] = {}
+        # database file -> connection used by the writer thread
+        self.databases: t.Dict[str, SqliteDatabase] = {}
+        # database file -> (descriptive fields, id) of the latest details row
+        self.details: t.Dict[str, t.Tuple[tuple, int]] = {}
+        self.forgotten: t.List[SqliteDatabase] = []
+        self.history_max_age = 7
+        # Old samples are swept once right after startup
+        self.last_sweep = None
+        self.wake = threading.Event()
+        self.thread = None
+
+    def follow_settings(self, helper):
+        self.history_max_age = helper.get_setting(
+            "history_max_age", self.history_max_age
         )
-        self.database.close()
-        return waiting_start.waiting_start
+        helper.subscribe_settings(self.on_settings_changed, ["history_max_age"])
+
+    def on_settings_changed(self, changed: dict):
+        self.history_max_age = changed["history_max_age"]
+
+    def submit(self, db_file: str, row: dict):
+        with self.lock:
+            self.pending.setdefault(db_file, []).append(row)
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, daemon=True, name="stats_writer"
+                )
+                self.thread.start()
+        STATS_QUEUE_DEPTH.inc()
+
+    def get_latest_pending(self, db_file: str) -> t.Optional[dict]:
+        """Newest sample of a database that has not been written yet"""
+        with self.lock:
+            rows = self.pending.get(db_file)
+            return dict(rows[-1]) if rows else None
+
+    def forget(self, db_file: str):
+        with self.flush_lock, self.lock:
+            rows = self.pending.pop(db_file, [])
+            database = self.databases.pop(db_file, None)
+            self.details.pop(db_file, None)
+            # Connections belong to the writer thread, it closes them
+            if database is not None:
+                self.forgotten.append(database)
+        STATS_QUEUE_DEPTH.dec(len(rows))
+
+    def run(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush()
+            with self.lock:
+                forgotten, self.forgotten = self.forgotten, []
+            for database in forgotten:
+                database.close()
+            if (
+                self.last_sweep is None
+                or time.monotonic() - self.last_sweep >= self.sweep_interval
+            ):
+                self.last_sweep = time.monotonic()
+                with self.flush_lock:
+                    self.sweep()
+
+    def get_database(self, db_file: str) -> SqliteDatabase:
+        with self.lock:
+            database = self.databases.get(db_file)
+            if database is None:
+                database = SqliteDatabase(
+                    db_file, pragmas={"journal_mode": "wal", "cache_size": -1024 * 10}
+                )
+                self.databases[db_file] = database
+        return database
+
+    def flush(self):
+        with self.flush_lock:
+            self.write_pending()
+
+    def write_pending(self):
+        with self.lock:
+            batches, self.pending = self.pending, {}
+        for path, rows in batches.items():
+            start = time.perf_counter()
+            try:
+                database = self.get_database(path)
+                database.connect(reuse_if_open=True)
+                with database.atomic():
+                    self.write_samples(path, rows, database)
+            except Exception as ex:
+                # The details row may not have made it, look it up again
+                self.details.pop(path, None)
+                logger.warning(
+                    f"Unable to save {len(rows)} stats samples to {path}: {ex}"
+                )
+            finally:
+                STATS_QUEUE_DEPTH.dec(len(rows))
+                STATS_FLUSH_SECONDS.observe(time.perf_counter() - start)
+
+    def write_samples(self, path: str, rows: t.List[dict], database: SqliteDatabase):
+        """
+        Descriptive fields rarely change between samples, a new details row is
+        only written when they do and samples point at the current one.
+        """
+        current = self.details.get(path)
+        if current is None:
+            latest = (
+                ServerStatsDetails.select()
+                .order_by(ServerStatsDetails.id.desc())
+                .first(database)
+            )
+            if latest is not None:
+                current = (
+                    tuple(getattr(latest, field) for field in DETAIL_FIELDS),
+                    latest.id,
+                )
+
+        samples = []
+        for row in rows:
+            details = tuple(row[field] for field in DETAIL_FIELDS)
+            if current is None or current[0] != details:
+                details_id = ServerStatsDetails.insert(
+                    created=row["created"], **dict(zip(DETAIL_FIELDS, details))
+                ).execute(database)
+                current = (details, details_id)
+            sample = {field: row[field] for field in SAMPLE_FIELDS}
+            sample["created"] = row["created"]
+            sample["server_id"] = row["server_id"]
+            sample["details"] = current[1]
+            samples.append(sample)
+        ServerStats.insert_many(samples).execute(database)
+        self.details[path] = current
+
+        StatsRollups.add_samples(
+            ServerStatsRollup,
+            ((row["created"], row) for row in rows),
+            ROLLUP_METRICS,
+            database,
+        )
+
+    def sweep(self):
+        minimum_to_exist = datetime.datetime.now() - timedelta(
+            days=self.history_max_age
+        )
+        with self.lock:
+            databases = list(self.databases.items())
+        for path, database in databases:
+            try:
+                database.connect(reuse_if_open=True)
+                ServerStats.delete().where(
+                    ServerStats.created < minimum_to_exist
+                ).execute(database)
+                ServerStatsRollup.delete().where(
+                    ServerStatsRollup.bucket < minimum_to_exist
+                ).execute(database)
+                ServerStatsDetails.delete().where(
+                    ServerStatsDetails.id.not_in(
+                        ServerStats.select(ServerStats.details).where(
+                            ServerStats.details.is_null(False)
+                        )
+                    )
+                ).execute(database)
+                # The latest details row may have gone with the old samples
+                self.details.pop(path, None)
+            except Exception as ex:
+                logger.warning(f"Unable to remove old stats from {path}: {ex}")
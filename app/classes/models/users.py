@@ -16,6 +16,8 @@ from peewee import (
 from playhouse.shortcuts import model_to_dict
 
 from app.classes.shared.helpers import Helpers
+from app.classes.shared.auth_cache import AuthCache
+from app.classes.shared.permission_matrix import PermissionMatrix
 from app.classes.models.base_model import BaseModel
 from app.classes.models.roles import Roles, HelperRoles
 
@@ -264,12 +266,15 @@ class HelperUsers:
             up_data = {}
         if up_data:
             Users.update(up_data).where(Users.user_id == user_id).execute()
+            AuthCache().invalidate_user(user_id)
+            PermissionMatrix().invalidate_user(user_id)
 
     @staticmethod
     def update_server_order(user_id, user_server_order):
         Users.update(server_order=user_server_order).where(
             Users.user_id == user_id
         ).execute()
+        AuthCache().invalidate_user(user_id)
 
     @staticmethod
     def get_server_order(user_id):
@@ -289,27 +294,34 @@ class HelperUsers:
     def remove_user(self, user_id):
         with self.database.atomic():
             UserRoles.delete().where(UserRoles.user_id == user_id).execute()
-            return Users.delete().where(Users.user_id == user_id).execute()
+            removed = Users.delete().where(Users.user_id == user_id).execute()
+        AuthCache().invalidate_user(user_id)
+        PermissionMatrix().invalidate_user(user_id)
+        return removed
 
     @staticmethod
     def set_support_path(user_id, support_path):
         Users.update(support_logs=support_path).where(
             Users.user_id == user_id
         ).execute()
+        AuthCache().invalidate_user(user_id)
 
     @staticmethod
     def set_prepare(user_id):
         Users.update(preparing=True).where(Users.user_id == user_id).execute()
+        AuthCache().invalidate_user(user_id)
 
     @staticmethod
     def stop_prepare(user_id):
         Users.update(preparing=False).where(Users.user_id == user_id).execute()
+        AuthCache().invalidate_user(user_id)
 
     @staticmethod
     def clear_support_status():
         Users.update(preparing=False).where(
             Users.preparing == True  # pylint: disable=singleton-comparison
         ).execute()
+        AuthCache().clear()
 
     @staticmethod
     def user_id_exists(user_id):
@@ -321,7 +333,10 @@ class HelperUsers:
 
     @staticmethod
     def get_or_create(user_id, role_id):
-        return UserRoles.get_or_create(user_id=user_id, role_id=role_id)
+        user_role = UserRoles.get_or_create(user_id=user_id, role_id=role_id)
+        AuthCache().invalidate_user(user_id)
+        PermissionMatrix().invalidate_user(user_id)
+        return user_role
 
     @staticmethod
     def get_user_roles_id(user_id):
@@ -343,6 +358,8 @@ class HelperUsers:
         UserRoles.insert(
             {UserRoles.user_id: user_id, UserRoles.role_id: role_id}
         ).execute()
+        AuthCache().invalidate_user(user_id)
+        PermissionMatrix().invalidate_user(user_id)
 
     @staticmethod
     def add_user_roles(user: t.Union[dict, Users]):
@@ -382,10 +399,14 @@ class HelperUsers:
         UserRoles.delete().where(UserRoles.user_id == user_id).where(
             UserRoles.role_id.in_(removed_roles)
         ).execute()
+        AuthCache().invalidate_user(user_id)
+        PermissionMatrix().invalidate_user(user_id)
 
     @staticmethod
     def remove_roles_from_role_id(role_id):
         UserRoles.delete().where(UserRoles.role_id == role_id).execute()
+        AuthCache().clear()
+        PermissionMatrix().invalidate_all()
 
     @staticmethod
     def get_users_from_role(role_id):
@@ -432,7 +453,9 @@ class HelperUsers:
     @staticmethod
     def delete_user_api_keys(user_id: str):
         ApiKeys.delete().where(ApiKeys.user_id == user_id).execute()
+        AuthCache().invalidate_user(user_id)
 
     @staticmethod
     def delete_user_api_key(key_id: str):
         ApiKeys.delete().where(ApiKeys.token_id == key_id).execute()
+        AuthCache().invalidate_api_key(key_id)
@@ -0,0 +1,95 @@
+import copy
+import time
+import logging
+import threading
+import collections
+
+from prometheus_client import Counter
+
+from app.classes.shared.singleton import Singleton
+
+logger = logging.getLogger(__name__)
+
+AUTH_CACHE_HITS = Counter(
+    "crafty_auth_cache_hits", "Token checks answered from the authentication cache"
+)
+AUTH_CACHE_MISSES = Counter(
+    "crafty_auth_cache_misses", "Token checks that had to decode and query the DB"
+)
+
+
+class AuthCache(metaclass=Singleton):
+    """
+    Bounded LRU cache of successful Authentication.check() results keyed by
+    token. Entries expire after ttl seconds and are dropped explicitly by the
+    model helpers whenever the user, its roles or its API keys change.
+    """
+
+    ttl = 60
+    max_entries = 2048
+
+    def __init__(self):
+        # token -> (expires_at, user_id, key_id, result)
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(token)
+                self.hits += 1
+                AUTH_CACHE_HITS.inc()
+                result = entry[3]
+            else:
+                if entry is not None:
+                    del self.entries[token]
+                self.misses += 1
+                AUTH_CACHE_MISSES.inc()
+                return None
+        # Callers are free to modify what they get back
+        key, data, user = result
+        return key, copy.deepcopy(data), copy.deepcopy(user)
+
+    def put(self, token: str, result):
+        key, data, user = result
+        key_id = getattr(key, "token_id", None) if key is not None else None
+        entry = (
+            time.monotonic() + self.ttl,
+            str(user["user_id"]),
+            None if key_id is None else str(key_id),
+            (key, copy.deepcopy(data), copy.deepcopy(user)),
+        )
+        with self.lock:
+            self.entries[token] = entry
+            self.entries.move_to_end(token)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        user_id = str(user_id)
+        with self.lock:
+            for token in [tok for tok, e in self.entries.items() if e[1] == user_id]:
+                del self.entries[token]
+        logger.debug(f"Dropped cached authentication of user {user_id}")
+
+    def invalidate_api_key(self, key_id):
+        key_id = str(key_id)
+        with self.lock:
+            for token in [tok for tok, e in self.entries.items() if e[2] == key_id]:
+                del self.entries[token]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
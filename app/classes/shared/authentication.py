@@ -6,6 +6,7 @@ import jwt
 from jwt import PyJWTError
 
 from app.classes.models.users import HelperUsers, ApiKeys
+from app.classes.shared.auth_cache import AuthCache
 from app.classes.controllers.management_controller import ManagementController
 
 logger = logging.getLogger(__name__)
@@ -47,8 +48,12 @@ class Authentication:
         self,
         token,
     ) -> Optional[Tuple[Optional[ApiKeys], Dict[str, Any], Dict[str, Any]]]:
+        token = str(token)
+        cached = AuthCache().get(token)
+        if cached is not None:
+            return cached
         try:
-            data = jwt.decode(str(token), self.secret, algorithms=["HS256"])
+            data = jwt.decode(token, self.secret, algorithms=["HS256"])
         except PyJWTError as error:
             logger.debug("Error while checking JWT token: ", exc_info=error)
             return None
@@ -61,8 +66,6 @@ class Authentication:
                 return None
         user_id: str = data["user_id"]
         user = HelperUsers.get_user(user_id)
-        # TODO: Have a cache or something so we don't constantly
-        # have to query the database
         valid_tokens_from_str = user.get("valid_tokens_from")
         # It's possible this will be a string or a dt coming from the DB
         # We need to account for that
@@ -74,7 +77,8 @@ class Authentication:
             valid_tokens_from_dt = valid_tokens_from_str
         # Convert the string to a datetime object
         if int(valid_tokens_from_dt.timestamp()) < iat:
-            # Success!
+            # Success! Remember it so the next request skips the DB
+            AuthCache().put(token, (key, data, user))
             return key, data, user
         return None
 
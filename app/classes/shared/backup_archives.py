@@ -0,0 +1,199 @@
+import os
+import logging
+import tarfile
+import zipfile
+import typing as t
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+from app.classes.shared.zip_archiver import ParallelZipExtractor, ParallelZipWriter
+from app.classes.shared.backup_manifest import ManifestEntry
+
+try:
+    import zstandard
+except ModuleNotFoundError:
+    # Optional, the tar.zst format is unavailable without it
+    zstandard = None  # pylint: disable=invalid-name
+
+logger = logging.getLogger(__name__)
+
+Entries = t.Iterable[ManifestEntry]
+
+
+class ZipBackupFormat:
+    name = "zip"
+    extension = ".zip"
+    # Levels zlib accepts, 0 stores the deflate stream uncompressed
+    min_level = 0
+    max_level = 9
+
+    @staticmethod
+    def is_available() -> bool:
+        return True
+
+    @staticmethod
+    def write_entries(
+        path_to_destination: str,
+        entries: Entries,
+        comment: str = "",
+        compressed: bool = False,
+        level: t.Optional[int] = None,
+        workers: int = 0,
+    ) -> t.Iterator[ManifestEntry]:
+        # Set the compression mode based on the `compressed` parameter
+        compression_mode = ZIP_DEFLATED if compressed else ZIP_STORED
+        # Configs saved before the level was checked per format may be out of range
+        level = BackupFormats.clamp_level(ZipBackupFormat, level)
+        # 0 picks a worker count based on the available cores
+        if not workers:
+            workers = ParallelZipWriter.get_default_workers()
+        with ZipFile(
+            path_to_destination, "w", compression_mode, compresslevel=level
+        ) as zip_file:
+            zip_file.comment = bytes(
+                comment, "utf-8"
+            )  # comments over 65535 bytes will be truncated
+            writer = ParallelZipWriter(zip_file, workers, level)
+            yield from writer.write_entries(entries)
+        BackupFormats.check_failed(writer.failed)
+
+    @staticmethod
+    def extract(archive_path: str, target_dir: str, progress=None):
+        with zipfile.ZipFile(archive_path, "r") as zip_ref:
+            # extracts archive to temp directory
+            ParallelZipExtractor(zip_ref).extract(target_dir, progress=progress)
+
+
+class TarZstdBackupFormat:
+    """
+    Streams a tar archive through a multi threaded zstd compressor straight
+    to disk. Compresses faster and smaller than deflate at the default level.
+    """
+
+    name = "tar.zst"
+    extension = ".tar.zst"
+    default_level = 3
+    min_level = 1
+    max_level = 22
+
+    @staticmethod
+    def is_available() -> bool:
+        return zstandard is not None
+
+    @staticmethod
+    def write_entries(
+        path_to_destination: str,
+        entries: Entries,
+        comment: str = "",
+        compressed: bool = True,  # pylint: disable=unused-argument
+        level: t.Optional[int] = None,
+        workers: int = 0,
+    ) -> t.Iterator[ManifestEntry]:
+        level = BackupFormats.clamp_level(TarZstdBackupFormat, level)
+        if not workers:
+            workers = ParallelZipWriter.get_default_workers()
+        failed = []
+        compressor = zstandard.ZstdCompressor(
+            level=TarZstdBackupFormat.default_level if level is None else level,
+            # zstd counts the calling thread separately
+            threads=workers if workers > 1 else 0,
+        )
+        with open(path_to_destination, "wb") as f, compressor.stream_writer(
+            f, closefd=False
+        ) as stream, tarfile.open(
+            fileobj=stream,
+            mode="w|",
+            format=tarfile.PAX_FORMAT,
+            pax_headers={"comment": comment},
+        ) as tar:
+            for entry in entries:
+                try:
+                    logger.debug(f"backing up: {entry.path}")
+                    tar.add(entry.path, entry.arcname, recursive=False)
+                except Exception as e:
+                    logger.warning(f"Error backing up: {entry.path}! - Error was: {e}")
+                    failed.append(entry.path)
+                yield entry
+        BackupFormats.check_failed(failed)
+
+    @staticmethod
+    def extract(
+        archive_path: str, target_dir: str, progress=None
+    ):  # pylint: disable=unused-argument
+        if zstandard is None:
+            raise RuntimeError(
+                "The zstandard module is required to restore tar.zst backups"
+            )
+        with open(archive_path, "rb") as f, zstandard.ZstdDecompressor().stream_reader(
+            f
+        ) as stream, tarfile.open(fileobj=stream, mode="r|") as tar:
+            if hasattr(tarfile, "data_filter"):
+                tar.extractall(target_dir, filter="data")
+                return
+            # Older interpreters without extraction filters
+            target_dir = os.path.abspath(target_dir)
+            for member in tar:
+                path = os.path.abspath(os.path.join(target_dir, member.name))
+                if (
+                    os.path.commonpath([target_dir, path]) != target_dir
+                    or member.issym()
+                    or member.islnk()
+                    or not (member.isfile() or member.isdir())
+                ):
+                    logger.warning(f"Skipping unsafe backup member {member.name}")
+                    continue
+                tar.extract(member, target_dir)
+
+
+class BackupFormats:
+    formats = {
+        ZipBackupFormat.name: ZipBackupFormat,
+        TarZstdBackupFormat.name: TarZstdBackupFormat,
+    }
+
+    @staticmethod
+    def get(name: str):
+        archive_format = BackupFormats.formats.get(name, ZipBackupFormat)
+        if not archive_format.is_available():
+            logger.warning(
+                f"Backup format {name} is not available on this install, "
+                f"falling back to zip"
+            )
+            return ZipBackupFormat
+        return archive_format
+
+    @staticmethod
+    def is_valid_level(name: str, level: t.Optional[int]) -> bool:
+        """None always is, it stands for the default level of the codec"""
+        archive_format = BackupFormats.formats.get(name, ZipBackupFormat)
+        return level is None or (
+            archive_format.min_level <= level <= archive_format.max_level
+        )
+
+    @staticmethod
+    def clamp_level(archive_format, level: t.Optional[int]) -> t.Optional[int]:
+        if level is None:
+            return None
+        clamped = min(max(level, archive_format.min_level), archive_format.max_level)
+        if clamped != level:
+            logger.warning(
+                f"Compression level {level} is out of range for "
+                f"{archive_format.name} backups, using {clamped}"
+            )
+        return clamped
+
+    @staticmethod
+    def check_failed(failed: t.List[str]):
+        # A backup missing files must not look like a good one
+        if failed:
+            raise RuntimeError(
+                f"{len(failed)} file(s) could not be backed up, "
+                f"first was {failed[0]}"
+            )
+
+    @staticmethod
+    def for_file(filename: str):
+        """Returns the format a backup file was written in, None if unknown"""
+        for archive_format in BackupFormats.formats.values():
+            if str(filename).endswith(archive_format.extension):
+                return archive_format
+        return None
@@ -0,0 +1,87 @@
+import os
+import logging
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+
+class ManifestEntry(t.NamedTuple):
+    path: str
+    arcname: str
+    size: int
+    mtime_ns: int
+
+
+class BackupManifest:
+    """
+    Everything a backup is going to contain, collected in a single pass over
+    the server directory.
+
+    Every file is stat'ed exactly once while scanning, the archivers and the
+    progress reporting work off the recorded sizes and times instead of
+    going back to the disk. Excluded directories are pruned as soon as they
+    are reached so nothing below them is ever listed.
+    """
+
+    # Never part of a backup, wherever it shows up
+    ignored_names = {"crafty.sqlite"}
+
+    def __init__(self, entries: t.List[ManifestEntry]):
+        self.entries = entries
+        self.total_size = sum(entry.size for entry in entries)
+
+    def __iter__(self) -> t.Iterator[ManifestEntry]:
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @staticmethod
+    def normalize(path: str) -> str:
+        # make all paths a unix style slash to match exclusions
+        return str(path).replace("\\", "/").rstrip("/")
+
+    @staticmethod
+    def scan(root_dir: str, excluded: t.Iterable[str] = ()) -> "BackupManifest":
+        excluded = {BackupManifest.normalize(p) for p in excluded}
+        # Cut off to turn a full path into its name in the archive
+        prefix_length = len(os.path.join(root_dir, ""))
+        entries = []
+        pending = [root_dir]
+        while pending:
+            current = pending.pop()
+            try:
+                with os.scandir(current) as it:
+                    dir_entries = list(it)
+            except OSError as e:
+                logger.warning(f"Unable to list {current} for backup: {e}")
+                continue
+            for dir_entry in dir_entries:
+                if excluded and BackupManifest.normalize(dir_entry.path) in excluded:
+                    logger.debug(
+                        f"Found {dir_entry.path} in exclusion list. Skipping..."
+                    )
+                    continue
+                try:
+                    if dir_entry.is_dir(follow_symlinks=False):
+                        pending.append(dir_entry.path)
+                        continue
+                    # Links to directories are not followed, just like os.walk
+                    if (
+                        dir_entry.name in BackupManifest.ignored_names
+                        or dir_entry.is_dir()
+                    ):
+                        continue
+                    stat = dir_entry.stat()
+                except OSError as e:
+                    logger.warning(f"Unable to stat {dir_entry.path} for backup: {e}")
+                    continue
+                entries.append(
+                    ManifestEntry(
+                        dir_entry.path,
+                        dir_entry.path[prefix_length:],
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                    )
+                )
+        return BackupManifest(entries)
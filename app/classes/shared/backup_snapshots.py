@@ -0,0 +1,359 @@
+import os
+import json
+import time
+import zlib
+import hashlib
+import tempfile
+import logging
+import datetime
+import threading
+import typing as t
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
+
+from app.classes.shared.backup_manifest import ManifestEntry
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotStore:
+    """
+    Content addressed store backing the incremental backup type.
+
+    Files are cut into fixed size chunks which are stored once under
+    chunks/<first two hex digits>/<sha256> in the backup directory. Every
+    backup is a small manifest (JSON lines, a header followed by one line per
+    file) listing the chunks each file is made of, so unchanged data is only
+    ever stored once no matter how many backups reference it.
+
+    Files whose size and mtime match the previous manifest are not read at
+    all. Chunks nothing references anymore are removed by collect_garbage()
+    once a manifest has been deleted.
+    """
+
+    manifest_suffix = ".snapshot"
+    manifest_format = "crafty-snapshot"
+    manifest_version = 1
+    chunk_size = 4 * 1024 * 1024
+    # First byte of every stored chunk
+    chunk_raw = b"\0"
+    chunk_deflated = b"\1"
+    # Chunks this recent are left alone by the garbage collection, they may
+    # belong to a backup that is still being written
+    gc_grace_seconds = 6 * 60 * 60
+    # Zip exports nobody asked for in this long are removed again, they are
+    # a full copy of the snapshot
+    export_ttl_seconds = 15 * 60
+    # zip export path -> lock, only held on to while the export is built
+    export_locks: t.Dict[str, threading.Lock] = {}
+    export_locks_lock = threading.Lock()
+
+    def __init__(self, backup_dir: str):
+        self.backup_dir = backup_dir
+        self.chunks_dir = os.path.join(backup_dir, "chunks")
+        self.exports_dir = os.path.join(backup_dir, "exports")
+
+    @staticmethod
+    def is_snapshot(filename: str) -> bool:
+        return str(filename).endswith(SnapshotStore.manifest_suffix)
+
+    # **********************************************************************************
+    #                                   Manifests
+    # **********************************************************************************
+    def list_manifests(self) -> t.List[str]:
+        if not os.path.isdir(self.backup_dir):
+            return []
+        # Manifests are named after their creation time, oldest first
+        return sorted(
+            os.path.join(self.backup_dir, name)
+            for name in os.listdir(self.backup_dir)
+            if self.is_snapshot(name)
+        )
+
+    @staticmethod
+    def read_header(manifest_path: str) -> dict:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+        if header.get("format") != SnapshotStore.manifest_format:
+            raise ValueError(f"{manifest_path} is not a backup snapshot")
+        return header
+
+    @staticmethod
+    def read_entries(manifest_path: str) -> t.Iterator[dict]:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("format") != SnapshotStore.manifest_format:
+                raise ValueError(f"{manifest_path} is not a backup snapshot")
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def load_previous(self) -> t.Dict[str, dict]:
+        manifests = self.list_manifests()
+        if not manifests:
+            return {}
+        try:
+            return {entry["path"]: entry for entry in self.read_entries(manifests[-1])}
+        except (OSError, ValueError) as e:
+            logger.warning(
+                f"Unable to read previous snapshot {manifests[-1]}, "
+                f"storing every file again: {e}"
+            )
+            return {}
+
+    # **********************************************************************************
+    #                                   Chunks
+    # **********************************************************************************
+    def chunk_path(self, digest: str) -> str:
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def store_chunk(self, data: bytes, compress: bool) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            # Refresh it so the garbage collection leaves it alone until our
+            # manifest refers to it
+            os.utime(path)
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if compress:
+            payload = zlib.compress(data)
+            # Not worth it for data that is already compressed
+            if len(payload) < len(data):
+                payload = self.chunk_deflated + payload
+            else:
+                payload = self.chunk_raw + data
+        else:
+            payload = self.chunk_raw + data
+        # Written aside and moved in place so a crash never leaves a partial
+        # chunk behind under a valid name
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(payload)
+        os.replace(temp_path, path)
+        return digest
+
+    def read_chunk(self, digest: str) -> bytes:
+        with open(self.chunk_path(digest), "rb") as f:
+            payload = f.read()
+        if payload[:1] == self.chunk_deflated:
+            return zlib.decompress(payload[1:])
+        return payload[1:]
+
+    def store_file(self, path: str, compress: bool) -> t.Tuple[t.List[str], int]:
+        chunks = []
+        size = 0
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(self.chunk_size)
+                if not block:
+                    break
+                size += len(block)
+                chunks.append(self.store_chunk(block, compress))
+        return chunks, size
+
+    def read_file(self, entry: dict) -> t.Iterator[bytes]:
+        for digest in entry["chunks"]:
+            yield self.read_chunk(digest)
+
+    # **********************************************************************************
+    #                                   Backups
+    # **********************************************************************************
+    def write_snapshot(
+        self,
+        manifest_path: str,
+        entries: t.Iterable[ManifestEntry],
+        compress: bool = False,
+        comment: str = "",
+    ) -> t.Iterator[ManifestEntry]:
+        """
+        Stores manifest entries and writes the snapshot once they are all in.
+        Yields every entry after it has been stored, just like
+        ParallelZipWriter.write_entries.
+        """
+        previous = self.load_previous()
+        files = []
+        total_size = 0
+        reused = 0
+        for entry in entries:
+            name = entry.arcname.replace("\\", "/").lstrip("/")
+            old = previous.get(name)
+            try:
+                # The size and mtime were recorded when the directory was
+                # scanned, before anything is read
+                if (
+                    old is not None
+                    and old["size"] == entry.size
+                    and old["mtime_ns"] == entry.mtime_ns
+                ):
+                    chunks, size = old["chunks"], old["size"]
+                    reused += 1
+                else:
+                    logger.debug(f"backing up: {entry.path}")
+                    chunks, size = self.store_file(entry.path, compress)
+                files.append(
+                    {
+                        "path": name,
+                        "size": size,
+                        "mtime_ns": entry.mtime_ns,
+                        "chunks": chunks,
+                    }
+                )
+                total_size += size
+            except Exception as e:
+                logger.warning(f"Error backing up: {entry.path}! - Error was: {e}")
+            yield entry
+
+        header = {
+            "format": self.manifest_format,
+            "version": self.manifest_version,
+            "created": datetime.datetime.now().astimezone().isoformat(),
+            "comment": comment,
+            "files": len(files),
+            "total_size": total_size,
+        }
+        temp_path = f"{manifest_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(header) + "\n")
+            for file in files:
+                f.write(json.dumps(file) + "\n")
+        os.replace(temp_path, manifest_path)
+        logger.info(
+            f"Wrote snapshot {manifest_path} with {len(files)} files, "
+            f"{reused} unchanged since the last one"
+        )
+
+    def restore(self, manifest_path: str, target_dir: str):
+        target_dir = os.path.abspath(target_dir)
+        for entry in self.read_entries(manifest_path):
+            path = os.path.abspath(os.path.join(target_dir, entry["path"]))
+            if os.path.commonpath([target_dir, path]) != target_dir:
+                raise ValueError(f"Path traversal detected in {manifest_path}")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                for data in self.read_file(entry):
+                    f.write(data)
+            os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+    def export_zip(self, manifest_path: str, zip_path: str):
+        """Packs a snapshot into a regular zip archive, e.g. for downloads"""
+        with ZipFile(zip_path, "w", ZIP_DEFLATED) as zip_file:
+            zip_file.comment = bytes(
+                self.read_header(manifest_path).get("comment", ""), "utf-8"
+            )
+            for entry in self.read_entries(manifest_path):
+                date_time = datetime.datetime.fromtimestamp(
+                    entry["mtime_ns"] / 1e9
+                ).timetuple()[:6]
+                # Zip can't store dates before 1980
+                zinfo = ZipInfo(entry["path"], max(date_time, (1980, 1, 1, 0, 0, 0)))
+                zinfo.compress_type = ZIP_DEFLATED
+                zinfo.file_size = entry["size"]
+                with zip_file.open(zinfo, "w") as handle:
+                    for data in self.read_file(entry):
+                        handle.write(data)
+
+    def get_export_path(self, manifest_path: str) -> str:
+        # Keyed by the mtime, a rewritten manifest gets a new export
+        name = os.path.basename(manifest_path).removesuffix(self.manifest_suffix)
+        mtime_ns = os.stat(manifest_path).st_mtime_ns
+        return os.path.join(self.exports_dir, f"{name}.{mtime_ns}.zip")
+
+    def get_export(self, manifest_path: str) -> str:
+        """
+        Path of the zip export of a snapshot. It is built on first use and
+        kept for export_ttl_seconds after the last request, so resumed
+        downloads are served the very same file.
+        """
+        export_path = self.get_export_path(manifest_path)
+        with SnapshotStore.export_locks_lock:
+            lock = SnapshotStore.export_locks.setdefault(export_path, threading.Lock())
+        try:
+            with lock:
+                try:
+                    # The access time tracks the last request, the mtime has
+                    # to stay put since downloads derive their ETag from it
+                    os.utime(
+                        export_path,
+                        ns=(time.time_ns(), os.stat(export_path).st_mtime_ns),
+                    )
+                except FileNotFoundError:
+                    self.build_export(manifest_path, export_path)
+        finally:
+            with SnapshotStore.export_locks_lock:
+                if SnapshotStore.export_locks.get(export_path) is lock:
+                    del SnapshotStore.export_locks[export_path]
+        self.remove_expired_exports()
+        return export_path
+
+    def build_export(self, manifest_path: str, export_path: str):
+        os.makedirs(self.exports_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(
+            dir=self.exports_dir, prefix=os.path.basename(export_path), suffix=".tmp"
+        )
+        os.close(fd)
+        try:
+            self.export_zip(manifest_path, temp_path)
+            os.replace(temp_path, export_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def remove_expired_exports(self):
+        """
+        Removes the exports not requested within export_ttl_seconds and those
+        of manifests that were deleted or rewritten
+        """
+        if not os.path.isdir(self.exports_dir):
+            return
+        current = set()
+        for manifest_path in self.list_manifests():
+            try:
+                current.add(os.path.basename(self.get_export_path(manifest_path)))
+            except OSError:
+                continue
+        cutoff = time.time() - self.export_ttl_seconds
+        for name in os.listdir(self.exports_dir):
+            path = os.path.join(self.exports_dir, name)
+            try:
+                stat = os.stat(path)
+                if name.endswith(".tmp"):
+                    # Still being written unless it was abandoned long ago
+                    if stat.st_mtime >= cutoff:
+                        continue
+                elif name in current and stat.st_atime >= cutoff:
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                # Exports still being sent can't be removed on Windows, the
+                # next sweep gets them
+                logger.warning(f"Unable to remove backup export {path}: {e}")
+
+    def remove(self, manifest_path: str):
+        os.remove(manifest_path)
+        self.collect_garbage()
+
+    def collect_garbage(self) -> int:
+        """Removes every chunk none of the remaining manifests refers to"""
+        self.remove_expired_exports()
+        referenced = set()
+        for manifest_path in self.list_manifests():
+            for entry in self.read_entries(manifest_path):
+                referenced.update(entry["chunks"])
+
+        removed = 0
+        if not os.path.isdir(self.chunks_dir):
+            return removed
+        cutoff = time.time() - self.gc_grace_seconds
+        for prefix in os.listdir(self.chunks_dir):
+            prefix_dir = os.path.join(self.chunks_dir, prefix)
+            for name in os.listdir(prefix_dir):
+                path = os.path.join(prefix_dir, name)
+                if name not in referenced and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            if not os.listdir(prefix_dir):
+                os.rmdir(prefix_dir)
+        logger.info(f"Removed {removed} unreferenced backup chunks")
+        return removed
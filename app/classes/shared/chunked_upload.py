@@ -0,0 +1,127 @@
+import os
+import time
+import logging
+import threading
+import typing as t
+
+from app.classes.shared.singleton import Singleton
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkedUpload:
+    """
+    One upload assembled in place. Chunks are written at their offset into
+    a file sized up front next to the destination, a bitmap keeps track of
+    which chunks arrived and the finished file is renamed into place, so no
+    part is ever read back or copied.
+    """
+
+    def __init__(self, path: str, size: int, total_chunks: int):
+        self.path = path
+        self.partial_path = f"{path}.crafty_upload"
+        self.size = size
+        self.total_chunks = total_chunks
+        self.received = bytearray((total_chunks + 7) // 8)
+        self.received_count = 0
+        self.last_write = time.monotonic()
+        self.lock = threading.Lock()
+        self.fd = os.open(
+            self.partial_path,
+            os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0),
+            0o644,
+        )
+        # Sized right away, chunks fill it in whatever order they arrive
+        os.ftruncate(self.fd, size)
+
+    @property
+    def complete(self) -> bool:
+        return self.received_count >= self.total_chunks
+
+    def has_chunk(self, index: int) -> bool:
+        return bool(self.received[index >> 3] & (1 << (index & 7)))
+
+    def write(self, offset: int, data: bytes):
+        if offset < 0 or offset + len(data) > self.size:
+            raise ValueError(f"Chunk at {offset} does not fit into {self.size} bytes")
+        if hasattr(os, "pwrite"):
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(self.fd, view, offset)
+                view = view[written:]
+                offset += written
+        else:
+            # No pwrite on Windows, seeking and writing has to happen in one go
+            with self.lock:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(self.fd, view) :]
+        self.last_write = time.monotonic()
+
+    def mark_received(self, index: int):
+        with self.lock:
+            # Chunks sent again after a failed response are only counted once
+            if not self.has_chunk(index):
+                self.received[index >> 3] |= 1 << (index & 7)
+                self.received_count += 1
+
+    def finish(self):
+        os.close(self.fd)
+        self.fd = None
+        os.replace(self.partial_path, self.path)
+
+    def discard(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        try:
+            os.remove(self.partial_path)
+        except FileNotFoundError:
+            pass
+
+
+class ChunkedUploads(metaclass=Singleton):
+    """
+    Uploads in progress by file id. Uploads nobody wrote to for
+    expire_after seconds are dropped together with their partial file.
+    """
+
+    expire_after = 60 * 60
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.uploads: t.Dict[str, ChunkedUpload] = {}
+
+    def open(self, file_id: str, path: str, size: int, total_chunks: int):
+        self.expire()
+        with self.lock:
+            upload = self.uploads.get(file_id)
+            if upload is None or upload.path != path:
+                if upload is not None:
+                    upload.discard()
+                upload = ChunkedUpload(path, size, total_chunks)
+                self.uploads[file_id] = upload
+        return upload
+
+    def finish(self, file_id: str) -> bool:
+        """Puts the upload in place once, False if someone else already did"""
+        with self.lock:
+            upload = self.uploads.pop(file_id, None)
+        if upload is None:
+            return False
+        upload.finish()
+        return True
+
+    def expire(self):
+        now = time.monotonic()
+        with self.lock:
+            expired = [
+                file_id
+                for file_id, upload in self.uploads.items()
+                if now - upload.last_write > self.expire_after
+            ]
+            uploads = [self.uploads.pop(file_id) for file_id in expired]
+        for upload in uploads:
+            logger.info(f"Dropping abandoned upload of {upload.path}")
+            upload.discard()
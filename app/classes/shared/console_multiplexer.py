@@ -0,0 +1,143 @@
+import os
+import time
+import socket
+import logging
+import selectors
+import threading
+
+from app.classes.shared.singleton import Singleton
+
+logger = logging.getLogger(__name__)
+
+
+class ConsoleMultiplexer(metaclass=Singleton):
+    """
+    Owns the stdout pipes of every running server and reads them from a single
+    selector thread instead of one blocked thread per server.
+
+    Every ready pipe gets at most one block read per loop iteration and the
+    block is fully dispatched before the pipe is polled again. A server that
+    floods its console therefore only gets its fair share of the loop, and
+    once we fall behind its pipe fills up and the server blocks on its own
+    writes instead of us buffering its output in memory.
+    """
+
+    # Largest amount of data read from a single server per loop iteration
+    read_block_size = 64 * 1024
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.pending = []
+        # Used to interrupt select() when a new pipe is handed to us
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ)
+        self.thread = None
+
+    @staticmethod
+    def is_supported() -> bool:
+        # Windows can't select() on pipes, servers there keep their own reader
+        return os.name != "nt"
+
+    def register(self, out_buf):
+        fd = out_buf.proc.stdout.fileno()
+        os.set_blocking(fd, False)
+        with self.lock:
+            self.pending.append((fd, out_buf))
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, daemon=True, name="console_multiplexer"
+                )
+                self.thread.start()
+        self.wakeup_send.send(b"\0")
+        logger.debug(f"Registered console pipe of server {out_buf.server_id}")
+
+    def register_pending(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for fd, out_buf in pending:
+            try:
+                self.selector.register(fd, selectors.EVENT_READ, out_buf)
+            except KeyError:
+                # The fd number of a pipe we never saw close has been reused,
+                # the kernel may have forgotten the old one already
+                self.selector.unregister(fd)
+                self.selector.register(fd, selectors.EVENT_READ, out_buf)
+            except (OSError, ValueError) as e:
+                logger.warning(
+                    f"Unable to watch console of server {out_buf.server_id} "
+                    f"due to {e}"
+                )
+
+    def run(self):
+        try:
+            while True:
+                try:
+                    self.poll()
+                except Exception as e:
+                    # This thread reads every console, it must not go away
+                    logger.exception(f"Error caught while reading consoles {e}")
+                    self.drop_closed()
+                    time.sleep(0.1)
+        finally:
+            with self.lock:
+                self.thread = None
+
+    def poll(self):
+        self.register_pending()
+        for key, _ in self.selector.select():
+            if key.fileobj is self.wakeup_recv:
+                try:
+                    while self.wakeup_recv.recv(4096):
+                        pass
+                except BlockingIOError:
+                    pass
+                continue
+            self.read_ready(key)
+
+    def drop_closed(self):
+        """Unregisters pipes that were closed under us, select() fails on them"""
+        for key in list(self.selector.get_map().values()):
+            if key.fileobj is self.wakeup_recv:
+                continue
+            try:
+                os.fstat(key.fd)
+            except OSError:
+                self.selector.unregister(key.fd)
+                logger.warning(
+                    f"Dropped closed console pipe of server {key.data.server_id}"
+                )
+
+    def read_ready(self, key):
+        out_buf = key.data
+        try:
+            block = os.read(key.fd, self.read_block_size)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            logger.warning(
+                f"Unable to read console of server {out_buf.server_id} due to {e}"
+            )
+            block = b""
+
+        if not block:
+            # The write end of the pipe is gone, the server has exited
+            self.selector.unregister(key.fd)
+            logger.debug(f"Console pipe of server {out_buf.server_id} closed")
+            try:
+                out_buf.close()
+            except Exception as e:
+                logger.exception(
+                    f"Error caught while closing console of server "
+                    f"{out_buf.server_id} {e}"
+                )
+            return
+
+        try:
+            out_buf.process_block(block)
+        except Exception as e:
+            logger.exception(
+                f"Error caught while processing console of server "
+                f"{out_buf.server_id} {e}"
+            )
@@ -0,0 +1,327 @@
+import os
+import sys
+import errno
+import ctypes
+import ctypes.util
+import struct
+import logging
+import threading
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+
+from app.classes.shared.singleton import Singleton
+
+logger = logging.getLogger(__name__)
+
+
+class InotifyWatcher:
+    """
+    Minimal inotify binding through ctypes, reports which watched directory
+    saw a change. Only available on Linux, create() returns None elsewhere.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+
+    watch_mask = (
+        IN_MODIFY
+        | IN_ATTRIB
+        | IN_CLOSE_WRITE
+        | IN_MOVED_FROM
+        | IN_MOVED_TO
+        | IN_CREATE
+        | IN_DELETE
+        | IN_DELETE_SELF
+        | IN_MOVE_SELF
+        | IN_ONLYDIR
+    )
+    event_header = struct.Struct("iIII")
+
+    def __init__(self, libc, fd: int, on_change: t.Callable[[t.Any, str], None]):
+        self.libc = libc
+        self.fd = fd
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        # watch descriptor -> (context, path)
+        self.watches: t.Dict[int, t.Tuple[t.Any, str]] = {}
+        self.thread = threading.Thread(
+            target=self.read_events, daemon=True, name="dir_size_inotify"
+        )
+        self.thread.start()
+
+    @staticmethod
+    def create(on_change: t.Callable[[t.Any, str], None]):
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC)
+        except (OSError, AttributeError) as e:
+            logger.info(f"inotify is not available, polling directory sizes: {e}")
+            return None
+        if fd < 0:
+            logger.info(
+                "inotify is not available, polling directory sizes: "
+                f"{os.strerror(ctypes.get_errno())}"
+            )
+            return None
+        return InotifyWatcher(libc, fd, on_change)
+
+    def watch(self, context, path: str) -> bool:
+        wd = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(path), ctypes.c_uint32(self.watch_mask)
+        )
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                logger.warning(
+                    f"Out of inotify watches while watching {path}, raise "
+                    "fs.inotify.max_user_watches to track every directory"
+                )
+            else:
+                logger.debug(f"Unable to watch {path}: {os.strerror(error)}")
+            return False
+        with self.lock:
+            self.watches[wd] = (context, path)
+        return True
+
+    def unwatch_context(self, context):
+        with self.lock:
+            descriptors = [wd for wd, w in self.watches.items() if w[0] is context]
+            for wd in descriptors:
+                del self.watches[wd]
+        for wd in descriptors:
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def unwatch_path(self, context, path: str):
+        prefix = os.path.join(path, "")
+        with self.lock:
+            descriptors = [
+                wd
+                for wd, w in self.watches.items()
+                if w[0] is context and (w[1] == path or w[1].startswith(prefix))
+            ]
+            for wd in descriptors:
+                del self.watches[wd]
+        for wd in descriptors:
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        while True:
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                logger.error(f"inotify reader stopped: {e}")
+                return
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _cookie, length = self.event_header.unpack_from(
+                    buffer, offset
+                )
+                offset += self.event_header.size + length
+                if mask & self.IN_Q_OVERFLOW:
+                    # Events were lost, everything has to be looked at again
+                    with self.lock:
+                        watched = list(self.watches.values())
+                    for context, path in watched:
+                        self.on_change(context, path)
+                    continue
+                with self.lock:
+                    if mask & self.IN_IGNORED:
+                        watched = self.watches.pop(wd, None)
+                    else:
+                        watched = self.watches.get(wd)
+                if watched is not None:
+                    self.on_change(*watched)
+
+
+class DirectoryNode(t.NamedTuple):
+    mtime_ns: int
+    # Size of the files directly inside the directory
+    files_size: int
+    subdirs: t.Tuple[str, ...]
+    # files_size plus the totals of every subdirectory
+    total: int
+
+
+class TrackedDirectory:
+    def __init__(self, path: str, callback: t.Callable[[int], None]):
+        self.path = path
+        self.callback = callback
+        self.nodes: t.Dict[str, DirectoryNode] = {}
+        # Directories whose own entries changed, and directories with a
+        # changed directory somewhere below them
+        self.dirty: t.Set[str] = set()
+        self.stale: t.Set[str] = set()
+        self.watched = False
+        self.polls = 0
+        self.pending = False
+        self.size = 0
+
+
+class DirSizeTracker(metaclass=Singleton):
+    """
+    Keeps track of the size of every server directory.
+
+    Totals are cached per directory together with the directory's mtime. A
+    refresh only lists directories whose mtime changed and reuses the cached
+    size of the files in every other one. Where inotify is available every
+    directory is watched, unchanged subtrees are then skipped entirely and
+    files growing in place are picked up as well. Without it in place growth
+    does not touch the directory mtime, so every full_rescan_polls polls a
+    tracked directory is measured from scratch.
+
+    All measurements run on one small shared pool, however many servers
+    there are.
+    """
+
+    max_workers = 2
+    full_rescan_polls = 6
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.directories: t.Dict[str, TrackedDirectory] = {}
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="dir_size"
+        )
+        self.watcher = InotifyWatcher.create(self.on_change)
+
+    def track(self, key, path: str, callback: t.Callable[[int], None]):
+        """Starts tracking path under key and measures it in the background"""
+        key = str(key)
+        with self.lock:
+            directory = self.directories.get(key)
+            if directory is not None and directory.path == path:
+                directory.callback = callback
+                return
+            self.directories[key] = TrackedDirectory(path, callback)
+        if directory is not None and self.watcher is not None:
+            self.watcher.unwatch_context(directory)
+        self.refresh(key)
+
+    def untrack(self, key):
+        with self.lock:
+            directory = self.directories.pop(str(key), None)
+        if directory is not None and self.watcher is not None:
+            self.watcher.unwatch_context(directory)
+
+    def get_size(self, key) -> int:
+        directory = self.directories.get(str(key))
+        return directory.size if directory is not None else 0
+
+    def refresh(self, key, force: bool = False):
+        with self.lock:
+            directory = self.directories.get(str(key))
+            # One measurement per directory at a time is plenty
+            if directory is None or directory.pending:
+                return
+            directory.pending = True
+        self.executor.submit(self.measure, directory, force)
+
+    def poll(self):
+        for key, directory in list(self.directories.items()):
+            directory.polls += 1
+            self.refresh(
+                key,
+                force=not directory.watched
+                and directory.polls % self.full_rescan_polls == 0,
+            )
+
+    def on_change(self, directory: TrackedDirectory, path: str):
+        with self.lock:
+            directory.dirty.add(path)
+            # Every directory above has to add its totals up again
+            while path not in directory.stale:
+                directory.stale.add(path)
+                if path == directory.path:
+                    break
+                parent = os.path.dirname(path)
+                if parent == path:
+                    break
+                path = parent
+
+    # **********************************************************************************
+    #                                   Measuring
+    # **********************************************************************************
+    def measure(self, directory: TrackedDirectory, force: bool):
+        try:
+            if not directory.nodes and self.watcher is not None:
+                directory.watched = True
+            directory.size = self.measure_dir(directory, directory.path, force)
+            directory.callback(directory.size)
+        except Exception as e:
+            logger.error(f"Unable to calculate the size of {directory.path}: {e}")
+        finally:
+            directory.pending = False
+
+    def measure_dir(self, directory: TrackedDirectory, path: str, force: bool) -> int:
+        node = directory.nodes.get(path)
+        with self.lock:
+            # Changes from here on mark the directory again
+            stale = path in directory.stale
+            dirty = path in directory.dirty
+            directory.stale.discard(path)
+            directory.dirty.discard(path)
+        if directory.watched and node is not None and not force and not stale:
+            return node.total
+
+        if directory.watched and node is None:
+            # Watched before it is listed so no change can slip through
+            if not self.watcher.watch(directory, path):
+                logger.info(f"Falling back to polling the size of {directory.path}")
+                directory.watched = False
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            self.forget(directory, path)
+            return 0
+        if node is not None and not force and not dirty and node.mtime_ns == mtime_ns:
+            files_size, subdirs = node.files_size, node.subdirs
+        else:
+            files_size, subdirs = self.scan_dir(path)
+            if node is not None:
+                for removed in set(node.subdirs).difference(subdirs):
+                    self.forget(directory, removed)
+
+        total = files_size
+        for subdir in subdirs:
+            total += self.measure_dir(directory, subdir, force)
+        directory.nodes[path] = DirectoryNode(mtime_ns, files_size, subdirs, total)
+        return total
+
+    @staticmethod
+    def scan_dir(path: str) -> t.Tuple[int, t.Tuple[str, ...]]:
+        files_size = 0
+        subdirs = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        else:
+                            files_size += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        # Removed while we were looking, the next change
+                        # event or poll catches up
+                        continue
+        except OSError as e:
+            logger.debug(f"Unable to list {path}: {e}")
+        return files_size, tuple(subdirs)
+
+    def forget(self, directory: TrackedDirectory, path: str):
+        prefix = os.path.join(path, "")
+        for cached in [p for p in directory.nodes if p == path or p.startswith(prefix)]:
+            del directory.nodes[cached]
+        if self.watcher is not None:
+            self.watcher.unwatch_path(directory, path)
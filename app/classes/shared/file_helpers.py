@@ -5,9 +5,9 @@ import pathlib
 import tempfile
 import zipfile
 import hashlib
-from typing import BinaryIO
+from typing import BinaryIO, Iterable
 import mimetypes
-from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+from zipfile import ZipFile, ZIP_DEFLATED
 import urllib.request
 import ssl
 import time
@@ -16,6 +16,10 @@ import certifi
 from app.classes.shared.helpers import Helpers
 from app.classes.shared.console import Console
 from app.classes.shared.websocket_manager import WebSocketManager
+from app.classes.shared.backup_archives import BackupFormats
+from app.classes.shared.backup_snapshots import SnapshotStore
+from app.classes.shared.backup_manifest import BackupManifest, ManifestEntry
+from app.classes.shared.zip_archiver import ParallelZipExtractor
 
 logger = logging.getLogger(__name__)
 
@@ -266,100 +270,124 @@ class FileHelpers:
         backup_id,
         comment="",
         compressed=None,
+        workers=0,
+        backup_type="full",
+        archive_format="zip",
+        compression_level=None,
     ):
-        # create a ZipFile object
-        path_to_destination += ".zip"
-        ex_replace = [p.replace("\\", "/") for p in excluded_dirs]
-        total_bytes = 0
-        dir_bytes = Helpers.get_dir_size(path_to_zip)
+        manifest = BackupManifest.scan(path_to_zip, excluded_dirs)
+        total_files = self.helper.human_readable_file_size(manifest.total_size)
         results = {
             "percent": 0,
-            "total_files": self.helper.human_readable_file_size(dir_bytes),
+            "total_files": total_files,
         }
-        WebSocketManager().broadcast_page_params(
+        WebSocketManager().broadcast_page_params_coalesced(
             "/panel/server_detail",
             {"id": str(server_id)},
             "backup_status",
             results,
         )
-        WebSocketManager().broadcast_page_params(
+        WebSocketManager().broadcast_page_params_coalesced(
             "/panel/edit_backup",
             {"id": str(server_id)},
             "backup_status",
             results,
         )
-        # Set the compression mode based on the `compressed` parameter
-        compression_mode = ZIP_DEFLATED if compressed else ZIP_STORED
-        with ZipFile(path_to_destination, "w", compression_mode) as zip_file:
-            zip_file.comment = bytes(
-                comment, "utf-8"
-            )  # comments over 65535 bytes will be truncated
-            for root, dirs, files in os.walk(path_to_zip, topdown=True):
-                for l_dir in dirs[:]:
-                    # make all paths in exclusions a unix style slash
-                    # to match directories.
-                    if str(os.path.join(root, l_dir)).replace("\\", "/") in ex_replace:
-                        dirs.remove(l_dir)
-                ziproot = path_to_zip
-                # iterate through list of files
-                for file in files:
-                    # check if file/dir is in exclusions list.
-                    # Only proceed if not exluded.
-                    if (
-                        str(os.path.join(root, file)).replace("\\", "/")
-                        not in ex_replace
-                        and file != "crafty.sqlite"
-                    ):
-                        try:
-                            logger.debug(f"backing up: {os.path.join(root, file)}")
-                            # add trailing slash to zip root dir if not windows.
-                            if os.name == "nt":
-                                zip_file.write(
-                                    os.path.join(root, file),
-                                    os.path.join(root.replace(ziproot, ""), file),
-                                )
-                            else:
-                                zip_file.write(
-                                    os.path.join(root, file),
-                                    os.path.join(root.replace(ziproot, "/"), file),
-                                )
 
-                        except Exception as e:
-                            logger.warning(
-                                f"Error backing up: {os.path.join(root, file)}!"
-                                f" - Error was: {e}"
-                            )
-                    # debug logging for exlusions list
-                    else:
-                        logger.debug(f"Found {file} in exclusion list. Skipping...")
-
-                    # add current file bytes to total bytes.
-                    total_bytes += os.path.getsize(os.path.join(root, file))
-                    # calcualte percentage based off total size and current archive size
-                    percent = round((total_bytes / dir_bytes) * 100, 2)
-                    # package results
-                    results = {
-                        "percent": percent,
-                        "total_files": self.helper.human_readable_file_size(dir_bytes),
-                        "backup_id": backup_id,
-                    }
-                    # send status results to page.
-                    WebSocketManager().broadcast_page_params(
-                        "/panel/server_detail",
-                        {"id": str(server_id)},
-                        "backup_status",
-                        results,
-                    )
-                    WebSocketManager().broadcast_page_params(
-                        "/panel/edit_backup",
-                        {"id": str(server_id)},
-                        "backup_status",
-                        results,
-                    )
+        if backup_type == "incremental":
+            path_to_destination += SnapshotStore.manifest_suffix
+            store = SnapshotStore(os.path.dirname(path_to_destination))
+            self.report_backup_progress(
+                store.write_snapshot(
+                    path_to_destination, manifest, compressed, comment
+                ),
+                manifest,
+                server_id,
+                backup_id,
+            )
+            return True
+
+        backup_format = BackupFormats.get(archive_format)
+        path_to_destination += backup_format.extension
+        try:
+            self.report_backup_progress(
+                backup_format.write_entries(
+                    path_to_destination,
+                    manifest,
+                    comment,
+                    compressed,
+                    compression_level,
+                    workers,
+                ),
+                manifest,
+                server_id,
+                backup_id,
+            )
+        except Exception:
+            # Don't leave an incomplete archive behind among the backups
+            if os.path.exists(path_to_destination):
+                os.remove(path_to_destination)
+            raise
         return True
 
+    def report_backup_progress(
+        self,
+        written: Iterable[ManifestEntry],
+        manifest: BackupManifest,
+        server_id,
+        backup_id,
+    ):
+        total_bytes = 0
+        total_files = self.helper.human_readable_file_size(manifest.total_size)
+        for entry in written:
+            # add current file bytes to total bytes.
+            total_bytes += entry.size
+            # calcualte percentage based off total size and current archive size
+            percent = (
+                round((total_bytes / manifest.total_size) * 100, 2)
+                if manifest.total_size
+                else 100
+            )
+            # package results
+            results = {
+                "percent": percent,
+                "total_files": total_files,
+                "backup_id": backup_id,
+            }
+            # send status results to page, rate limited as this runs
+            # for every single file
+            WebSocketManager().broadcast_page_params_coalesced(
+                "/panel/server_detail",
+                {"id": str(server_id)},
+                "backup_status",
+                results,
+            )
+            WebSocketManager().broadcast_page_params_coalesced(
+                "/panel/edit_backup",
+                {"id": str(server_id)},
+                "backup_status",
+                results,
+            )
+
     @staticmethod
-    def unzip_file(zip_path, server_update=False):
+    def get_extract_progress(user_id, archive_path):
+        """
+        Progress callback for ParallelZipExtractor.extract that keeps the
+        user posted through the websocket, None without a user
+        """
+        if not user_id:
+            return None
+        archive = os.path.basename(archive_path)
+
+        def report(percent):
+            WebSocketManager().broadcast_user(
+                user_id, "extract_status", {"percent": percent, "archive": archive}
+            )
+
+        return report
+
+    @staticmethod
+    def unzip_file(zip_path, server_update=False, user_id=None):
         ignored_names = ["server.properties", "permissions.json", "allowlist.json"]
         # Get directory without zipfile name
         new_dir = pathlib.Path(zip_path).parents[0]
@@ -367,35 +395,19 @@ class FileHelpers:
         if Helpers.check_file_perms(zip_path) and os.path.isfile(zip_path):
             # make sure the directory we're unzipping this to exists
             Helpers.ensure_dir_exists(new_dir)
-            # we'll make a temporary directory to unzip this to.
-            temp_dir = tempfile.mkdtemp()
+
+            def skip(path):
+                # if a top level item is one of our ignored names we'll skip it
+                return server_update and path.split(os.path.sep)[0] in ignored_names
+
             try:
                 with zipfile.ZipFile(zip_path, "r") as zip_ref:
-                    # we'll extract this to the temp dir using zipfile module
-                    zip_ref.extractall(temp_dir)
-                # we'll iterate through the top level directory moving everything
-                # out of the temp directory and into it's final home.
-                for item in os.listdir(temp_dir):
-                    # if the file is one of our ignored names we'll skip it
-                    if item in ignored_names and server_update:
-                        continue
-                    # we handle files and dirs differently or we'll crash out.
-                    if os.path.isdir(os.path.join(temp_dir, item)):
-                        try:
-                            FileHelpers.move_dir_exist(
-                                os.path.join(temp_dir, item),
-                                os.path.join(new_dir, item),
-                            )
-                        except Exception as ex:
-                            logger.error(f"ERROR IN ZIP IMPORT: {ex}")
-                    else:
-                        try:
-                            FileHelpers.move_file(
-                                os.path.join(temp_dir, item),
-                                os.path.join(new_dir, item),
-                            )
-                        except Exception as ex:
-                            logger.error(f"ERROR IN ZIP IMPORT: {ex}")
+                    # members are written straight into their final home
+                    ParallelZipExtractor(zip_ref).extract(
+                        new_dir,
+                        skip=skip,
+                        progress=FileHelpers.get_extract_progress(user_id, zip_path),
+                    )
             except Exception as ex:
                 Console.error(ex)
         else:
@@ -404,9 +416,15 @@ class FileHelpers:
 
     def unzip_server(self, zip_path, user_id):
         if Helpers.check_file_perms(zip_path):
-            temp_dir = tempfile.mkdtemp()
+            # Next to the servers, so moving the import in place is a rename
+            temp_dir = tempfile.mkdtemp(
+                prefix=Helpers.staging_prefix, dir=self.helper.servers_dir
+            )
             with zipfile.ZipFile(zip_path, "r") as zip_ref:
                 # extracts archive to temp directory
-                zip_ref.extractall(temp_dir)
+                ParallelZipExtractor(zip_ref).extract(
+                    temp_dir,
+                    progress=FileHelpers.get_extract_progress(user_id, zip_path),
+                )
             if user_id:
                 return temp_dir
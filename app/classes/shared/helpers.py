@@ -1,4 +1,5 @@
 import contextlib
+import copy
 import os
 import re
 import sys
@@ -12,12 +13,12 @@ import socket
 import secrets
 import logging
 import html
-import zipfile
 import pathlib
 import ctypes
 import shutil
 import shlex
 import subprocess
+import threading
 import itertools
 from datetime import datetime, timezone
 from socket import gethostname
@@ -28,6 +29,9 @@ from packaging import version as pkg_version
 from app.classes.shared.null_writer import NullWriter
 from app.classes.shared.console import Console
 from app.classes.shared.installer import installer
+from app.classes.shared.log_highlighter import LogHighlighter
+from app.classes.shared.backup_snapshots import SnapshotStore
+from app.classes.shared.backup_archives import BackupFormats, ZipBackupFormat
 from app.classes.shared.translation import Translation
 
 with redirect_stderr(NullWriter()):
@@ -55,6 +59,11 @@ except ModuleNotFoundError as err:
 
 class Helpers:
     allowed_quotes = ['"', "'", "`"]
+    # How often (in seconds) config.json is checked for external edits
+    settings_check_interval = 1.0
+    # Archives are extracted to dirs with this prefix in the servers dir, on
+    # the same filesystem as the servers they are moved into
+    staging_prefix = ".crafty_staging_"
 
     def __init__(self):
         self.root_dir = os.path.abspath(os.path.curdir)
@@ -84,6 +93,15 @@ class Helpers:
         self.ignored_names = ["crafty_managed.txt", "db_stats"]
         self.crafty_starting = False
         self.minimum_password_length = 8
+        self.log_highlighter = None
+
+        # In memory copy of config.json, see load_settings
+        self.settings_cache = None
+        self.settings_signature = None
+        self.settings_checked = 0.0
+        self.settings_lock = threading.RLock()
+        self.settings_subscribers = []
+        self.subscribe_settings(self.reset_log_highlighter, ["keywords"])
 
     @staticmethod
     def auto_installer_fix(ex):
@@ -460,13 +478,101 @@ class Helpers:
                     cmd_out[cmd_index] += char
         return cmd_out
 
+    def load_settings(self, force=False) -> dict:
+        """
+        Returns the in memory copy of config.json. The file is only stat'ed once
+        every settings_check_interval seconds and only re-read when its
+        modification time or size changed, which picks up external edits.
+        """
+        now = time.monotonic()
+        if (
+            not force
+            and self.settings_cache is not None
+            and now - self.settings_checked < self.settings_check_interval
+        ):
+            return self.settings_cache
+
+        with self.settings_lock:
+            stat = os.stat(self.settings_file)
+            self.settings_checked = now
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if force or signature != self.settings_signature:
+                with open(self.settings_file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                changed = self.update_settings_cache(data, signature)
+            else:
+                changed = {}
+            settings = self.settings_cache
+        self.notify_settings_subscribers(changed)
+        return settings
+
+    def update_settings_cache(self, data: dict, signature) -> dict:
+        # Must be called with the settings lock held, returns what changed
+        old_data = self.settings_cache
+        self.settings_cache = data
+        self.settings_signature = signature
+        if old_data is None:
+            return {}
+        return {
+            key: value
+            for key, value in data.items()
+            if key not in old_data or old_data[key] != value
+        }
+
+    def write_settings(self, data: dict, indent: int):
+        with self.settings_lock:
+            temp_file = f"{self.settings_file}.tmp"
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=indent)
+            try:
+                # Readers either see the old or the new file, never half of one
+                os.replace(temp_file, self.settings_file)
+            except OSError:
+                # config.json itself may be a bind mount that can't be replaced
+                os.remove(temp_file)
+                with open(self.settings_file, "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=indent)
+            stat = os.stat(self.settings_file)
+            self.settings_checked = time.monotonic()
+            changed = self.update_settings_cache(
+                copy.deepcopy(data), (stat.st_mtime_ns, stat.st_size)
+            )
+        self.notify_settings_subscribers(changed)
+
+    def subscribe_settings(self, callback, keys=None):
+        """
+        Calls callback with a dict of the changed settings whenever the settings
+        are written or config.json is edited externally. If keys is given the
+        callback only fires for (and only receives) those settings.
+        """
+        self.settings_subscribers.append((callback, set(keys) if keys else None))
+
+    def notify_settings_subscribers(self, changed: dict):
+        if not changed:
+            return
+        for callback, keys in list(self.settings_subscribers):
+            relevant = {
+                key: value
+                for key, value in changed.items()
+                if keys is None or key in keys
+            }
+            if not relevant:
+                continue
+            try:
+                callback(relevant)
+            except Exception as e:
+                logger.exception(f"Error caught in settings subscriber {e}")
+
     def get_setting(self, key, default_return=False):
         try:
-            with open(self.settings_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            data = self.load_settings()
 
             if key in data.keys():
-                return data.get(key)
+                value = data.get(key)
+                # Don't hand out references into the cache
+                if isinstance(value, (list, dict)):
+                    return copy.deepcopy(value)
+                return value
 
             logger.error(f'Config File Error: Setting "{key}" does not exist')
             Console.error(f'Config File Error: Setting "{key}" does not exist')
@@ -481,10 +587,24 @@ class Helpers:
 
         return default_return
 
+    def get_setting_as(self, key, value_type, default_return=None):
+        value = self.get_setting(key, default_return)
+        if value is default_return:
+            return default_return
+        if value_type is bool and isinstance(value, str):
+            return value.strip().lower() in ("true", "yes", "1")
+        try:
+            return value_type(value)
+        except (TypeError, ValueError):
+            logger.error(
+                f'Config File Error: Setting "{key}" is not a valid '
+                f"{value_type.__name__}: {value!r}"
+            )
+            return default_return
+
     def set_settings(self, data):
         try:
-            with open(self.settings_file, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=4)
+            self.write_settings(data, 4)
 
         except Exception as e:
             logger.critical(
@@ -527,12 +647,14 @@ class Helpers:
             "dir_size_poll_freq_minutes": 5,
             "crafty_logs_delete_after_days": 0,
             "big_bucket_repo": "https://jars.arcadiatech.org",
+            "websocket_max_event_rate": 10,
+            "stats_snapshot_ttl_seconds": 5,
+            "upload_max_buffer_mb": 4,
         }
 
     def get_all_settings(self):
         try:
-            with open(self.settings_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            data = copy.deepcopy(self.load_settings())
 
         except Exception as e:
             data = {}
@@ -574,14 +696,13 @@ class Helpers:
 
     def set_setting(self, key, new_value):
         try:
-            with open(self.settings_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            with self.settings_lock:
+                data = copy.deepcopy(self.load_settings(force=True))
 
-            if key in data.keys():
-                data[key] = new_value
-                with open(self.settings_file, "w", encoding="utf-8") as f:
-                    json.dump(data, f, indent=2)
-                return True
+                if key in data.keys():
+                    data[key] = new_value
+                    self.write_settings(data, 2)
+                    return True
 
             logger.error(f'Config File Error: Setting "{key}" does not exist')
             Console.error(f'Config File Error: Setting "{key}" does not exist')
@@ -702,41 +823,22 @@ class Helpers:
         except:
             return False
 
-    def log_colors(self, line):
-        # our regex replacements
-        # note these are in a tuple
-
-        user_keywords = self.get_setting("keywords")
-
-        replacements = [
-            (r"(\[.+?/INFO\])", r'<span class="mc-log-info">\1</span>'),
-            (r"(\[.+?/WARN\])", r'<span class="mc-log-warn">\1</span>'),
-            (r"(\[.+?/ERROR\])", r'<span class="mc-log-error">\1</span>'),
-            (r"(\[.+?/FATAL\])", r'<span class="mc-log-fatal">\1</span>'),
-            (
-                r"(\w+?\[/\d+?\.\d+?\.\d+?\.\d+?\:\d+?\])",
-                r'<span class="mc-log-keyword">\1</span>',
-            ),
-            (r"\[(\d\d:\d\d:\d\d)\]", r'<span class="mc-log-time">[\1]</span>'),
-            (r"(\[.+? INFO\])", r'<span class="mc-log-info">\1</span>'),
-            (r"(\[.+? WARN\])", r'<span class="mc-log-warn">\1</span>'),
-            (r"(\[.+? ERROR\])", r'<span class="mc-log-error">\1</span>'),
-            (r"(\[.+? FATAL\])", r'<span class="mc-log-fatal">\1</span>'),
-        ]
+    def reset_log_highlighter(self, _changed=None):
+        self.log_highlighter = None
 
-        # highlight users keywords
-        for keyword in user_keywords:
-            # pylint: disable=consider-using-f-string
-            search_replace = (
-                r"({})".format(keyword),
-                r'<span class="mc-log-keyword">\1</span>',
-            )
-            replacements.append(search_replace)
+    def get_log_highlighter(self) -> LogHighlighter:
+        # Built lazily and dropped whenever the keywords setting changes
+        highlighter = self.log_highlighter
+        if highlighter is None:
+            highlighter = LogHighlighter(self.get_setting("keywords", []))
+            self.log_highlighter = highlighter
+        return highlighter
 
-        for old, new in replacements:
-            line = re.sub(old, new, line, flags=re.IGNORECASE)
+    def log_colors(self, line):
+        return self.get_log_highlighter().highlight(line)
 
-        return line
+    def log_colors_lines(self, lines):
+        return self.get_log_highlighter().highlight_lines(lines)
 
     @staticmethod
     def validate_traversal(base_path, filename):
@@ -1228,13 +1330,16 @@ class Helpers:
         return output
 
     @staticmethod
-    def unzip_backup_archive(backup_path, zip_name):
+    def unzip_backup_archive(backup_path, zip_name, staging_root=None, progress=None):
         zip_path = os.path.join(backup_path, zip_name)
         if Helpers.check_file_perms(zip_path):
-            temp_dir = tempfile.mkdtemp()
-            with zipfile.ZipFile(zip_path, "r") as zip_ref:
-                # extracts archive to temp directory
-                zip_ref.extractall(temp_dir)
+            temp_dir = tempfile.mkdtemp(prefix=Helpers.staging_prefix, dir=staging_root)
+            if SnapshotStore.is_snapshot(zip_name):
+                # Incremental backups are rebuilt from their chunks
+                SnapshotStore(os.path.dirname(zip_path)).restore(zip_path, temp_dir)
+                return temp_dir
+            backup_format = BackupFormats.for_file(zip_name) or ZipBackupFormat
+            backup_format.extract(zip_path, temp_dir, progress)
             return temp_dir
         return False
 
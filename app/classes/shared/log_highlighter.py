@@ -0,0 +1,104 @@
+import re
+import logging
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+
+class LogHighlighter:
+    """
+    Wraps the interesting parts of a console line in mc-log-* spans.
+
+    All built-in and user keyword patterns are compiled once into a single
+    alternation so every line is scanned exactly one time. Rebuild the
+    highlighter (see Helpers.get_log_highlighter) when the keywords change.
+    """
+
+    # (css class, pattern) - earlier entries win when several match at the
+    # same position. Brackets can't span "]" so the timestamp in front of a
+    # "[thread/LEVEL]" block is highlighted on its own.
+    builtin_patterns = [
+        ("mc-log-info", r"\[[^\]\n]+?/INFO\]"),
+        ("mc-log-warn", r"\[[^\]\n]+?/WARN\]"),
+        ("mc-log-error", r"\[[^\]\n]+?/ERROR\]"),
+        ("mc-log-fatal", r"\[[^\]\n]+?/FATAL\]"),
+        ("mc-log-keyword", r"\w+?\[/\d+?\.\d+?\.\d+?\.\d+?\:\d+?\]"),
+        ("mc-log-time", r"\[\d\d:\d\d:\d\d\]"),
+        ("mc-log-info", r"\[[^\]\n]+? INFO\]"),
+        ("mc-log-warn", r"\[[^\]\n]+? WARN\]"),
+        ("mc-log-error", r"\[[^\]\n]+? ERROR\]"),
+        ("mc-log-fatal", r"\[[^\]\n]+? FATAL\]"),
+    ]
+
+    # Flags at the start of a keyword, only allowed at the very start of the
+    # combined pattern, so they are turned into a group scoped to the keyword
+    global_flags = re.compile(r"\(\?([aiLmsux]+)\)")
+
+    def __init__(self, keywords: t.Optional[t.List[str]] = None):
+        self.keywords = list(keywords or [])
+        keyword_patterns = [
+            self.get_keyword_pattern(keyword) for keyword in self.keywords if keyword
+        ]
+        try:
+            self.pattern = self.compile_patterns(keyword_patterns)
+        except re.error as e:
+            # Keywords are checked one by one, should they still clash with
+            # each other fall back to matching all of them literally
+            logger.warning(
+                f"Log keywords can't be combined ({e}), matching them literally"
+            )
+            self.pattern = self.compile_patterns(
+                [re.escape(keyword) for keyword in self.keywords if keyword]
+            )
+
+    @staticmethod
+    def get_keyword_pattern(keyword: str) -> str:
+        """
+        The keyword the way it goes into the combined pattern. Keywords that
+        don't work inside of it are matched literally.
+        """
+        flags = LogHighlighter.global_flags.match(keyword)
+        pattern = keyword
+        if flags:
+            pattern = f"(?{flags.group(1)}:{keyword[flags.end():]})"
+        try:
+            # Wrapped the same way it ends up in the combined pattern
+            groups = re.compile(f"(?P<keyword>{pattern})").groups
+        except re.error as e:
+            logger.warning(
+                f"Log keyword {keyword!r} is not a valid regex ({e}), "
+                f"matching it literally"
+            )
+            return re.escape(keyword)
+        if groups != 1:
+            # Numbered groups and backreferences would point at the groups of
+            # the other patterns
+            logger.warning(
+                f"Log keyword {keyword!r} contains groups, matching it literally"
+            )
+            return re.escape(keyword)
+        return pattern
+
+    def compile_patterns(self, keyword_patterns: t.List[str]) -> re.Pattern:
+        patterns = list(self.builtin_patterns)
+        patterns.extend(("mc-log-keyword", pattern) for pattern in keyword_patterns)
+        # Group names map a match back to its css class
+        self.classes = {}
+        alternatives = []
+        for i, (css_class, pattern) in enumerate(patterns):
+            self.classes[f"h{i}"] = css_class
+            alternatives.append(f"(?P<h{i}>{pattern})")
+        return re.compile("|".join(alternatives), re.IGNORECASE)
+
+    def replace(self, match: re.Match) -> str:
+        # Our groups wrap the whole pattern so they always close last
+        group = match.lastgroup
+        return f'<span class="{self.classes[group]}">{match.group(group)}</span>'
+
+    def highlight(self, line: str) -> str:
+        return self.pattern.sub(self.replace, line)
+
+    def highlight_lines(self, lines: t.List[str]) -> t.List[str]:
+        # One line at a time, user patterns may use "$" or match a line break
+        # and would span lines if they were run over a joined batch
+        return [self.highlight(line) for line in lines]
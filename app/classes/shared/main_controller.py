@@ -35,6 +35,8 @@ from app.classes.shared.file_helpers import FileHelpers
 from app.classes.shared.import_helper import ImportHelpers
 from app.classes.minecraft.bigbucket import BigBucket
 from app.classes.shared.websocket_manager import WebSocketManager
+from app.classes.shared.dir_size_tracker import DirSizeTracker
+from app.classes.shared.status_snapshot import StatusSnapshotCache
 
 logger = logging.getLogger(__name__)
 
@@ -159,8 +161,7 @@ class Controller:
         keys = list(current_config.keys())
         keys.sort()
         sorted_data = {i: current_config[i] for i in keys}
-        with open(self.helper.settings_file, "w", encoding="utf-8") as f:
-            json.dump(sorted_data, f, indent=4)
+        self.helper.set_settings(sorted_data)
 
     def package_support_logs(self, exec_user):
         if exec_user["preparing"]:
@@ -970,6 +971,9 @@ class Controller:
                 srv_obj = server["server_obj"]
                 srv_obj.server_scheduler.shutdown()
                 srv_obj.dir_scheduler.shutdown()
+                DirSizeTracker().untrack(server_id)
+                StatusSnapshotCache().forget(server_id)
+                srv_obj.stats_helper.discard_pending_stats()
                 running = srv_obj.check_running()
 
                 if running:
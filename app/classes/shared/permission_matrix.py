@@ -0,0 +1,117 @@
+import logging
+import threading
+import typing as t
+
+from app.classes.shared.singleton import Singleton
+
+logger = logging.getLogger(__name__)
+
+
+class PermissionMatrix(metaclass=Singleton):
+    """
+    In memory (user, server) -> permission mask index built from the
+    RoleServers and UserRoles tables.
+
+    Users and roles are loaded lazily the first time they are looked up and
+    the model helpers mark them stale whenever their rows change, so a change
+    only reloads the affected user or role instead of the whole index. The
+    loaders live in the models layer and are registered by
+    app.classes.models.server_permissions to keep this module import free.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # user_id -> (superuser, [role_id, ...]) or None for unknown users
+        self.users: t.Dict[str, t.Optional[t.Tuple[bool, t.List[str]]]] = {}
+        # role_id -> (role_name, {server_id: mask})
+        self.roles: t.Dict[str, t.Tuple[str, t.Dict[str, str]]] = {}
+        # user_id -> {server_id: mask}, derived from the two above
+        self.user_masks: t.Dict[str, t.Dict[str, str]] = {}
+        self.mask_length = 0
+        self.user_loader = None
+        self.role_loader = None
+
+    def set_loaders(self, user_loader, role_loader, mask_length: int):
+        self.user_loader = user_loader
+        self.role_loader = role_loader
+        self.mask_length = mask_length
+
+    # **********************************************************************************
+    #                                   Invalidation
+    # **********************************************************************************
+    def invalidate_user(self, user_id):
+        with self.lock:
+            self.users.pop(str(user_id), None)
+            self.user_masks.pop(str(user_id), None)
+
+    def invalidate_role(self, role_id):
+        role_id = str(role_id)
+        with self.lock:
+            self.roles.pop(role_id, None)
+            # Only the users holding this role have to be derived again
+            for user_id, user in self.users.items():
+                if user is not None and role_id in user[1]:
+                    self.user_masks.pop(user_id, None)
+
+    def invalidate_all(self):
+        with self.lock:
+            self.users.clear()
+            self.roles.clear()
+            self.user_masks.clear()
+
+    # **********************************************************************************
+    #                                   Lookups
+    # **********************************************************************************
+    def get_user(self, user_id) -> t.Optional[t.Tuple[bool, t.List[str]]]:
+        user_id = str(user_id)
+        with self.lock:
+            if user_id not in self.users:
+                self.users[user_id] = self.user_loader(user_id)
+            return self.users[user_id]
+
+    def get_role(self, role_id) -> t.Tuple[str, t.Dict[str, str]]:
+        role_id = str(role_id)
+        with self.lock:
+            if role_id not in self.roles:
+                self.roles[role_id] = self.role_loader(role_id)
+            return self.roles[role_id]
+
+    def get_role_masks(self, user_id) -> t.Dict[str, str]:
+        """
+        Returns {server_id: mask} for every server the user reaches through
+        one of its roles. When several roles grant the same server the role
+        with the lowest id wins, matching the order the database used to
+        return them in.
+        """
+        user_id = str(user_id)
+        with self.lock:
+            masks = self.user_masks.get(user_id)
+            if masks is not None:
+                return masks
+            user = self.get_user(user_id)
+            masks = {}
+            if user is not None:
+                for role_id in user[1]:
+                    for server_id, mask in self.get_role(role_id)[1].items():
+                        masks.setdefault(server_id, mask)
+            self.user_masks[user_id] = masks
+            return masks
+
+    def is_superuser(self, user_id) -> bool:
+        user = self.get_user(user_id)
+        return user is not None and user[0]
+
+    def get_mask(self, user_id, server_id) -> str:
+        if self.is_superuser(user_id):
+            return "1" * self.mask_length
+        return self.get_role_masks(user_id).get(str(server_id), "0" * self.mask_length)
+
+    def get_server_ids(self, user_id) -> t.List[str]:
+        # Servers the user can reach through its roles
+        return list(self.get_role_masks(user_id).keys())
+
+    def get_role_names(self, user_id) -> t.Set[str]:
+        user = self.get_user(user_id)
+        if user is None:
+            return set()
+        return {self.get_role(role_id)[0] for role_id in user[1]}
@@ -1,6 +1,5 @@
 from contextlib import redirect_stderr
 import os
-import io
 import re
 import shutil
 import time
@@ -9,7 +8,6 @@ import base64
 import threading
 import logging.config
 import subprocess
-import html
 import glob
 import json
 
@@ -25,18 +23,24 @@ from apscheduler.jobstores.base import JobLookupError, ConflictingIdError
 from prometheus_client import CollectorRegistry, Gauge, Info
 
 from app.classes.minecraft.stats import Stats
-from app.classes.minecraft.mc_ping import ping, ping_bedrock
+from app.classes.minecraft.ping_engine import PingEngine
 from app.classes.models.servers import HelperServers, Servers
 from app.classes.models.server_stats import HelperServerStats
-from app.classes.models.management import HelpersManagement, HelpersWebhooks
+from app.classes.models.management import HelpersManagement
 from app.classes.models.users import HelperUsers
 from app.classes.models.server_permissions import PermissionsServers
 from app.classes.shared.console import Console
+from app.classes.shared.console_multiplexer import ConsoleMultiplexer
+from app.classes.shared.backup_snapshots import SnapshotStore
+from app.classes.shared.backup_archives import BackupFormats
+from app.classes.shared.dir_size_tracker import DirSizeTracker
+from app.classes.shared.server_console import ConsoleScrollback, ServerOutBuf
+from app.classes.shared.status_snapshot import StatusSnapshot, StatusSnapshotCache
+from app.classes.shared.webhook_dispatcher import WebhookDispatcher
 from app.classes.shared.helpers import Helpers
 from app.classes.shared.file_helpers import FileHelpers
 from app.classes.shared.null_writer import NullWriter
 from app.classes.shared.websocket_manager import WebSocketManager
-from app.classes.web.webhooks.webhook_factory import WebhookFactory
 
 with redirect_stderr(NullWriter()):
     import psutil
@@ -56,99 +60,16 @@ def callback(called_func):
         try:
             res = called_func(*args, **kwargs)
         finally:
-            events = WebhookFactory.get_monitored_events()
-            if called_func.__name__ in events:
-                server_webhooks = HelpersWebhooks.get_webhooks_by_server(
-                    args[0].server_id, True
+            # Only queued here, webhooks are sent from the dispatcher's workers
+            if res is not False:
+                WebhookDispatcher().dispatch(
+                    args[0].server_id, args[0].name, called_func.__name__
                 )
-                for swebhook in server_webhooks:
-                    if called_func.__name__ in str(swebhook.trigger).split(","):
-                        logger.info(
-                            f"Found callback for event {called_func.__name__}"
-                            f" for server {args[0].server_id}"
-                        )
-                        webhook = HelpersWebhooks.get_webhook_by_id(swebhook.id)
-                        webhook_provider = WebhookFactory.create_provider(
-                            webhook["webhook_type"]
-                        )
-                        if res is not False and swebhook.enabled:
-                            webhook_provider.send(
-                                bot_name=webhook["bot_name"],
-                                server_name=args[0].name,
-                                title=webhook["name"],
-                                url=webhook["url"],
-                                message=webhook["body"],
-                                color=webhook["color"],
-                            )
         return res
 
     return wrapper
 
 
-class ServerOutBuf:
-    lines = {}
-
-    def __init__(self, helper, proc, server_id):
-        self.helper = helper
-        self.proc = proc
-        self.server_id = str(server_id)
-        # Buffers text for virtual_terminal_lines config number of lines
-        self.max_lines = self.helper.get_setting("virtual_terminal_lines")
-        self.line_buffer = ""
-        ServerOutBuf.lines[self.server_id] = []
-        self.lsi = 0
-
-    def process_byte(self, char):
-        if char == os.linesep[self.lsi]:
-            self.lsi += 1
-        else:
-            self.lsi = 0
-            self.line_buffer += char
-
-        if self.lsi >= len(os.linesep):
-            self.lsi = 0
-            ServerOutBuf.lines[self.server_id].append(self.line_buffer)
-
-            self.new_line_handler(self.line_buffer)
-            self.line_buffer = ""
-            # Limit list length to self.max_lines:
-            if len(ServerOutBuf.lines[self.server_id]) > self.max_lines:
-                ServerOutBuf.lines[self.server_id].pop(0)
-
-    def check(self):
-        text_wrapper = io.TextIOWrapper(
-            self.proc.stdout, encoding="UTF-8", errors="ignore", newline=""
-        )
-        while True:
-            if self.proc.poll() is None:
-                char = text_wrapper.read(1)  # modified
-                # TODO: we may want to benchmark reading in blocks and userspace
-                # processing it later, reads are kind of expensive as a syscall
-                self.process_byte(char)
-            else:
-                flush = text_wrapper.read()  # modified
-                for char in flush:
-                    self.process_byte(char)
-                break
-
-    def new_line_handler(self, new_line):
-        new_line = re.sub("(\033\\[(0;)?[0-9]*[A-z]?(;[0-9])?m?)", " ", new_line)
-        new_line = re.sub("[A-z]{2}\b\b", "", new_line)
-        highlighted = self.helper.log_colors(html.escape(new_line))
-
-        logger.debug("Broadcasting new virtual terminal line")
-
-        # TODO: Do not send data to clients who do not have permission to view
-        # this server's console
-        if len(WebSocketManager().clients) > 0:
-            WebSocketManager().broadcast_page_params(
-                "/panel/server_detail",
-                {"id": self.server_id},
-                "vterm_new_line",
-                {"line": highlighted + "<br />"},
-            )
-
-
 # **********************************************************************************
 #                               Minecraft Server Class
 # **********************************************************************************
@@ -183,6 +104,10 @@ class ServerInstance:
         self.stats_helper = HelperServerStats(self.server_id)
         self.last_backup_failed = False
         self.server_registry = CollectorRegistry()
+        # Buffers text for virtual_terminal_lines config number of lines
+        self.scrollback = ConsoleScrollback(
+            self.helper.get_setting("virtual_terminal_lines")
+        )
 
         try:
             with open(
@@ -223,6 +148,7 @@ class ServerInstance:
         self.server_object = server_data
         self.stats_helper.select_database()
         self.reload_server_settings()
+        StatusSnapshotCache().invalidate(self.server_id)
 
     def reload_server_settings(self):
         server_data = HelperServers.get_server_data_by_id(self.server_id)
@@ -574,13 +500,27 @@ class ServerInstance:
                     self.stats_helper.finish_import()
                 return False
 
-        out_buf = ServerOutBuf(self.helper, self.process, self.server_id)
+        self.scrollback.clear()
+        out_buf = ServerOutBuf(
+            self.helper,
+            self.process,
+            self.server_id,
+            self.scrollback,
+            self.console_closed,
+        )
 
         logger.debug(f"Starting virtual terminal listener for server {self.name}")
-        threading.Thread(
-            target=out_buf.check, daemon=True, name=f"{self.server_id}_virtual_terminal"
-        ).start()
+        if ConsoleMultiplexer.is_supported():
+            ConsoleMultiplexer().register(out_buf)
+        else:
+            threading.Thread(
+                target=out_buf.check,
+                daemon=True,
+                name=f"{self.server_id}_virtual_terminal",
+            ).start()
 
+        # Snapshots taken before the start still see the server stopped
+        StatusSnapshotCache().invalidate(self.server_id)
         self.is_crashed = False
         self.stats_helper.server_crash_reset()
 
@@ -822,6 +762,19 @@ class ServerInstance:
                     WebSocketManager().broadcast_user(user, "send_start_reload", {})
                 break
 
+    def console_closed(self):
+        # The process closed its console, so it has most likely exited. Run the
+        # crash watcher shortly instead of waiting for its next interval, the
+        # small delay gives the process time to be reaped.
+        try:
+            self.server_scheduler.modify_job(
+                f"c_{self.server_id}",
+                next_run_time=datetime.datetime.now(self.tz)
+                + datetime.timedelta(seconds=2),
+            )
+        except JobLookupError:
+            pass
+
     def stop_crash_detection(self):
         # This is only used if the crash detection settings change
         # while the server is running.
@@ -960,6 +913,7 @@ class ServerInstance:
         self.is_crashed = False
         self.updating = False
         self.process = None
+        StatusSnapshotCache().invalidate(self.server_id)
 
     def check_running(self):
         # if process is None, we never tried to start
@@ -1204,8 +1158,13 @@ class ServerInstance:
                 backup_id,
                 conf["backup_name"],
                 conf["compress"],
+                conf["worker_count"],
+                conf["backup_type"],
+                conf["archive_format"],
+                conf["compression_level"],
             )
 
+            removed_snapshot = False
             while (
                 len(self.list_backups(conf)) > conf["max_backups"]
                 and conf["max_backups"] > 0
@@ -1215,6 +1174,14 @@ class ServerInstance:
                 oldfile_path = f"{backup_location}/{oldfile['path']}"
                 logger.info(f"Removing old backup '{oldfile['path']}'")
                 os.remove(Helpers.get_os_understandable_path(oldfile_path))
+                removed_snapshot = removed_snapshot or SnapshotStore.is_snapshot(
+                    oldfile_path
+                )
+            if removed_snapshot:
+                # Drop the chunks only the removed snapshots referred to
+                SnapshotStore(
+                    Helpers.get_os_understandable_path(backup_location)
+                ).collect_garbage()
 
             logger.info(f"Backup of server: {self.name} completed")
             results = {
@@ -1223,13 +1190,14 @@ class ServerInstance:
                 "current_file": 0,
                 "backup_id": backup_id,
             }
-            if len(WebSocketManager().clients) > 0:
-                WebSocketManager().broadcast_page_params(
-                    "/panel/server_detail",
-                    {"id": str(self.server_id)},
-                    "backup_status",
-                    results,
-                )
+            # Goes through the same channel as the progress updates so it
+            # can't be overtaken by one of them
+            WebSocketManager().broadcast_page_params_coalesced(
+                "/panel/server_detail",
+                {"id": str(self.server_id)},
+                "backup_status",
+                results,
+            )
             server_users = PermissionsServers.get_server_user_list(self.server_id)
             for user in server_users:
                 WebSocketManager().broadcast_user(
@@ -1269,13 +1237,14 @@ class ServerInstance:
                 "current_file": 0,
                 "backup_id": backup_id,
             }
-            if len(WebSocketManager().clients) > 0:
-                WebSocketManager().broadcast_page_params(
-                    "/panel/server_detail",
-                    {"id": str(self.server_id)},
-                    "backup_status",
-                    results,
-                )
+            # Goes through the same channel as the progress updates so it
+            # can't be overtaken by one of them
+            WebSocketManager().broadcast_page_params_coalesced(
+                "/panel/server_detail",
+                {"id": str(self.server_id)},
+                "backup_status",
+                results,
+            )
             if was_server_running:
                 logger.info(
                     "Backup complete. User had shutdown preference. Starting server."
@@ -1312,10 +1281,23 @@ class ServerInstance:
         ):
             return []
         files = Helpers.get_human_readable_files_sizes(
-            Helpers.list_dir_by_date(
-                Helpers.get_os_understandable_path(backup_location)
-            )
+            [
+                path
+                for path in Helpers.list_dir_by_date(
+                    Helpers.get_os_understandable_path(backup_location)
+                )
+                if BackupFormats.for_file(path) or SnapshotStore.is_snapshot(path)
+            ]
         )
+        for f in files:
+            if SnapshotStore.is_snapshot(f["path"]):
+                # The manifest is tiny, show the size of the backed up files
+                try:
+                    f["size"] = Helpers.human_readable_file_size(
+                        SnapshotStore.read_header(f["path"])["total_size"]
+                    )
+                except (OSError, ValueError, KeyError) as e:
+                    logger.warning(f"Unable to read backup snapshot {f['path']}: {e}")
         return [
             {
                 "path": os.path.relpath(
@@ -1325,7 +1307,6 @@ class ServerInstance:
                 "size": f["size"],
             }
             for f in files
-            if f["path"].endswith(".zip")
         ]
 
     @callback
@@ -1546,14 +1527,10 @@ class ServerInstance:
             WebSocketManager().broadcast_user(user, "remove_spinner", {})
 
     def start_dir_calc_task(self):
-        server_dt = HelperServers.get_server_data_by_id(self.server_id)
-        self.server_size = self.stats.get_server_dir_size(server_dt["path"])
-        self.dir_scheduler.add_job(
-            self.calc_dir_size,
-            "interval",
-            minutes=self.helper.get_setting("dir_size_poll_freq_minutes"),
-            id=str(self.server_id) + "_dir_poll",
-        )
+        # The size is measured in the background and kept up to date by the
+        # tracker, booting doesn't wait for it
+        self.server_size = Helpers.human_readable_file_size(0)
+        self.calc_dir_size()
         self.dir_scheduler.add_job(
             self.cache_players,
             "interval",
@@ -1563,7 +1540,10 @@ class ServerInstance:
 
     def calc_dir_size(self):
         server_dt = HelperServers.get_server_data_by_id(self.server_id)
-        self.server_size = self.stats.get_server_dir_size(server_dt["path"])
+        DirSizeTracker().track(self.server_id, server_dt["path"], self.set_dir_size)
+
+    def set_dir_size(self, size: int):
+        self.server_size = Helpers.human_readable_file_size(size)
 
     # **********************************************************************************
     #                               Minecraft Servers Statistics
@@ -1652,47 +1632,75 @@ class ServerInstance:
                 return True
         return False
 
-    def get_servers_stats(self):
-        server_stats = {}
-
-        logger.info("Getting Stats for Server " + self.name + " ...")
-
-        server_id = self.server_id
-        server = HelperServers.get_server_data_by_id(server_id)
-
-        logger.debug(f"Getting stats for server: {server_id}")
-
-        # get our server object, settings and data dictionaries
-        self.reload_server_settings()
-
-        # process stats
-        p_stats = Stats._try_get_process_stats(self.process, self.check_running())
+    def take_status_snapshot(self):
+        server = HelperServers.get_server_data_by_id(self.server_id)
+        if not server:
+            return None
+        # Same as reload_server_settings, without looking the server up twice
+        self.settings = server
+        running = self.check_running()
+        p_stats = Stats._try_get_process_stats(self.process, running)
         internal_ip = server["server_ip"]
         server_port = server["server_port"]
-        server_name = server.get("server_name", f"ID#{server_id}")
+        server_type = server["type"]
 
-        logger.debug(f"Pinging server '{server}' on {internal_ip}:{server_port}")
-        if HelperServers.get_server_type_by_id(server_id) == "minecraft-bedrock":
-            int_mc_ping = ping_bedrock(internal_ip, int(server_port))
+        logger.debug(f"Pinging server '{self.name}' on {internal_ip}:{server_port}")
+        if server_type == "minecraft-bedrock":
+            int_mc_ping = PingEngine().ping(internal_ip, server_port, bedrock=True)
         else:
             try:
-                int_mc_ping = ping(internal_ip, int(server_port))
+                int_mc_ping = PingEngine().ping(internal_ip, server_port)
             except:
                 int_mc_ping = False
 
-        int_data = False
         ping_data = {}
-
         # if we got a good ping return, let's parse it
         if int_mc_ping:
-            int_data = True
-            if (
-                HelperServers.get_server_type_by_id(server["server_id"])
-                == "minecraft-bedrock"
-            ):
+            if server_type == "minecraft-bedrock":
                 ping_data = Stats.parse_server_raknet_ping(int_mc_ping)
             else:
                 ping_data = Stats.parse_server_ping(int_mc_ping)
+
+        return StatusSnapshot(
+            time.monotonic(),
+            server,
+            server_type,
+            running,
+            p_stats,
+            int_mc_ping,
+            ping_data,
+        )
+
+    def get_status_snapshot(self):
+        """
+        Server data, process stats and ping of the server, shared by every
+        caller within stats_snapshot_ttl_seconds
+        """
+        return StatusSnapshotCache().get(self.server_id, self.take_status_snapshot)
+
+    def get_servers_stats(self):
+        server_stats = {}
+
+        logger.info("Getting Stats for Server " + self.name + " ...")
+
+        server_id = self.server_id
+        logger.debug(f"Getting stats for server: {server_id}")
+
+        # get our server object, settings and data dictionaries
+        snapshot = self.get_status_snapshot()
+        server = snapshot.server if snapshot else {}
+
+        # process stats
+        p_stats = (
+            snapshot.process_stats
+            if snapshot
+            else Stats._try_get_process_stats(self.process, self.check_running())
+        )
+        server_port = server.get("server_port")
+        server_name = server.get("server_name", f"ID#{server_id}")
+
+        int_data = bool(snapshot and snapshot.ping)
+        ping_data = snapshot.ping_data if snapshot else {}
         # Makes sure we only show stats when a server is online
         # otherwise people have gotten confused.
         if self.check_running():
@@ -1737,29 +1745,20 @@ class ServerInstance:
         return server_stats
 
     def get_server_players(self):
-        server = HelperServers.get_server_data_by_id(self.server_id)
-
-        logger.debug(f"Getting players for server {server['server_name']}")
-
-        internal_ip = server["server_ip"]
-        server_port = server["server_port"]
-
-        logger.debug(f"Pinging {internal_ip} on port {server_port}")
-        if HelperServers.get_server_type_by_id(self.server_id) != "minecraft-bedrock":
-            int_mc_ping = ping(internal_ip, int(server_port))
-
-            ping_data = {}
+        snapshot = self.get_status_snapshot()
+        if snapshot is None:
+            return []
 
+        logger.debug(f"Getting players for server {snapshot.server['server_name']}")
+        if snapshot.server_type != "minecraft-bedrock":
             # if we got a good ping return, let's parse it
-            if int_mc_ping:
-                ping_data = Stats.parse_server_ping(int_mc_ping)
-                return ping_data["players"]
+            if snapshot.ping:
+                return snapshot.ping_data["players"]
         return []
 
     def get_raw_server_stats(self, server_id):
-        try:
-            server = HelperServers.get_server_obj(server_id)
-        except:
+        snapshot = self.get_status_snapshot()
+        if snapshot is None:
             return {
                 "id": server_id,
                 "started": False,
@@ -1780,40 +1779,29 @@ class ServerInstance:
             }
 
         server_stats = {}
-        if not server:
-            return {}
-        server_dt = HelperServers.get_server_data_by_id(server_id)
+        server_dt = snapshot.server
 
         logger.debug(f"Getting stats for server: {server_id}")
 
-        # get our server object, settings and data dictionaries
-        self.reload_server_settings()
-
         # world data
         server_name = server_dt["server_name"]
 
         # process stats
-        p_stats = Stats._try_get_process_stats(self.process, self.check_running())
+        p_stats = snapshot.process_stats
 
-        internal_ip = server_dt["server_ip"]
         server_port = server_dt["server_port"]
 
-        logger.debug(f"Pinging server '{self.name}' on {internal_ip}:{server_port}")
-        if HelperServers.get_server_type_by_id(server_id) == "minecraft-bedrock":
-            int_mc_ping = ping_bedrock(internal_ip, int(server_port))
-        else:
-            int_mc_ping = ping(internal_ip, int(server_port))
-
+        int_mc_ping = snapshot.ping
         int_data = False
         ping_data = {}
         # Makes sure we only show stats when a server is online
         # otherwise people have gotten confused.
         if self.check_running():
             # if we got a good ping return, let's parse it
-            if HelperServers.get_server_type_by_id(server_id) != "minecraft-bedrock":
+            if snapshot.server_type != "minecraft-bedrock":
                 if int_mc_ping:
                     int_data = True
-                    ping_data = Stats.parse_server_ping(int_mc_ping)
+                    ping_data = snapshot.ping_data
 
                 server_stats = {
                     "id": server_id,
@@ -1837,7 +1825,7 @@ class ServerInstance:
             else:
                 if int_mc_ping:
                     int_data = True
-                    ping_data = Stats.parse_server_raknet_ping(int_mc_ping)
+                    ping_data = snapshot.ping_data
                     try:
                         server_icon = base64.encodebytes(ping_data["icon"])
                     except Exception as ex:
@@ -1914,13 +1902,7 @@ class ServerInstance:
             {"version": f"{server_stats.get('version')}"}
         )
         self.online_players.labels(f"{self.server_id}").set(server_stats.get("online"))
-
-        # delete old data
-        max_age = self.helper.get_setting("history_max_age")
-        now = datetime.datetime.now()
-        minimum_to_exist = now - datetime.timedelta(days=max_age)
-
-        self.stats_helper.remove_old_stats(minimum_to_exist)
+        # old data is removed by the stats writer's periodic sweep
 
     def init_registries(self):
         # REGISTRY Entries for Server Stats functions
@@ -1950,6 +1932,6 @@ class ServerInstance:
             registry=self.server_registry,
         )
 
-    def get_server_history(self):
-        history = self.stats_helper.get_history_stats(self.server_id, 1)
+    def get_server_history(self, hours=1, max_points=None):
+        history = self.stats_helper.get_history_stats(self.server_id, hours, max_points)
         return history
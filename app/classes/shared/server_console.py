@@ -0,0 +1,127 @@
+import os
+import re
+import html
+import codecs
+import logging
+import threading
+import collections
+import typing as t
+
+from app.classes.shared.websocket_manager import WebSocketManager
+
+logger = logging.getLogger(__name__)
+
+ANSI_ESCAPE = re.compile("(\033\\[(0;)?[0-9]*[A-z]?(;[0-9])?m?)")
+BACKSPACE_PAIR = re.compile("[A-z]{2}\b\b")
+
+
+class ConsoleScrollback:
+    """
+    Fixed capacity ring buffer holding the most recent console lines of a
+    server. Every line gets a monotonically increasing sequence number so
+    clients can ask for only the lines they haven't seen yet.
+    """
+
+    def __init__(self, max_lines: int):
+        self.lines = collections.deque(maxlen=max(int(max_lines), 1))
+        # Sequence number of the most recently appended line
+        self.last_seq = 0
+        self.lock = threading.Lock()
+
+    def append(self, line: str) -> int:
+        with self.lock:
+            self.last_seq += 1
+            # Appending to a full deque drops the oldest line in O(1)
+            self.lines.append(line)
+            return self.last_seq
+
+    def clear(self):
+        # The sequence counter keeps running so polling clients notice the reset
+        with self.lock:
+            self.lines.clear()
+
+    def get_lines(self, since: int = None) -> t.Tuple[t.List[str], int]:
+        """
+        Returns the buffered lines with a sequence number greater than since
+        (all of them if since is None) along with the current last sequence
+        number
+        """
+        with self.lock:
+            lines = list(self.lines)
+            last_seq = self.last_seq
+        # A client ahead of us means our counter was reset, send everything
+        if since is None or since < 0 or since > last_seq:
+            return lines, last_seq
+        return lines[len(lines) - min(last_seq - since, len(lines)) :], last_seq
+
+
+class ServerOutBuf:
+    # Size of the blocks read from the process pipe in one syscall
+    read_block_size = 64 * 1024
+
+    def __init__(
+        self, helper, proc, server_id, scrollback: ConsoleScrollback, on_close=None
+    ):
+        self.helper = helper
+        self.proc = proc
+        self.server_id = str(server_id)
+        self.scrollback = scrollback
+        # Called once the process closes its end of the pipe
+        self.on_close = on_close
+        # Holds the partial line left over at the end of the last block
+        self.line_buffer = ""
+        self.decoder = codecs.getincrementaldecoder("UTF-8")(errors="ignore")
+
+    def process_block(self, block: bytes):
+        text = self.line_buffer + self.decoder.decode(block)
+        new_lines = text.split(os.linesep)
+        # The last item is whatever came after the final line separator,
+        # keep it around until the rest of the line arrives
+        self.line_buffer = new_lines.pop()
+        if not new_lines:
+            return
+        for line in new_lines:
+            self.scrollback.append(line)
+        self.new_lines_handler(new_lines)
+
+    def check(self):
+        while True:
+            # read1 returns as soon as any data is available (up to the block
+            # size) and an empty bytes object once the pipe is closed
+            block = self.proc.stdout.read1(self.read_block_size)
+            if not block:
+                break
+            self.process_block(block)
+        self.close()
+
+    def close(self):
+        if self.on_close is not None:
+            self.on_close()
+
+    def new_lines_handler(self, new_lines):
+        # Nobody is watching, skip the highlighting work altogether
+        if not WebSocketManager().has_clients(
+            "/panel/server_detail", {"id": self.server_id}
+        ):
+            return
+
+        cleaned = []
+        for new_line in new_lines:
+            new_line = ANSI_ESCAPE.sub(" ", new_line)
+            new_line = BACKSPACE_PAIR.sub("", new_line)
+            cleaned.append(html.escape(new_line))
+
+        logger.debug("Broadcasting new virtual terminal lines")
+
+        # TODO: Do not send data to clients who do not have permission to view
+        # this server's console
+        WebSocketManager().broadcast_page_params_coalesced(
+            "/panel/server_detail",
+            {"id": self.server_id},
+            "vterm_new_line",
+            [
+                highlighted + "<br />"
+                for highlighted in self.helper.log_colors_lines(cleaned)
+            ],
+            batch_key="lines",
+        )
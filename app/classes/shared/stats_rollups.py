@@ -0,0 +1,141 @@
+import datetime
+import typing as t
+
+from peewee import EXCLUDED, fn
+
+Sample = t.Tuple[datetime.datetime, t.Dict[str, float]]
+
+
+class StatsRollups:
+    """
+    Keeps 1 minute, 5 minute and 1 hour rollups (sample count and min, max
+    and average of every metric) next to the raw stats samples.
+
+    Rollups are updated as samples are written, a batch of samples is merged
+    into the existing buckets with a single upsert. History queries pick the
+    finest resolution that still fits the requested range into the point
+    budget, so a week long chart reads a few hundred rows instead of every
+    raw sample.
+
+    Rollup models need resolution, bucket and samples fields, a unique index
+    on (resolution, bucket) and <metric>_min, <metric>_max and <metric>_avg
+    fields for every metric they track.
+    """
+
+    resolutions = (60, 5 * 60, 60 * 60)
+    default_max_points = 1000
+
+    @staticmethod
+    def bucket_start(created: datetime.datetime, resolution: int):
+        # Every resolution divides an hour, so buckets are aligned within the
+        # hour and DST changes don't shift them
+        offset = (created.minute * 60 + created.second) % resolution
+        return created.replace(microsecond=0) - datetime.timedelta(seconds=offset)
+
+    @staticmethod
+    def to_number(value) -> float:
+        # Stats fall back to False or "" when the server can't be reached
+        try:
+            return float(value or 0)
+        except (TypeError, ValueError):
+            return 0.0
+
+    @staticmethod
+    def aggregate(samples: t.Iterable[Sample], metrics: t.Sequence[str]) -> dict:
+        """Groups samples into {(resolution, bucket): {metric: [min, max, sum]}}"""
+        groups = {}
+        for created, values in samples:
+            values = {m: StatsRollups.to_number(values.get(m)) for m in metrics}
+            for resolution in StatsRollups.resolutions:
+                key = (resolution, StatsRollups.bucket_start(created, resolution))
+                group = groups.get(key)
+                if group is None:
+                    group = {"samples": 0}
+                    for metric, value in values.items():
+                        group[metric] = [value, value, 0.0]
+                    groups[key] = group
+                group["samples"] += 1
+                for metric, value in values.items():
+                    low, high, total = group[metric]
+                    group[metric] = [min(low, value), max(high, value), total + value]
+        return groups
+
+    @staticmethod
+    def add_samples(
+        model, samples: t.Iterable[Sample], metrics: t.Sequence[str], database=None
+    ):
+        groups = StatsRollups.aggregate(samples, metrics)
+        if not groups:
+            return
+        rows = []
+        for (resolution, bucket), group in groups.items():
+            row = {
+                model.resolution: resolution,
+                model.bucket: bucket,
+                model.samples: group["samples"],
+            }
+            for metric in metrics:
+                low, high, total = group[metric]
+                row[getattr(model, f"{metric}_min")] = low
+                row[getattr(model, f"{metric}_max")] = high
+                row[getattr(model, f"{metric}_avg")] = total / group["samples"]
+            rows.append(row)
+
+        # Merges the batch into buckets that already exist, SQLite evaluates
+        # every expression against the row as it was before the update
+        update = {model.samples: model.samples + EXCLUDED.samples}
+        for metric in metrics:
+            low = getattr(model, f"{metric}_min")
+            high = getattr(model, f"{metric}_max")
+            avg = getattr(model, f"{metric}_avg")
+            update[low] = fn.MIN(low, getattr(EXCLUDED, low.column_name))
+            update[high] = fn.MAX(high, getattr(EXCLUDED, high.column_name))
+            update[avg] = (
+                avg * model.samples
+                + getattr(EXCLUDED, avg.column_name) * EXCLUDED.samples
+            ) / (model.samples + EXCLUDED.samples)
+        model.insert_many(rows).on_conflict(
+            conflict_target=[model.resolution, model.bucket], update=update
+        ).execute(database)
+
+    @staticmethod
+    def pick_resolution(hours: float, max_points: int, raw_interval: int) -> int:
+        """Returns the rollup resolution to read, 0 for the raw samples"""
+        span = hours * 60 * 60
+        if span / max(raw_interval, 1) <= max_points:
+            return 0
+        for resolution in StatsRollups.resolutions:
+            if span / resolution <= max_points:
+                return resolution
+        return StatsRollups.resolutions[-1]
+
+    @staticmethod
+    def get_history(
+        model,
+        resolution: int,
+        since: datetime.datetime,
+        metrics: t.Sequence[str],
+        time_key: str,
+        database=None,
+    ) -> t.List[dict]:
+        """
+        Rollup rows shaped like the raw samples: the average under the metric
+        name, plus <metric>_min and <metric>_max.
+        """
+        query = (
+            model.select()
+            .where(model.resolution == resolution)
+            .where(model.bucket >= StatsRollups.bucket_start(since, resolution))
+            .order_by(model.bucket)
+            .dicts()
+            .execute(database)
+        )
+        history = []
+        for row in query:
+            point = {time_key: row["bucket"], "samples": row["samples"]}
+            for metric in metrics:
+                point[metric] = row[f"{metric}_avg"]
+                point[f"{metric}_min"] = row[f"{metric}_min"]
+                point[f"{metric}_max"] = row[f"{metric}_max"]
+            history.append(point)
+        return history
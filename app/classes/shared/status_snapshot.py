@@ -0,0 +1,102 @@
+import time
+import logging
+import threading
+import typing as t
+
+from prometheus_client import Counter
+
+from app.classes.shared.singleton import Singleton
+
+logger = logging.getLogger(__name__)
+
+STATUS_SNAPSHOT_HITS = Counter(
+    "crafty_status_snapshot_hits",
+    "Server status requests answered from the snapshot cache",
+)
+STATUS_SNAPSHOT_MISSES = Counter(
+    "crafty_status_snapshot_misses",
+    "Server status requests that had to look up, sample and ping the server",
+)
+
+
+class StatusSnapshot(t.NamedTuple):
+    taken: float
+    # Servers row as HelperServers.get_server_data_by_id returns it
+    server: dict
+    server_type: str
+    running: bool
+    process_stats: dict
+    # What the ping returned, and what Stats made of it ({} without an answer)
+    ping: t.Any
+    ping_data: dict
+
+
+class StatusSnapshotCache(metaclass=Singleton):
+    """
+    Keeps the latest status snapshot of every server for ttl seconds, so the
+    stats recorder, the player cache and the realtime stats share one server
+    lookup, one process sample and one ping.
+
+    Concurrent requests for the same server wait for the snapshot that is
+    being taken instead of taking their own.
+    """
+
+    # Default for the stats_snapshot_ttl_seconds setting
+    ttl = 5
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshots: t.Dict[str, StatusSnapshot] = {}
+        # server id -> lock held while its snapshot is taken
+        self.building: t.Dict[str, threading.Lock] = {}
+
+    def follow_settings(self, helper):
+        self.ttl = helper.get_setting("stats_snapshot_ttl_seconds", self.ttl)
+        helper.subscribe_settings(
+            self.on_settings_changed, ["stats_snapshot_ttl_seconds"]
+        )
+
+    def on_settings_changed(self, changed: dict):
+        self.ttl = changed["stats_snapshot_ttl_seconds"]
+        logger.info(f"Reusing server status snapshots for {self.ttl}s")
+
+    def get(
+        self, server_id, take: t.Callable[[], t.Optional[StatusSnapshot]]
+    ) -> t.Optional[StatusSnapshot]:
+        key = str(server_id)
+        snapshot = self.get_fresh(key)
+        if snapshot is not None:
+            return snapshot
+
+        with self.lock:
+            building = self.building.setdefault(key, threading.Lock())
+        with building:
+            # Someone else may have taken it while we were waiting
+            snapshot = self.get_fresh(key)
+            if snapshot is not None:
+                return snapshot
+            STATUS_SNAPSHOT_MISSES.inc()
+            snapshot = take()
+            if snapshot is not None:
+                with self.lock:
+                    self.snapshots[key] = snapshot
+            return snapshot
+
+    def get_fresh(self, key: str) -> t.Optional[StatusSnapshot]:
+        with self.lock:
+            snapshot = self.snapshots.get(key)
+            if snapshot is None or time.monotonic() - snapshot.taken >= self.ttl:
+                return None
+        STATUS_SNAPSHOT_HITS.inc()
+        return snapshot
+
+    def invalidate(self, server_id):
+        # The next request takes a new snapshot, after the server row changed
+        # or the server was started or stopped
+        with self.lock:
+            self.snapshots.pop(str(server_id), None)
+
+    def forget(self, server_id):
+        with self.lock:
+            self.snapshots.pop(str(server_id), None)
+            self.building.pop(str(server_id), None)
@@ -13,6 +13,7 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 
 from app.classes.models.management import HelpersManagement
+from app.classes.models.server_stats import StatsWriter
 from app.classes.models.users import HelperUsers
 from app.classes.controllers.users_controller import UsersController
 from app.classes.shared.console import Console
@@ -21,6 +22,8 @@ from app.classes.shared.helpers import Helpers
 from app.classes.shared.main_controller import Controller
 from app.classes.web.tornado_handler import Webserver
 from app.classes.shared.websocket_manager import WebSocketManager
+from app.classes.shared.dir_size_tracker import DirSizeTracker
+from app.classes.shared.webhook_dispatcher import WebhookDispatcher
 
 logger = logging.getLogger("apscheduler")
 command_log = logging.getLogger("cmd_queue")
@@ -155,6 +158,21 @@ class TasksManager:
             self.controller.servers.stop_all_servers()
         except:
             logger.info("Caught error during shutdown", exc_info=True)
+        try:
+            # Lets the stop_server webhooks of the servers above go out
+            WebhookDispatcher().join(10)
+        except:
+            logger.info(
+                "Caught error during shutdown - unable to send webhooks",
+                exc_info=True,
+            )
+        try:
+            StatsWriter().flush()
+        except:
+            logger.info(
+                "Caught error during shutdown - unable to save server stats",
+                exc_info=True,
+            )
         try:
             temp_dir = os.path.join(self.controller.project_root, "temp")
             FileHelpers.del_dirs(temp_dir)
@@ -699,6 +717,17 @@ class TasksManager:
             id="stats",
         )
 
+    def start_dir_size_polling(self):
+        poll_minutes = self.helper.get_setting("dir_size_poll_freq_minutes")
+        logger.info(f"Polling server directory sizes every {poll_minutes} minutes")
+        # Servers register themselves with the tracker, one job covers them all
+        self.scheduler.add_job(
+            DirSizeTracker().poll,
+            "interval",
+            minutes=poll_minutes,
+            id="dir_size_poll",
+        )
+
     def big_bucket_cache_refresher(self):
         logger.info("Refreshing big bucket cache on start")
         self.controller.big_bucket.refresh_cache()
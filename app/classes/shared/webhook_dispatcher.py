@@ -0,0 +1,188 @@
+import time
+import queue
+import logging
+import threading
+import typing as t
+
+from prometheus_client import Counter, Gauge
+
+from app.classes.models.management import HelpersWebhooks
+from app.classes.shared.singleton import Singleton
+from app.classes.web.webhooks.webhook_factory import WebhookFactory
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_QUEUE_DEPTH = Gauge(
+    "crafty_webhook_queue_depth", "Server events waiting for their webhooks"
+)
+WEBHOOKS_FAILED = Counter(
+    "crafty_webhooks_failed", "Webhooks given up on after their last retry"
+)
+WEBHOOKS_DROPPED = Counter(
+    "crafty_webhooks_dropped", "Server events dropped because the queue was full"
+)
+
+
+class WebhookEvent(t.NamedTuple):
+    server_id: str
+    server_name: str
+    event: str
+
+
+class WebhookDispatcher(metaclass=Singleton):
+    """
+    Sends server event webhooks from a small pool of worker threads.
+
+    Server lifecycle methods only put the event on a bounded queue, looking
+    up the webhooks and talking to Discord and friends happens on the
+    workers. Every worker keeps its own keep-alive session, see
+    WebhookProvider.get_session. Failed requests are retried with an
+    exponential backoff, except for client errors other than 429 which won't
+    get better by trying again.
+
+    The webhooks of every server are cached and dropped by the management
+    controller whenever webhooks are created, changed or deleted.
+    """
+
+    max_workers = 4
+    max_queue = 1000
+    retries = 3
+    backoff = 2
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queue: "queue.Queue[WebhookEvent]" = queue.Queue(self.max_queue)
+        self.workers: t.List[threading.Thread] = []
+        # server id -> webhooks of the server
+        self.webhooks: t.Dict[str, t.List[dict]] = {}
+        # Bumped on every invalidation, so a lookup that raced one isn't kept
+        self.generation = 0
+
+    def dispatch(self, server_id, server_name: str, event: str):
+        if event not in WebhookFactory.get_monitored_events():
+            return
+        self.start_workers()
+        try:
+            self.queue.put_nowait(WebhookEvent(str(server_id), server_name, event))
+        except queue.Full:
+            WEBHOOKS_DROPPED.inc()
+            logger.warning(
+                f"Webhook queue is full, dropping {event} of server {server_id}"
+            )
+            return
+        WEBHOOK_QUEUE_DEPTH.inc()
+
+    def start_workers(self):
+        with self.lock:
+            while len(self.workers) < self.max_workers:
+                worker = threading.Thread(
+                    target=self.run,
+                    daemon=True,
+                    name=f"webhook_{len(self.workers)}",
+                )
+                worker.start()
+                self.workers.append(worker)
+
+    def join(self, timeout: float):
+        """Waits up to timeout seconds for the queued webhooks to go out"""
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+    # **********************************************************************************
+    #                                   Webhook Cache
+    # **********************************************************************************
+    def get_webhooks(self, server_id: str) -> t.List[dict]:
+        with self.lock:
+            webhooks = self.webhooks.get(server_id)
+            generation = self.generation
+        if webhooks is None:
+            webhooks = [
+                {"id": webhook_id, **webhook}
+                for webhook_id, webhook in HelpersWebhooks.get_webhooks_by_server(
+                    server_id, False
+                ).items()
+            ]
+            with self.lock:
+                if generation == self.generation:
+                    self.webhooks[server_id] = webhooks
+        return webhooks
+
+    def invalidate(self, server_id=None):
+        with self.lock:
+            self.generation += 1
+            if server_id is None:
+                self.webhooks.clear()
+            else:
+                self.webhooks.pop(str(server_id), None)
+
+    # **********************************************************************************
+    #                                   Sending
+    # **********************************************************************************
+    def run(self):
+        while True:
+            event = self.queue.get()
+            WEBHOOK_QUEUE_DEPTH.dec()
+            try:
+                for webhook in self.get_webhooks(event.server_id):
+                    if not webhook["enabled"]:
+                        continue
+                    if event.event not in str(webhook["trigger"]).split(","):
+                        continue
+                    logger.info(
+                        f"Found callback for event {event.event}"
+                        f" for server {event.server_id}"
+                    )
+                    try:
+                        self.send(webhook, event)
+                    except Exception as e:
+                        WEBHOOKS_FAILED.inc()
+                        logger.error(f"Unable to send webhook {webhook['name']}: {e}")
+            except Exception as e:
+                logger.error(
+                    f"Unable to send webhooks of server {event.server_id}: {e}"
+                )
+            finally:
+                self.queue.task_done()
+
+    def send(self, webhook: dict, event: WebhookEvent):
+        provider = WebhookFactory.create_provider(webhook["webhook_type"])
+        for attempt in range(self.retries + 1):
+            try:
+                provider.send(
+                    bot_name=webhook["bot_name"],
+                    server_name=event.server_name,
+                    title=webhook["name"],
+                    url=webhook["url"],
+                    message=webhook["body"],
+                    color=webhook["color"],
+                )
+                return
+            except RuntimeError as e:
+                delay = self.get_retry_delay(e.__cause__, attempt)
+                if delay is None or attempt == self.retries:
+                    break
+                logger.info(
+                    f"Retrying webhook {webhook['name']} of server "
+                    f"{event.server_id} in {delay}s"
+                )
+                time.sleep(delay)
+        WEBHOOKS_FAILED.inc()
+        logger.error(
+            f"Giving up on webhook {webhook['name']} of server {event.server_id}"
+        )
+
+    def get_retry_delay(self, error, attempt: int) -> t.Optional[float]:
+        delay = self.backoff * 2**attempt
+        response = getattr(error, "response", None)
+        if response is None:
+            # Timeouts and connection errors
+            return delay
+        if response.status_code == 429:
+            try:
+                return min(float(response.headers.get("Retry-After", delay)), 60)
+            except ValueError:
+                return delay
+        if response.status_code >= 500:
+            return delay
+        return None
@@ -0,0 +1,154 @@
+import time
+import logging
+import threading
+import typing as t
+
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+WS_EVENTS_MERGED = Counter(
+    "crafty_websocket_events_merged",
+    "WebSocket events folded into a batched message",
+    ["event"],
+)
+WS_EVENTS_DROPPED = Counter(
+    "crafty_websocket_events_dropped",
+    "WebSocket events superseded by a newer value before they were sent",
+    ["event"],
+)
+
+
+class CoalescedChannel:
+    __slots__ = ("page", "params", "event_type", "batch_key", "pending", "last_sent")
+
+    def __init__(self, page, params, event_type, batch_key):
+        self.page = page
+        self.params = params
+        self.event_type = event_type
+        self.batch_key = batch_key
+        # Latest value, or list of items for batched channels, None if empty
+        self.pending = None
+        self.last_sent = 0.0
+
+
+class EventCoalescer:
+    """
+    Limits every (page, params, event) channel to max_rate messages a second.
+
+    The first event after a quiet period goes out right away. Events arriving
+    faster than that are held back and flushed by a single background thread
+    once the channel's interval has passed:
+    - latest value wins for plain channels (progress updates), earlier
+      values are dropped
+    - channels with a batch_key collect their items and are sent as one
+      {batch_key: [items]} message (console lines)
+    """
+
+    def __init__(self, send_fn: t.Callable[[str, dict, str, t.Any], None]):
+        self.send_fn = send_fn
+        self.interval = 0.0
+        self.channels: t.Dict[tuple, CoalescedChannel] = {}
+        # channel key -> monotonic time the channel may be flushed at
+        self.deadlines: t.Dict[tuple, float] = {}
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def set_max_rate(self, max_rate):
+        # 0 (or less) turns coalescing off, events are sent as they come
+        with self.condition:
+            self.interval = 1.0 / max_rate if max_rate and max_rate > 0 else 0.0
+            self.condition.notify()
+
+    def submit(
+        self, page: str, params: dict, event_type: str, data, batch_key: str = None
+    ):
+        key = (page, tuple(sorted(params.items())), event_type)
+        now = time.monotonic()
+        with self.condition:
+            channel = self.channels.get(key)
+            if channel is None:
+                channel = CoalescedChannel(page, params, event_type, batch_key)
+                self.channels[key] = channel
+
+            if channel.pending is None and now - channel.last_sent >= self.interval:
+                channel.last_sent = now
+                send_now = data
+            else:
+                send_now = None
+                if batch_key is not None:
+                    if channel.pending is None:
+                        channel.pending = list(data)
+                    else:
+                        channel.pending.extend(data)
+                        WS_EVENTS_MERGED.labels(event_type).inc(len(data))
+                else:
+                    if channel.pending is not None:
+                        WS_EVENTS_DROPPED.labels(event_type).inc()
+                    channel.pending = data
+                if key not in self.deadlines:
+                    self.deadlines[key] = channel.last_sent + self.interval
+                    self.ensure_thread()
+                    self.condition.notify()
+
+        if send_now is not None:
+            self.send(channel, send_now)
+
+    def send(self, channel: CoalescedChannel, data):
+        if channel.batch_key is not None:
+            data = {channel.batch_key: data}
+        try:
+            self.send_fn(channel.page, channel.params, channel.event_type, data)
+        except Exception as e:
+            logger.exception(
+                f"Error caught while sending coalesced {channel.event_type} {e}"
+            )
+
+    def ensure_thread(self):
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self.run, daemon=True, name="ws_coalescer"
+            )
+            self.thread.start()
+
+    def take_due(self) -> t.List[t.Tuple[CoalescedChannel, t.Any]]:
+        """
+        Waits until at least one channel is due and takes its pending data.
+        Must be called with the condition held.
+        """
+        while True:
+            now = time.monotonic()
+            due = [key for key, deadline in self.deadlines.items() if deadline <= now]
+            if due:
+                break
+            if self.deadlines:
+                self.condition.wait(min(self.deadlines.values()) - now)
+            else:
+                self.condition.wait()
+
+        ready = []
+        for key in due:
+            del self.deadlines[key]
+            channel = self.channels[key]
+            if channel.pending is not None:
+                ready.append((channel, channel.pending))
+                channel.pending = None
+                channel.last_sent = now
+        return ready
+
+    def run(self):
+        while True:
+            with self.condition:
+                ready = self.take_due()
+                # Forget channels that have been quiet for a while
+                cutoff = time.monotonic() - max(self.interval, 1.0) * 10
+                for key in [
+                    key
+                    for key, channel in self.channels.items()
+                    if channel.pending is None
+                    and channel.last_sent < cutoff
+                    and key not in self.deadlines
+                ]:
+                    del self.channels[key]
+            for channel, data in ready:
+                self.send(channel, data)
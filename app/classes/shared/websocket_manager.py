@@ -1,126 +1,219 @@
-import json
 import logging
+import threading
+import orjson
 
 from app.classes.shared.singleton import Singleton
 from app.classes.shared.console import Console
+from app.classes.shared.websocket_coalescer import EventCoalescer
 from app.classes.models.users import HelperUsers
 
 logger = logging.getLogger(__name__)
 
 
 class WebSocketManager(metaclass=Singleton):
+    """
+    Keeps track of the connected WebSocket clients.
+
+    Besides the set of all clients, clients are indexed by page, by
+    (page, query param, value) and by user id when they are added, so
+    targeted broadcasts only ever look at the clients they are meant for.
+    Clients are expected to have their page, page_query_params and user_id
+    set before they are added and to keep them for the connection lifetime.
+    """
+
+    # Default for the websocket_max_event_rate setting, see EventCoalescer
+    max_event_rate = 10
+
     def __init__(self):
         self.clients = set()
+        self.pages = {}
+        self.page_params = {}
+        self.users = {}
+        # Broadcasts come from server, backup and task threads while clients
+        # come and go on the IOLoop
+        self.lock = threading.Lock()
+        self.coalescer = EventCoalescer(self.broadcast_page_params)
+        self.coalescer.set_max_rate(self.max_event_rate)
+
+    def follow_settings(self, helper):
+        self.set_max_event_rate(
+            helper.get_setting("websocket_max_event_rate", self.max_event_rate)
+        )
+        helper.subscribe_settings(
+            self.on_settings_changed, ["websocket_max_event_rate"]
+        )
+
+    def on_settings_changed(self, changed: dict):
+        self.set_max_event_rate(changed["websocket_max_event_rate"])
+
+    def set_max_event_rate(self, max_rate):
+        logger.info(f"Limiting coalesced WebSocket events to {max_rate}/s")
+        self.coalescer.set_max_rate(max_rate)
+
+    @staticmethod
+    def index_add(index: dict, key, client):
+        index.setdefault(key, set()).add(client)
+
+    @staticmethod
+    def index_remove(index: dict, key, client):
+        clients = index.get(key)
+        if clients is None:
+            return
+        clients.discard(client)
+        if not clients:
+            del index[key]
+
+    @staticmethod
+    def client_keys(client):
+        page = client.page
+        page_params = [
+            (page, key, value)
+            for key, value in (client.page_query_params or {}).items()
+        ]
+        return page, page_params, str(client.user_id)
 
     def add_client(self, client):
-        self.clients.add(client)
+        page, page_params, user_id = self.client_keys(client)
+        with self.lock:
+            self.clients.add(client)
+            self.index_add(self.pages, page, client)
+            for key in page_params:
+                self.index_add(self.page_params, key, client)
+            self.index_add(self.users, user_id, client)
 
     def remove_client(self, client):
-        if client in self.clients:
+        with self.lock:
+            if client not in self.clients:
+                logger.exception("Error caught while removing unknown WebSocket client")
+                return
             self.clients.remove(client)
-        else:
-            logger.exception("Error caught while removing unknown WebSocket client")
-
+            page, page_params, user_id = self.client_keys(client)
+            self.index_remove(self.pages, page, client)
+            for key in page_params:
+                self.index_remove(self.page_params, key, client)
+            self.index_remove(self.users, user_id, client)
+
+    # **********************************************************************************
+    #                                   Lookups
+    # **********************************************************************************
+    def get_clients(self, page: str = None, params: dict = None, user_id=None):
+        """
+        Returns a snapshot of the clients matching every given criteria, the
+        smallest matching index is used as the starting point
+        """
+        with self.lock:
+            candidates = []
+            if page is not None:
+                candidates.append(self.pages.get(page, ()))
+                for key, value in (params or {}).items():
+                    candidates.append(self.page_params.get((page, key, value), ()))
+            if user_id is not None:
+                candidates.append(self.users.get(str(user_id), ()))
+            if not candidates:
+                return list(self.clients)
+            candidates.sort(key=len)
+            clients = set(candidates[0])
+            for other in candidates[1:]:
+                clients.intersection_update(other)
+            return list(clients)
+
+    def get_user_clients(self, user_ids):
+        with self.lock:
+            clients = []
+            for user_id in user_ids:
+                clients.extend(self.users.get(str(user_id), ()))
+            return clients
+
+    def has_clients(self, page: str = None, params: dict = None) -> bool:
+        if page is None:
+            return len(self.clients) > 0
+        return len(self.get_clients(page, params)) > 0
+
+    # **********************************************************************************
+    #                                   Broadcasts
+    # **********************************************************************************
     def broadcast(self, event_type: str, data):
-        logger.debug(
-            f"Sending to {len(self.clients)} clients: "
-            f"{json.dumps({'event': event_type, 'data': data})}"
-        )
-        for client in self.clients:
-            try:
-                client.send_message(event_type, data)
-            except Exception as e:
-                logger.exception(
-                    f"Error caught while sending WebSocket message to "
-                    f"{client.get_remote_ip()} {e}"
-                )
+        self.send_to_clients(self.get_clients(), event_type, data)
 
     def broadcast_to_admins(self, event_type: str, data):
-        def filter_fn(client):
-            if str(client.get_user_id()) in str(HelperUsers.get_super_user_list()):
-                return True
-            return False
-
-        self.broadcast_with_fn(filter_fn, event_type, data)
+        clients = self.get_user_clients(HelperUsers.get_super_user_list())
+        self.send_to_clients(clients, event_type, data)
 
     def broadcast_to_non_admins(self, event_type: str, data):
-        def filter_fn(client):
-            if str(client.get_user_id()) not in str(HelperUsers.get_super_user_list()):
-                return True
-            return False
-
-        self.broadcast_with_fn(filter_fn, event_type, data)
+        super_users = {str(user_id) for user_id in HelperUsers.get_super_user_list()}
+        with self.lock:
+            clients = []
+            for user_id, user_clients in self.users.items():
+                if user_id not in super_users:
+                    clients.extend(user_clients)
+        self.send_to_clients(clients, event_type, data)
 
     def broadcast_page(self, page: str, event_type: str, data):
-        def filter_fn(client):
-            return client.page == page
-
-        self.broadcast_with_fn(filter_fn, event_type, data)
+        self.send_to_clients(self.get_clients(page), event_type, data)
 
     def broadcast_user(self, user_id: str, event_type: str, data):
-        def filter_fn(client):
-            return client.get_user_id() == user_id
-
-        self.broadcast_with_fn(filter_fn, event_type, data)
+        self.send_to_clients(self.get_clients(user_id=user_id), event_type, data)
 
     def broadcast_user_page(self, page: str, user_id: str, event_type: str, data):
-        def filter_fn(client):
-            if client.get_user_id() != user_id:
-                return False
-            if client.page != page:
-                return False
-            return True
-
-        self.broadcast_with_fn(filter_fn, event_type, data)
+        self.send_to_clients(self.get_clients(page, user_id=user_id), event_type, data)
 
     def broadcast_user_page_params(
         self, page: str, params: dict, user_id: str, event_type: str, data
     ):
-        def filter_fn(client):
-            if client.get_user_id() != user_id:
-                return False
-            if client.page != page:
-                return False
-            for key, param in params.items():
-                if param != client.page_query_params.get(key, None):
-                    return False
-            return True
-
-        self.broadcast_with_fn(filter_fn, event_type, data)
+        self.send_to_clients(self.get_clients(page, params, user_id), event_type, data)
 
     def broadcast_page_params(self, page: str, params: dict, event_type: str, data):
-        def filter_fn(client):
-            if client.page != page:
-                return False
-            for key, param in params.items():
-                if param != client.page_query_params.get(key, None):
-                    return False
-            return True
+        self.send_to_clients(self.get_clients(page, params), event_type, data)
 
-        self.broadcast_with_fn(filter_fn, event_type, data)
+    def broadcast_page_params_coalesced(
+        self, page: str, params: dict, event_type: str, data, batch_key: str = None
+    ):
+        """
+        Rate limited broadcast_page_params for high frequency events. Without
+        a batch_key only the latest data is sent, with one data must be a list
+        and the items are sent in batches as {batch_key: [items]}.
+        """
+        if not self.has_clients(page, params):
+            return
+        self.coalescer.submit(page, params, event_type, data, batch_key)
 
     def broadcast_with_fn(self, filter_fn, event_type: str, data):
-        # assign self.clients to a static variable here so hopefully
-        # the set size won't change
-        static_clients = self.clients
-        clients = list(filter(filter_fn, static_clients))
-        logger.debug(
-            f"Sending to {len(clients)}  \
-            out of {len(self.clients)} "
-            f"clients: {json.dumps({'event': event_type, 'data': data})}"
+        # Full scan, prefer one of the indexed broadcasts above
+        clients = list(filter(filter_fn, self.get_clients()))
+        self.send_to_clients(clients, event_type, data)
+
+    @staticmethod
+    def encode_message(event_type: str, data) -> bytes:
+        return orjson.dumps(
+            {"event": event_type, "data": data}, option=orjson.OPT_NON_STR_KEYS
         )
 
-        for client in clients[:]:
+    def send_to_clients(self, clients, event_type: str, data):
+        if not clients:
+            return
+        # Serialized once, every client gets the very same bytes
+        try:
+            message = self.encode_message(event_type, data)
+        except orjson.JSONEncodeError as e:
+            logger.exception(f"Unable to encode WebSocket event {event_type} {e}")
+            return
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f"Sending to {len(clients)} out of {len(self.clients)} "
+                f"clients: {message.decode('utf-8')}"
+            )
+
+        for client in clients:
             try:
-                client.send_message(event_type, data)
+                client.send_raw_message(message)
             except Exception as e:
                 logger.exception(
-                    f"Error catched while sending WebSocket message to "
+                    f"Error caught while sending WebSocket message to "
                     f"{client.get_remote_ip()} {e}"
                 )
 
     def disconnect_all(self):
         Console.info("Disconnecting WebSocket clients")
-        for client in self.clients:
+        for client in self.get_clients():
             client.close()
         Console.info("Disconnected WebSocket clients")
@@ -0,0 +1,247 @@
+import os
+import zlib
+import errno
+import shutil
+import logging
+import tempfile
+import collections
+import typing as t
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
+
+from app.classes.shared.backup_manifest import ManifestEntry
+
+logger = logging.getLogger(__name__)
+
+
+class PrecompressedEntry:
+    """
+    Stands in for the compressor of a zipfile write handle when the data
+    handed to it has already been deflated by a worker.
+    """
+
+    @staticmethod
+    def compress(data):
+        return data
+
+    @staticmethod
+    def flush():
+        return b""
+
+
+class ParallelZipWriter:
+    """
+    Adds files to a ZIP_DEFLATED archive, deflating them on a thread pool.
+
+    zlib releases the GIL while compressing, so workers compress the next
+    files while the calling thread appends finished entries to the archive
+    in their original order. Only a bounded window of files is in flight.
+    Files larger than max_parallel_size are written through ZipFile.write()
+    on the calling thread so they are never held in memory.
+    """
+
+    # Size of the blocks files are read and deflated in
+    read_block_size = 1024 * 1024
+    max_parallel_size = 64 * 1024 * 1024
+    # In flight files per worker
+    window_per_worker = 4
+
+    def __init__(self, zip_file: ZipFile, workers: int, compresslevel: int = None):
+        self.zip_file = zip_file
+        self.workers = max(int(workers), 1)
+        self.compresslevel = (
+            zlib.Z_DEFAULT_COMPRESSION if compresslevel is None else compresslevel
+        )
+        # Paths of the files that could not be archived
+        self.failed: t.List[str] = []
+
+    @staticmethod
+    def get_default_workers() -> int:
+        return max(min(os.cpu_count() or 1, 4), 1)
+
+    @staticmethod
+    def is_supported(zip_file: ZipFile) -> bool:
+        # The precompressed path relies on zipfile internals that have been
+        # stable since 3.6, fall back to plain writes if they ever change
+        return zip_file.compression == ZIP_DEFLATED and hasattr(zip_file, "_writing")
+
+    def deflate(self, path: str):
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+        chunks = []
+        crc = 0
+        size = 0
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(self.read_block_size)
+                if not block:
+                    break
+                size += len(block)
+                crc = zlib.crc32(block, crc)
+                chunks.append(compressor.compress(block))
+        chunks.append(compressor.flush())
+        return chunks, crc, size
+
+    def write_deflated(self, path: str, arcname: str, deflated):
+        chunks, crc, size = deflated
+        zinfo = ZipInfo.from_file(path, arcname)
+        zinfo.compress_type = ZIP_DEFLATED
+        zinfo.file_size = size
+        with self.zip_file.open(zinfo, "w") as handle:
+            handle._compressor = (
+                PrecompressedEntry()
+            )  # pylint: disable=protected-access
+            for chunk in chunks:
+                handle.write(chunk)
+            # write() accounted the compressed bytes, put the real values in
+            # place before close() writes the headers
+            handle._crc = crc  # pylint: disable=protected-access
+            handle._file_size = size  # pylint: disable=protected-access
+
+    def write_file(self, path: str, arcname: str, future):
+        if future is None:
+            self.zip_file.write(path, arcname)
+        else:
+            self.write_deflated(path, arcname, future.result())
+
+    def write_entries(
+        self, entries: t.Iterable[ManifestEntry]
+    ) -> t.Iterator[ManifestEntry]:
+        """
+        Archives manifest entries and yields every entry once it has been
+        written, in the order they came in.
+        Files that fail are logged, skipped and collected in failed.
+        """
+        if self.workers <= 1 or not self.is_supported(self.zip_file):
+            for entry in entries:
+                self.write_safe(entry, None)
+                yield entry
+            return
+
+        window = collections.deque()
+        with ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="backup_deflate"
+        ) as executor:
+            for entry in entries:
+                future = None
+                # The manifest already knows the size, no need to stat again
+                if entry.size <= self.max_parallel_size:
+                    future = executor.submit(self.deflate, entry.path)
+                window.append((entry, future))
+                while len(window) > self.workers * self.window_per_worker:
+                    yield self.write_next(window)
+            while window:
+                yield self.write_next(window)
+
+    def write_next(self, window: collections.deque) -> ManifestEntry:
+        entry, future = window.popleft()
+        self.write_safe(entry, future)
+        return entry
+
+    def write_safe(self, entry: ManifestEntry, future):
+        try:
+            logger.debug(f"backing up: {entry.path}")
+            self.write_file(entry.path, entry.arcname, future)
+        except Exception as e:
+            logger.warning(f"Error backing up: {entry.path}! - Error was: {e}")
+            self.failed.append(entry.path)
+
+
+class ParallelZipExtractor:
+    """
+    Extracts an archive straight into its final location, inflating the
+    members on a thread pool.
+
+    Every member is written to a staging directory inside the target and
+    renamed into place once complete, so nothing is copied a second time
+    and no half written file ever shows up in the target. Existing
+    directories are merged into and existing files replaced, like moving
+    an extracted temp dir over with move_dir_exist did.
+    """
+
+    copy_block_size = 1024 * 1024
+
+    def __init__(self, zip_file: ZipFile, workers: int = 0):
+        self.zip_file = zip_file
+        self.workers = max(int(workers or ParallelZipWriter.get_default_workers()), 1)
+
+    @staticmethod
+    def get_member_path(member: ZipInfo) -> t.Optional[str]:
+        """
+        Relative path of a member the way ZipFile.extract() sanitizes it,
+        None for members that would not land inside the target
+        """
+        arcname = member.filename.replace("/", os.path.sep)
+        if os.path.altsep:
+            arcname = arcname.replace(os.path.altsep, os.path.sep)
+        arcname = os.path.splitdrive(arcname)[1]
+        invalid = ("", os.path.curdir, os.path.pardir)
+        parts = [part for part in arcname.split(os.path.sep) if part not in invalid]
+        return os.path.join(*parts) if parts else None
+
+    def extract(
+        self,
+        target_dir: str,
+        skip: t.Callable[[str], bool] = None,
+        progress: t.Callable[[float], None] = None,
+    ):
+        """
+        Extracts every member to target_dir, leaving out the members whose
+        relative path skip returns True for. progress is called with the
+        percentage of bytes extracted whenever it moved by a whole percent.
+        Members that fail are logged and skipped.
+        """
+        os.makedirs(target_dir, exist_ok=True)
+        files = []
+        for member in self.zip_file.infolist():
+            path = self.get_member_path(member)
+            if path is None or (skip is not None and skip(path)):
+                continue
+            if member.is_dir():
+                os.makedirs(os.path.join(target_dir, path), exist_ok=True)
+            else:
+                files.append((member, path))
+        # Largest first so one big world file doesn't end up last in line
+        files.sort(key=lambda file: file[0].file_size, reverse=True)
+        total_size = sum(member.file_size for member, _path in files)
+
+        staging_dir = tempfile.mkdtemp(prefix=".crafty_extract_", dir=target_dir)
+        try:
+            with ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="zip_inflate"
+            ) as executor:
+                futures = {
+                    executor.submit(
+                        self.extract_member,
+                        member,
+                        os.path.join(staging_dir, str(index)),
+                        os.path.join(target_dir, path),
+                    ): member
+                    for index, (member, path) in enumerate(files)
+                }
+                extracted = 0
+                reported = 0
+                for future in as_completed(futures):
+                    member = futures[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.error(f"Unable to extract {member.filename}: {e}")
+                    extracted += member.file_size
+                    percent = int(extracted * 100 / total_size) if total_size else 100
+                    if progress is not None and percent > reported:
+                        reported = percent
+                        progress(percent)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def extract_member(self, member: ZipInfo, staging_path: str, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.zip_file.open(member) as source, open(staging_path, "wb") as target:
+            shutil.copyfileobj(source, target, self.copy_block_size)
+        try:
+            os.replace(staging_path, path)
+        except OSError as e:
+            # Directories mounted somewhere inside the target
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.move(staging_path, path)
@@ -1,4 +1,5 @@
-from typing import Awaitable, Callable, Optional
+import math
+from typing import Awaitable, Callable, Optional, Tuple
 from app.classes.web.base_handler import BaseHandler
 
 
@@ -21,6 +22,22 @@ class BaseApiHandler(BaseHandler):
     put = _unimplemented_method  # type: Callable[..., Optional[Awaitable[None]]]
     # }}}
 
+    def get_history_range(self) -> Tuple[float, Optional[int]]:
+        """
+        The hours and points query arguments of the stats history endpoints.
+        Raises ValueError for anything that isn't a positive number.
+        """
+        hours = float(self.get_query_argument("hours", "1"))
+        max_points = self.get_query_argument("points", None)
+        max_points = int(max_points) if max_points is not None else None
+        if not math.isfinite(hours):
+            raise ValueError("hours must be a number")
+        if hours <= 0 or (max_points is not None and max_points <= 0):
+            raise ValueError("hours and points must be positive")
+        # Nothing older than history_max_age is kept anyway
+        hours = min(hours, self.helper.get_setting("history_max_age", 7) * 24)
+        return hours, max_points
+
     def options(self, *_, **__):
         """
         Fix CORS
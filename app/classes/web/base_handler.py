@@ -13,6 +13,7 @@ from app.classes.shared.file_helpers import FileHelpers
 from app.classes.shared.main_controller import Controller
 from app.classes.shared.translation import Translation
 from app.classes.shared.main_models import DatabaseShortcuts
+from app.classes.shared.permission_matrix import PermissionMatrix
 from app.classes.models.users import DoesNotExist
 
 logger = logging.getLogger(__name__)
@@ -221,9 +222,9 @@ class BaseHandler(tornado.web.RequestHandler):
                     )
 
                 logger.debug(user["roles"])
-                for r in user["roles"]:
-                    role = self.controller.roles.get_role(r)
-                    exec_user_role.add(role["role_name"])
+                exec_user_role.update(
+                    PermissionMatrix().get_role_names(user["user_id"])
+                )
                 authorized_servers = self.controller.servers.get_authorized_servers(
                     user["user_id"]  # TODO: API key authorized servers?
                 )
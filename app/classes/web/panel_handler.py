@@ -12,7 +12,8 @@ import nh3
 import requests
 import tornado.web
 import tornado.escape
-from tornado import iostream
+import tornado.ioloop
+from tornado import httputil, iostream
 
 # TZLocal is set as a hidden import on win pipeline
 from tzlocal import get_localzone
@@ -24,6 +25,7 @@ from app.classes.models.management import HelpersManagement
 from app.classes.controllers.roles_controller import RolesController
 from app.classes.shared.helpers import Helpers
 from app.classes.shared.main_models import DatabaseShortcuts
+from app.classes.shared.backup_snapshots import SnapshotStore
 from app.classes.web.base_handler import BaseHandler
 from app.classes.web.webhooks.webhook_factory import WebhookFactory
 
@@ -132,29 +134,106 @@ class PanelHandler(BaseHandler):
                 roles.add(role.role_id)
         return roles
 
-    def download_file(self, name: str, file: str):
+    @staticmethod
+    def parse_range(header: str, size: int) -> t.Optional[t.Tuple[int, int]]:
+        """
+        First and last byte of a single bytes range, None if the header can't
+        be served as one range. Raises ValueError if it can't be satisfied.
+        """
+        unit, _, ranges = header.partition("=")
+        if unit.strip().lower() != "bytes" or "," in ranges:
+            # Several ranges at once are answered with the whole file
+            return None
+        first, sep, last = ranges.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if not first:
+                # Suffix range, the last bytes of the file
+                suffix = int(last)
+                if suffix <= 0:
+                    raise ValueError("empty suffix range")
+                return max(size - suffix, 0), size - 1
+            first = int(first)
+            last = int(last) if last else size - 1
+        except ValueError:
+            return None
+        if first >= size or last < first:
+            raise ValueError(f"range {header} not satisfiable")
+        return first, min(last, size - 1)
+
+    async def download_file(self, name: str, file: str):
+        """
+        Streams file to the client. Reads happen on the executor and every
+        chunk waits for the previous one to be sent, so slow clients neither
+        block the IOLoop nor pile the file up in memory. Single byte ranges
+        are supported for resuming and parallel downloads.
+        """
+        chunk_size = 1024 * 1024 * 4  # 4 MiB
+        stat = os.stat(file)
+        size = stat.st_size
+        etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+        last_modified = datetime.datetime.fromtimestamp(
+            stat.st_mtime, datetime.timezone.utc
+        ).replace(microsecond=0)
+
         self.set_header("Content-Type", "application/octet-stream")
         self.set_header("Content-Disposition", f"attachment; filename={name}")
-        chunk_size = 1024 * 1024 * 4  # 4 MiB
+        self.set_header("Accept-Ranges", "bytes")
+        self.set_header("ETag", etag)
+        self.set_header("Last-Modified", last_modified)
+
+        first, last = 0, size - 1
+        range_header = self.request.headers.get("Range")
+        if_range = self.request.headers.get("If-Range")
+        if (
+            range_header
+            and if_range
+            and if_range
+            not in (
+                etag,
+                httputil.format_timestamp(last_modified),
+            )
+        ):
+            # The file changed since the client got its first part
+            range_header = None
+        if range_header:
+            try:
+                requested = self.parse_range(range_header, size)
+            except ValueError:
+                self.set_status(416)
+                self.set_header("Content-Range", f"bytes */{size}")
+                self.clear_header("Content-Disposition")
+                self.finish()
+                return
+            if requested is not None:
+                first, last = requested
+                self.set_status(206)
+                self.set_header("Content-Range", f"bytes {first}-{last}/{size}")
+        self.set_header("Content-Length", last - first + 1)
 
+        loop = tornado.ioloop.IOLoop.current()
         with open(file, "rb") as f:
-            while True:
-                chunk = f.read(chunk_size)
+            f.seek(first)
+            remaining = last - first + 1
+            while remaining > 0:
+                chunk = await loop.run_in_executor(
+                    None, f.read, min(chunk_size, remaining)
+                )
                 if not chunk:
                     break
+                remaining -= len(chunk)
                 try:
                     self.write(chunk)  # write the chunk to response
-                    self.flush()  # send the chunk to client
+                    # Waits until the client took the chunk before reading on
+                    await self.flush()
                 except iostream.StreamClosedError:
                     # this means the client has closed the connection
                     # so break the loop
                     break
                 finally:
-                    # deleting the chunk is very important because
-                    # if many clients are downloading files at the
-                    # same time, the chunks in memory will keep
-                    # increasing and will eat up the RAM
                     del chunk
+        self.finish()
 
     def check_subpage_perms(self, user_perms, subpage):
         if SUBPAGE_PERMS.get(subpage, False) in user_perms:
@@ -785,9 +864,28 @@ class PanelHandler(BaseHandler):
                 self.redirect("/panel/error?error=Invalid path detected")
                 return
 
-            self.download_file(file, backup_file)
-
-            self.redirect(f"/panel/server_detail?id={server_id}&subpage=backup")
+            if SnapshotStore.is_snapshot(backup_file):
+                # Incremental backups are handed out as a regular zip archive
+                zip_name = os.path.basename(file).removesuffix(".snapshot") + ".zip"
+                loop = tornado.ioloop.IOLoop.current()
+                store = SnapshotStore(os.path.dirname(backup_file))
+                export_path = await loop.run_in_executor(
+                    None, store.get_export, backup_file
+                )
+                try:
+                    await self.download_file(zip_name, export_path)
+                finally:
+                    # Drop the export once it went unused for its whole TTL,
+                    # even if nobody downloads or backs up anything after this
+                    loop.call_later(
+                        SnapshotStore.export_ttl_seconds + 1,
+                        loop.run_in_executor,
+                        None,
+                        store.remove_expired_exports,
+                    )
+            else:
+                await self.download_file(file, backup_file)
+            return
 
         elif page == "panel_config":
             auth_servers = {}
@@ -1356,6 +1454,10 @@ class PanelHandler(BaseHandler):
                 "server_id": server_id,
                 "backup_location": os.path.join(self.helper.backup_path, server_id),
                 "compress": False,
+                "worker_count": 0,
+                "backup_type": "full",
+                "archive_format": "zip",
+                "compression_level": None,
                 "shutdown": False,
                 "before": "",
                 "after": "",
@@ -1657,8 +1759,8 @@ class PanelHandler(BaseHandler):
                 self.redirect("/panel/error?error=Invalid path detected")
                 return
 
-            self.download_file(name, file)
-            self.redirect(f"/panel/server_detail?id={server_id}&subpage=files")
+            await self.download_file(name, file)
+            return
 
         elif page == "wiki":
             template = "panel/wiki.html"
@@ -1666,34 +1768,11 @@ class PanelHandler(BaseHandler):
         elif page == "download_support_package":
             temp_zip_storage = exec_user["support_logs"]
 
-            self.set_header("Content-Type", "application/octet-stream")
-            self.set_header(
-                "Content-Disposition", "attachment; filename=" + "support_logs.zip"
-            )
-            chunk_size = 1024 * 1024 * 4  # 4 MiB
-            if temp_zip_storage != "":
-                with open(temp_zip_storage, "rb") as f:
-                    while True:
-                        chunk = f.read(chunk_size)
-                        if not chunk:
-                            break
-                        try:
-                            self.write(chunk)  # write the chunk to response
-                            self.flush()  # send the chunk to client
-                        except iostream.StreamClosedError:
-                            # this means the client has closed the connection
-                            # so break the loop
-                            break
-                        finally:
-                            # deleting the chunk is very important because
-                            # if many clients are downloading files at the
-                            # same time, the chunks in memory will keep
-                            # increasing and will eat up the RAM
-                            del chunk
-                self.redirect("/panel/dashboard")
-            else:
+            if temp_zip_storage == "":
                 self.redirect("/panel/error?error=No path found for support logs")
                 return
+            await self.download_file("support_logs.zip", temp_zip_storage)
+            return
 
         elif page == "support_logs":
             logger.info(
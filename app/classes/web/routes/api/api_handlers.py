@@ -77,7 +77,10 @@ from app.classes.web.routes.api.crafty.config.index import (
 from app.classes.web.routes.api.crafty.config.server_dir import (
     ApiCraftyConfigServerDirHandler,
 )
-from app.classes.web.routes.api.crafty.stats.stats import ApiCraftyHostStatsHandler
+from app.classes.web.routes.api.crafty.stats.stats import (
+    ApiCraftyHostStatsHandler,
+    ApiCraftyHostStatsHistoryHandler,
+)
 from app.classes.web.routes.api.crafty.clogs.index import ApiCraftyLogIndexHandler
 from app.classes.web.routes.api.crafty.imports.index import ApiImportFilesIndexHandler
 from app.classes.web.routes.api.crafty.exe_cache import ApiCraftyJarCacheIndexHandler
@@ -127,6 +130,11 @@ def api_handlers(handler_args):
             ApiCraftyHostStatsHandler,
             handler_args,
         ),
+        (
+            r"/api/v2/crafty/stats/history/?",
+            ApiCraftyHostStatsHistoryHandler,
+            handler_args,
+        ),
         (
             r"/api/v2/crafty/logs/([a-z0-9_]+)/?",
             ApiCraftyLogIndexHandler,
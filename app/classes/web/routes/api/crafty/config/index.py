@@ -32,6 +32,9 @@ config_json_schema = {
         "dir_size_poll_freq_minutes": {"type": "integer"},
         "crafty_logs_delete_after_days": {"type": "integer"},
         "big_bucket_repo": {"type": "string"},
+        "websocket_max_event_rate": {"type": "integer", "minimum": 0},
+        "stats_snapshot_ttl_seconds": {"type": "integer", "minimum": 0},
+        "upload_max_buffer_mb": {"type": "integer", "minimum": 1},
     },
     "additionalProperties": False,
     "minProperties": 1,
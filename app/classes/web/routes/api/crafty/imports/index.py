@@ -2,6 +2,7 @@ import os
 import logging
 import json
 import html
+import tornado.ioloop
 from jsonschema import validate
 from jsonschema.exceptions import ValidationError
 from app.classes.models.crafty_permissions import EnumPermissionsCrafty
@@ -24,7 +25,7 @@ files_get_schema = {
 
 
 class ApiImportFilesIndexHandler(BaseApiHandler):
-    def post(self):
+    async def post(self):
         auth_data = self.authenticate_user()
         if not auth_data:
             return
@@ -69,7 +70,9 @@ class ApiImportFilesIndexHandler(BaseApiHandler):
                     self.controller.project_root, "import", "upload", folder
                 )
             if Helpers.check_file_exists(folder):
-                folder = self.file_helper.unzip_server(folder, user_id)
+                folder = await tornado.ioloop.IOLoop.current().run_in_executor(
+                    None, self.file_helper.unzip_server, folder, user_id
+                )
                 root_path = True
             else:
                 if user_id:
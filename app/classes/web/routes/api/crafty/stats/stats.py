@@ -19,3 +19,28 @@ class ApiCraftyHostStatsHandler(BaseApiHandler):
                 "data": latest,
             },
         )
+
+
+class ApiCraftyHostStatsHistoryHandler(BaseApiHandler):
+    def get(self):
+        auth_data = self.authenticate_user()
+        if not auth_data:
+            return
+
+        try:
+            hours, max_points = self.get_history_range()
+        except ValueError as e:
+            return self.finish_json(
+                400,
+                {"status": "error", "error": "INVALID_ARGUMENTS", "error_data": str(e)},
+            )
+
+        history = self.controller.management.get_hosts_history(hours, max_points)
+
+        self.finish_json(
+            200,
+            {
+                "status": "ok",
+                "data": history,
+            },
+        )
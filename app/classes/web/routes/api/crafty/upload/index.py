@@ -1,7 +1,12 @@
 import os
+import re
+import hashlib
 import logging
 import shutil
+import tornado.ioloop
+import tornado.web
 from app.classes.models.server_permissions import EnumPermissionsServer
+from app.classes.shared.chunked_upload import ChunkedUpload, ChunkedUploads
 from app.classes.shared.helpers import Helpers
 from app.classes.web.base_api_handler import BaseApiHandler
 
@@ -31,10 +36,27 @@ IMAGE_MIME_TYPES = [
 ]
 
 ARCHIVE_MIME_TYPES = ["application/zip"]
+CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
 
 
+@tornado.web.stream_request_body
 class ApiFilesUploadHandler(BaseApiHandler):
-    async def post(self, server_id=None):
+    """
+    Uploads are streamed, every piece of the body is hashed and written to
+    its place in the file as it arrives. At most upload_max_buffer_mb of an
+    upload waits in memory, after that Tornado stops reading from the client
+    until the disk caught up.
+    """
+
+    # Default for the upload_max_buffer_mb setting
+    max_buffer_mb = 4
+
+    # Tornado awaits prepare and data_received when they return a coroutine
+    async def prepare(self):  # pylint: disable=invalid-overridden-method
+        self.upload = None
+        if self.request.method != "POST":
+            return
+        server_id = self.path_args[0] if self.path_args else None
         auth_data = self.authenticate_user()
         if not auth_data:
             return
@@ -118,7 +140,6 @@ class ApiFilesUploadHandler(BaseApiHandler):
         self.chunk_index = self.request.headers.get("chunkId")
         if u_type == "server_upload":
             self.upload_dir = self.request.headers.get("location", None)
-        self.temp_dir = os.path.join(self.controller.project_root, "temp", self.file_id)
 
         if u_type == "server_upload":
             # If this is an upload from a server the path will be what
@@ -173,37 +194,34 @@ class ApiFilesUploadHandler(BaseApiHandler):
             return self.finish_json(
                 200, {"status": "ok", "data": {"file-id": self.file_id}}
             )
-        # Create the upload and temp directories if they don't exist
+        # Create the upload directory if it doesn't exist
         os.makedirs(self.upload_dir, exist_ok=True)
+        file_path = os.path.join(self.upload_dir, self.filename)
+        self.auth_data = auth_data
+        self.server_id = server_id
+        self.u_type = u_type
+        self.file_path = file_path
+        self.file_size = file_size
+        loop = tornado.ioloop.IOLoop.current()
 
         # Check for chunked header. We will handle this request differently
         # if it doesn't exist
         if not self.chunked:
-            # Write the file directly to the upload dir
-            with open(os.path.join(self.upload_dir, self.filename), "wb") as file:
-                chunk = self.request.body
-                if chunk:
-                    file.write(chunk)
-            # We'll check the file hash against the sent hash once the file is
-            # written. We cannot check this buffer.
-            calculated_hash = self.file_helper.calculate_file_hash(
-                os.path.join(self.upload_dir, self.filename)
-            )
-            logger.info(
-                f"File upload completed. Filename: {self.filename} Type: {u_type}"
-            )
-            return self.finish_json(
-                200,
-                {
-                    "status": "completed",
-                    "data": {"message": "File uploaded successfully"},
-                },
-            )
-        # Since this is a chunked upload we'll create the temp dir for parts.
-        os.makedirs(self.temp_dir, exist_ok=True)
+            # The whole file is the body, it is written next to the upload dir
+            # and moved in place once all of it arrived
+            self.offset = 0
+            self.expected_size = file_size
+            try:
+                self.upload = await loop.run_in_executor(
+                    None, ChunkedUpload, file_path, file_size, 1
+                )
+            except OSError as e:
+                return self.fail_upload(500, "WRITE ERROR", str(e))
+            self.start_body(file_size)
+            return
 
         # Read headers and query parameters
-        content_length = int(self.request.headers.get("Content-Length"))
+        content_length = int(self.request.headers.get("Content-Length", 0))
         if content_length <= 0:
             logger.error(
                 f"File upload failed. Filename: {self.filename}"
@@ -237,12 +255,130 @@ class ApiFilesUploadHandler(BaseApiHandler):
                 },
             )
 
-        # Calculate the hash of the buffer and compare it against the expected hash
-        calculated_hash = self.file_helper.calculate_buffer_hash(self.request.body)
-        if str(self.chunk_hash) != str(calculated_hash):
+        try:
+            self.chunk_number = int(self.chunk_index)
+            self.offset = self.get_chunk_offset(
+                self.request.headers.get("Content-Range"),
+                self.chunk_number,
+                total_chunks,
+                file_size,
+                content_length,
+            )
+        except ValueError:
+            return self.fail_upload(
+                400, "INDEX ERROR", f"Invalid chunk {self.chunk_index}"
+            )
+        self.expected_size = content_length
+
+        # Chunks are written at their offset into the upload as they arrive
+        try:
+            self.upload = await loop.run_in_executor(
+                None,
+                ChunkedUploads().open,
+                self.file_id,
+                file_path,
+                file_size,
+                total_chunks,
+            )
+        except OSError as e:
+            return self.fail_upload(500, "WRITE ERROR", str(e))
+        self.start_body(content_length)
+
+    def start_body(self, body_size: int):
+        self.hasher = hashlib.sha256()
+        self.buffer = []
+        self.buffered = 0
+        self.written = 0
+        self.writing = None
+        self.upload_error = None
+        self.max_buffer = (
+            max(
+                self.helper.get_setting("upload_max_buffer_mb", self.max_buffer_mb),
+                1,
+            )
+            * 1024
+            * 1024
+        )
+        # The server wide limit is meant for requests we keep in memory
+        self.request.connection.set_max_body_size(body_size)
+
+    # Awaiting the write here is what holds off reading more of the body
+    async def data_received(
+        self, chunk: bytes
+    ):  # pylint: disable=invalid-overridden-method
+        if self.upload is None:
+            return
+        self.buffer.append(chunk)
+        self.buffered += len(chunk)
+        # Half of the buffer is being written while the other half fills up
+        if self.buffered >= self.max_buffer // 2:
+            await self.write_buffer(self.upload)
+
+    async def write_buffer(self, upload: ChunkedUpload):
+        # Waiting for the previous write holds off reading from the client
+        await self.wait_for_write()
+        if not self.buffered:
+            return
+        data = b"".join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        offset = self.offset + self.written
+        self.written += len(data)
+        if self.upload_error is None:
+            self.writing = tornado.ioloop.IOLoop.current().run_in_executor(
+                None, self.write_data, upload, offset, data
+            )
+
+    async def wait_for_write(self):
+        writing, self.writing = self.writing, None
+        if writing is None:
+            return
+        try:
+            await writing
+        except (OSError, ValueError) as e:
+            self.upload_error = e
+
+    def write_data(self, upload: ChunkedUpload, offset: int, data: bytes):
+        # Runs on the executor, one write at a time so the hash stays in order
+        self.hasher.update(data)
+        upload.write(offset, data)
+
+    async def post(self, server_id=None):
+        upload, self.upload = self.upload, None
+        if upload is None:
+            return
+        await self.write_buffer(upload)
+        await self.wait_for_write()
+        loop = tornado.ioloop.IOLoop.current()
+
+        if not self.chunked:
+            if self.upload_error is None and self.written != self.expected_size:
+                self.upload_error = ValueError(
+                    f"Received {self.written} of {self.expected_size} bytes"
+                )
+            if self.upload_error is not None:
+                await loop.run_in_executor(None, upload.discard)
+                return self.fail_upload(500, "WRITE ERROR", str(self.upload_error))
+            upload.mark_received(0)
+            await loop.run_in_executor(None, upload.finish)
+            logger.info(
+                f"File upload completed. Filename: {self.filename} Type: {self.u_type}"
+            )
+            return self.finish_json(
+                200,
+                {
+                    "status": "completed",
+                    "data": {"message": "File uploaded successfully"},
+                },
+            )
+
+        if self.upload_error is not None:
+            return self.fail_upload(500, "WRITE ERROR", str(self.upload_error))
+        # Compare the hash of the chunk against the expected hash
+        if str(self.chunk_hash) != self.hasher.hexdigest():
             logger.error(
                 f"File upload failed. Filename: {self.filename}"
-                f"Type: {u_type} Error: INVALID HASH"
+                f"Type: {self.u_type} Error: INVALID HASH"
             )
             return self.finish_json(
                 400,
@@ -255,38 +391,18 @@ class ApiFilesUploadHandler(BaseApiHandler):
                     },
                 },
             )
+        upload.mark_received(self.chunk_number)
 
-        # File paths
-        file_path = os.path.join(self.upload_dir, self.filename)
-        chunk_path = os.path.join(
-            self.temp_dir, f"{self.filename}.part{self.chunk_index}"
-        )
-
-        # Save the chunk
-        with open(chunk_path, "wb") as f:
-            f.write(self.request.body)
-
-        # Check if all chunks are received
-        received_chunks = [
-            f
-            for f in os.listdir(self.temp_dir)
-            if f.startswith(f"{self.filename}.part")
-        ]
-        # When we've reached the total chunks we'll
-        # Compare the hash and write the file
-        if len(received_chunks) == total_chunks:
-            with open(file_path, "wb") as outfile:
-                for i in range(total_chunks):
-                    chunk_file = os.path.join(self.temp_dir, f"{self.filename}.part{i}")
-                    with open(chunk_file, "rb") as infile:
-                        outfile.write(infile.read())
-                    os.remove(chunk_file)
+        # When we've received every chunk the file only has to be put in place
+        if upload.complete and await loop.run_in_executor(
+            None, ChunkedUploads().finish, self.file_id
+        ):
             logger.info(
                 f"File upload completed. Filename: {self.filename}"
-                f" Path: {file_path} Type: {u_type}"
+                f" Path: {self.file_path} Type: {self.u_type}"
             )
             self.controller.management.add_to_audit_log(
-                auth_data[4]["user_id"],
+                self.auth_data[4]["user_id"],
                 f"Uploaded file {self.filename}",
                 server_id,
                 self.request.remote_ip,
@@ -306,3 +422,48 @@ class ApiFilesUploadHandler(BaseApiHandler):
                     "data": {"message": f"Chunk {self.chunk_index} received"},
                 },
             )
+
+    def on_connection_close(self):
+        super().on_connection_close()
+        upload, self.upload = self.upload, None
+        # A chunk that didn't make it is simply sent again, a whole file is not
+        if upload is not None and not self.chunked:
+            tornado.ioloop.IOLoop.current().spawn_callback(self.discard_upload, upload)
+
+    async def discard_upload(self, upload: ChunkedUpload):
+        await self.wait_for_write()
+        await tornado.ioloop.IOLoop.current().run_in_executor(None, upload.discard)
+
+    def fail_upload(self, status: int, error: str, message: str):
+        logger.error(
+            f"File upload failed. Filename: {self.filename}"
+            f" Type: {self.u_type} Error: {message}"
+        )
+        return self.finish_json(
+            status,
+            {
+                "status": "error",
+                "error": error,
+                "data": {"message": message, "chunk_id": self.chunk_index},
+            },
+        )
+
+    @staticmethod
+    def get_chunk_offset(
+        content_range, chunk_index, total_chunks, file_size, chunk_size
+    ) -> int:
+        """
+        Where a chunk goes in the file, from its Content-Range header or
+        otherwise from its index, all chunks but the last being equally large
+        """
+        if not 0 <= chunk_index < total_chunks:
+            raise ValueError(f"Invalid chunk {chunk_index}")
+        match = CONTENT_RANGE_RE.fullmatch(content_range or "")
+        if match:
+            start, end, size = (int(group) for group in match.groups())
+            if end - start + 1 != chunk_size or size != file_size:
+                raise ValueError(f"Content-Range {content_range} doesn't match chunk")
+            return start
+        if chunk_index == total_chunks - 1:
+            return file_size - chunk_size
+        return chunk_index * chunk_size
@@ -1,11 +1,14 @@
 import logging
 import json
 import os
+import tornado.ioloop
 from apscheduler.jobstores.base import JobLookupError
 from jsonschema import validate
 from jsonschema.exceptions import ValidationError
 from app.classes.models.server_permissions import EnumPermissionsServer
 from app.classes.shared.file_helpers import FileHelpers
+from app.classes.shared.backup_snapshots import SnapshotStore
+from app.classes.shared.backup_archives import BackupFormats
 from app.classes.web.base_api_handler import BaseApiHandler
 from app.classes.shared.helpers import Helpers
 
@@ -26,6 +29,14 @@ BACKUP_PATCH_SCHEMA = {
         "backup_location": {"type": "string", "minLength": 1},
         "max_backups": {"type": "integer"},
         "compress": {"type": "boolean"},
+        "worker_count": {"type": "integer", "minimum": 0},
+        "backup_type": {"type": "string", "enum": ["full", "incremental"]},
+        "archive_format": {"type": "string", "enum": ["zip", "tar.zst"]},
+        "compression_level": {
+            "type": ["integer", "null"],
+            "minimum": 0,
+            "maximum": 22,
+        },
         "shutdown": {"type": "boolean"},
         "before": {"type": "string"},
         "after": {"type": "string"},
@@ -41,6 +52,14 @@ BASIC_BACKUP_PATCH_SCHEMA = {
         "backup_name": {"type": "string", "minLength": 3},
         "max_backups": {"type": "integer"},
         "compress": {"type": "boolean"},
+        "worker_count": {"type": "integer", "minimum": 0},
+        "backup_type": {"type": "string", "enum": ["full", "incremental"]},
+        "archive_format": {"type": "string", "enum": ["zip", "tar.zst"]},
+        "compression_level": {
+            "type": ["integer", "null"],
+            "minimum": 0,
+            "maximum": 22,
+        },
         "shutdown": {"type": "boolean"},
         "before": {"type": "string"},
         "after": {"type": "string"},
@@ -139,7 +158,7 @@ class ApiServersServerBackupsBackupIndexHandler(BaseApiHandler):
 
         return self.finish_json(200, {"status": "ok"})
 
-    def post(self, server_id: str, backup_id: str):
+    async def post(self, server_id: str, backup_id: str):
         auth_data = self.authenticate_user()
         if not auth_data:
             return
@@ -199,7 +218,14 @@ class ApiServersServerBackupsBackupIndexHandler(BaseApiHandler):
         )
         if Helpers.validate_traversal(backup_location, zip_name):
             try:
-                temp_dir = Helpers.unzip_backup_archive(backup_location, zip_name)
+                temp_dir = await tornado.ioloop.IOLoop.current().run_in_executor(
+                    None,
+                    Helpers.unzip_backup_archive,
+                    backup_location,
+                    zip_name,
+                    self.helper.servers_dir,
+                    FileHelpers.get_extract_progress(auth_data[4]["user_id"], zip_name),
+                )
             except (FileNotFoundError, NotADirectoryError) as e:
                 return self.finish_json(
                     400, {"status": "error", "error": f"NO BACKUP FOUND {e}"}
@@ -360,6 +386,20 @@ class ApiServersServerBackupsBackupIndexHandler(BaseApiHandler):
                     "error_data": GENERAL_AUTH_ERROR,
                 },
             )
+        archive_format = data.get("archive_format", backup_conf["archive_format"])
+        if not BackupFormats.is_valid_level(
+            archive_format,
+            data.get("compression_level", backup_conf["compression_level"]),
+        ):
+            return self.finish_json(
+                400,
+                {
+                    "status": "error",
+                    "error": "INVALID_COMPRESSION_LEVEL",
+                    "error_data": f"Compression level is out of range for "
+                    f"{archive_format} backups",
+                },
+            )
         self.controller.management.update_backup_config(backup_id, data)
         return self.finish_json(200, {"status": "ok"})
 
@@ -423,13 +463,16 @@ class ApiServersServerBackupsBackupFilesIndexHandler(BaseApiHandler):
             ),
         )
         try:
-            FileHelpers.del_file(
-                os.path.join(
-                    backup_conf["backup_location"],
-                    backup_conf["backup_id"],
-                    data["filename"],
-                )
+            backup_file = os.path.join(
+                backup_conf["backup_location"],
+                backup_conf["backup_id"],
+                data["filename"],
             )
+            if SnapshotStore.is_snapshot(backup_file):
+                # Takes the chunks nothing else refers to along with it
+                SnapshotStore(os.path.dirname(backup_file)).remove(backup_file)
+            else:
+                FileHelpers.del_file(backup_file)
         except Exception as e:
             return self.finish_json(
                 400, {"status": "error", "error": f"DELETE FAILED with error {e}"}
@@ -4,6 +4,7 @@ import json
 from jsonschema import validate
 from jsonschema.exceptions import ValidationError
 from app.classes.models.server_permissions import EnumPermissionsServer
+from app.classes.shared.backup_archives import BackupFormats
 from app.classes.web.base_api_handler import BaseApiHandler
 
 logger = logging.getLogger(__name__)
@@ -15,6 +16,14 @@ backup_patch_schema = {
         "backup_location": {"type": "string", "minLength": 1},
         "max_backups": {"type": "integer"},
         "compress": {"type": "boolean"},
+        "worker_count": {"type": "integer", "minimum": 0},
+        "backup_type": {"type": "string", "enum": ["full", "incremental"]},
+        "archive_format": {"type": "string", "enum": ["zip", "tar.zst"]},
+        "compression_level": {
+            "type": ["integer", "null"],
+            "minimum": 0,
+            "maximum": 22,
+        },
         "shutdown": {"type": "boolean"},
         "before": {"type": "string"},
         "after": {"type": "string"},
@@ -30,6 +39,14 @@ basic_backup_patch_schema = {
         "backup_name": {"type": "string", "minLength": 3},
         "max_backups": {"type": "integer"},
         "compress": {"type": "boolean"},
+        "worker_count": {"type": "integer", "minimum": 0},
+        "backup_type": {"type": "string", "enum": ["full", "incremental"]},
+        "archive_format": {"type": "string", "enum": ["zip", "tar.zst"]},
+        "compression_level": {
+            "type": ["integer", "null"],
+            "minimum": 0,
+            "maximum": 22,
+        },
         "shutdown": {"type": "boolean"},
         "before": {"type": "string"},
         "after": {"type": "string"},
@@ -85,6 +102,19 @@ class ApiServersServerBackupsIndexHandler(BaseApiHandler):
                     "error_data": str(e),
                 },
             )
+        archive_format = data.get("archive_format", "zip")
+        if not BackupFormats.is_valid_level(
+            archive_format, data.get("compression_level")
+        ):
+            return self.finish_json(
+                400,
+                {
+                    "status": "error",
+                    "error": "INVALID_COMPRESSION_LEVEL",
+                    "error_data": f"Compression level is out of range for "
+                    f"{archive_format} backups",
+                },
+            )
         if server_id not in [str(x["server_id"]) for x in auth_data[0]]:
             # if the user doesn't have access to the server, return an error
             return self.finish_json(400, {"status": "error", "error": "NOT_AUTHORIZED"})
@@ -2,6 +2,7 @@ import os
 import logging
 import json
 import html
+import tornado.ioloop
 from jsonschema import validate
 from jsonschema.exceptions import ValidationError
 from app.classes.models.server_permissions import EnumPermissionsServer
@@ -515,7 +516,7 @@ class ApiServersServerFilesCreateHandler(BaseApiHandler):
 
 
 class ApiServersServerFilesZipHandler(BaseApiHandler):
-    def post(self, server_id: str):
+    async def post(self, server_id: str):
         auth_data = self.authenticate_user()
         if not auth_data:
             return
@@ -565,7 +566,10 @@ class ApiServersServerFilesZipHandler(BaseApiHandler):
                 },
             )
         if Helpers.check_file_exists(folder):
-            folder = self.file_helper.unzip_file(folder, user_id)
+            # Top level server.properties and friends are left alone like before
+            folder = await tornado.ioloop.IOLoop.current().run_in_executor(
+                None, self.file_helper.unzip_file, folder, True, user_id
+            )
         else:
             if user_id:
                 return self.finish_json(
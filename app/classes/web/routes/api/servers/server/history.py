@@ -16,8 +16,17 @@ class ApiServersServerHistoryHandler(BaseApiHandler):
             # if the user doesn't have access to the server, return an error
             return self.finish_json(400, {"status": "error", "error": "NOT_AUTHORIZED"})
 
+        try:
+            hours, max_points = self.get_history_range()
+        except ValueError as e:
+            return self.finish_json(
+                400,
+                {"status": "error", "error": "INVALID_ARGUMENTS", "error_data": str(e)},
+            )
+
         srv = ServersController().get_server_instance_by_id(server_id)
-        history = srv.get_server_history()
+        # Long ranges are answered from rollups so they fit into the points
+        history = srv.get_server_history(hours, max_points)
 
         self.finish_json(
             200,
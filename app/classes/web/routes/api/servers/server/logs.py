@@ -3,7 +3,6 @@ import logging
 import pathlib
 import re
 from app.classes.models.server_permissions import EnumPermissionsServer
-from app.classes.shared.server import ServerOutBuf
 from app.classes.web.base_api_handler import BaseApiHandler
 
 
@@ -26,6 +25,19 @@ class ApiServersServerLogsHandler(BaseApiHandler):
         disable_ansi_strip = self.get_query_argument("raw", None) == "true"
         # GET /api/v2/servers/server/logs?html=true
         use_html = self.get_query_argument("html", None) == "true"
+        # GET /api/v2/servers/server/logs?since=120
+        since = self.get_query_argument("since", None)
+        try:
+            since = int(since) if since is not None else None
+        except ValueError:
+            return self.finish_json(
+                400,
+                {
+                    "status": "error",
+                    "error": "INVALID_SINCE",
+                    "error_data": "since must be an integer sequence number",
+                },
+            )
 
         if server_id not in [str(x["server_id"]) for x in auth_data[0]]:
             # if the user doesn't have access to the server, return an error
@@ -42,6 +54,7 @@ class ApiServersServerLogsHandler(BaseApiHandler):
             return self.finish_json(400, {"status": "error", "error": "NOT_AUTHORIZED"})
 
         server_data = self.controller.servers.get_server_data_by_id(server_id)
+        last_seq = None
 
         if read_log_file:
             log_lines = self.helper.get_setting("max_log_lines")
@@ -55,7 +68,13 @@ class ApiServersServerLogsHandler(BaseApiHandler):
             # Remove newline characters from the end of the lines
             raw_lines = [line.rstrip("\r\n") for line in raw_lines]
         else:
-            raw_lines = ServerOutBuf.lines.get(server_id, [])
+            try:
+                server_instance = self.controller.servers.get_server_instance_by_id(
+                    server_id
+                )
+                raw_lines, last_seq = server_instance.scrollback.get_lines(since)
+            except ValueError:
+                raw_lines = []
 
         lines = []
 
@@ -66,15 +85,15 @@ class ApiServersServerLogsHandler(BaseApiHandler):
                     line = re.sub("[A-z]{2}\b\b", "", line)
                     line = html.escape(line)
 
-                if colored_output:
-                    line = self.helper.log_colors(line)
-
                 lines.append(line)
             except Exception as e:
                 logger.warning(f"Skipping Log Line due to error: {e}")
 
+        if colored_output:
+            lines = self.helper.log_colors_lines(lines)
+
         if use_html:
             for line in lines:
                 line = f"{line}<br />"
 
-        self.finish_json(200, {"status": "ok", "data": lines})
+        self.finish_json(200, {"status": "ok", "data": lines, "last_seq": last_seq})
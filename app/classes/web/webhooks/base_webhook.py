@@ -1,6 +1,8 @@
 from abc import ABC, abstractmethod
 import logging
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 
 from app.classes.shared.helpers import Helpers
 
@@ -23,11 +25,25 @@ class WebhookProvider(ABC):
         + "Crafty_4-0.png"
     )
     CRAFTY_VERSION = helper.get_version_string()
+    # One keep-alive session per sending thread, sessions aren't thread safe
+    _sessions = threading.local()
+
+    @classmethod
+    def get_session(cls) -> requests.Session:
+        session = getattr(cls._sessions, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+            session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+            cls._sessions.session = session
+        return session
 
     def _send_request(self, url, payload, headers=None):
         """Send a POST request to the given URL with the provided payload."""
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=10)
+            response = self.get_session().post(
+                url, json=payload, headers=headers, timeout=10
+            )
             response.raise_for_status()
             return "Dispatch successful"
         except requests.RequestException as error:
@@ -14,6 +14,7 @@ logger = logging.getLogger(__name__)
 class WebSocketHandler(tornado.websocket.WebSocketHandler):
     page = None
     page_query_params = None
+    user_id = None
     controller: Controller = None
     tasks_manager = None
     translator = None
@@ -68,6 +69,9 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
             )
 
     def handle(self):
+        # The identity is resolved once here, the manager indexes us by it
+        _, _, user = self.controller.authentication.check(self.get_cookie("token"))
+        self.user_id = user["user_id"]
         self.page = self.get_query_argument("page")
         self.page_query_params = dict(
             parse_qsl(
@@ -79,6 +83,8 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
 
     # pylint: disable=arguments-renamed
     def on_message(self, raw_message):
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
         logger.debug(f"Got message from WebSocket connection {raw_message}")
         message = json.loads(raw_message)
         logger.debug(f"Event Type: {message['event']}, Data: {message['data']}")
@@ -96,12 +102,14 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
         )
 
     def send_message(self, event_type: str, data):
-        message = str(json.dumps({"event": event_type, "data": data}))
+        self.send_raw_message(WebSocketManager.encode_message(event_type, data))
+
+    def send_raw_message(self, message: bytes):
+        # Tornado sends bytes as a text frame unless binary is requested
         self.write_message_async(message)
 
     def get_user_id(self):
-        _, _, user = self.controller.authentication.check(self.get_cookie("token"))
-        return user["user_id"]
+        return self.user_id
 
     def check_auth(self):
         return self.controller.authentication.check_bool(self.get_cookie("token"))
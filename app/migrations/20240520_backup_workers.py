@@ -0,0 +1,16 @@
+# Generated by database migrator
+import peewee
+
+
+def migrate(migrator, database, **kwargs):
+    migrator.add_columns("backups", worker_count=peewee.IntegerField(default=0))
+    """
+    Write your migrations here.
+    """
+
+
+def rollback(migrator, database, **kwargs):
+    migrator.drop_columns("backups", ["worker_count"])
+    """
+    Write your rollback migrations here.
+    """
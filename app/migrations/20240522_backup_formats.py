@@ -0,0 +1,20 @@
+# Generated by database migrator
+import peewee
+
+
+def migrate(migrator, database, **kwargs):
+    migrator.add_columns(
+        "backups",
+        archive_format=peewee.CharField(default="zip"),
+        compression_level=peewee.IntegerField(default=0),
+    )
+    """
+    Write your migrations here.
+    """
+
+
+def rollback(migrator, database, **kwargs):
+    migrator.drop_columns("backups", ["archive_format", "compression_level"])
+    """
+    Write your rollback migrations here.
+    """
@@ -0,0 +1,65 @@
+# Generated by database migrator
+import peewee
+
+
+def rollup_sql(resolution: int) -> str:
+    # Same buckets as StatsRollups.bucket_start, built from the raw samples
+    seconds = (
+        "(CAST(strftime('%M', time) AS INTEGER) * 60"
+        " + CAST(strftime('%S', time) AS INTEGER))"
+    )
+    bucket_seconds = f"({seconds} - {seconds} % {resolution})"
+    bucket = (
+        "strftime('%Y-%m-%d %H:', time)"
+        f" || printf('%02d:%02d', {bucket_seconds} / 60, {bucket_seconds} % 60)"
+    )
+    return (
+        "INSERT INTO host_stats_rollup (resolution, bucket, samples,"
+        " cpu_usage_min, cpu_usage_max, cpu_usage_avg,"
+        " mem_percent_min, mem_percent_max, mem_percent_avg)"
+        f" SELECT {resolution}, {bucket} AS rollup_bucket, COUNT(*),"
+        " MIN(cpu_usage), MAX(cpu_usage), AVG(cpu_usage),"
+        " MIN(mem_percent), MAX(mem_percent), AVG(mem_percent)"
+        " FROM host_stats GROUP BY rollup_bucket"
+    )
+
+
+def migrate(migrator, database, **kwargs):
+    db = database
+
+    class HostStatsRollup(peewee.Model):
+        id = peewee.AutoField()
+        resolution = peewee.IntegerField()
+        bucket = peewee.DateTimeField()
+        samples = peewee.IntegerField(default=0)
+        cpu_usage_min = peewee.FloatField(default=0)
+        cpu_usage_max = peewee.FloatField(default=0)
+        cpu_usage_avg = peewee.FloatField(default=0)
+        mem_percent_min = peewee.FloatField(default=0)
+        mem_percent_max = peewee.FloatField(default=0)
+        mem_percent_avg = peewee.FloatField(default=0)
+
+        class Meta:
+            table_name = "host_stats_rollup"
+            indexes = ((("resolution", "bucket"), True),)
+            database = db
+
+    # Applied migrations are replayed before new ones run, only fill the
+    # rollups the first time around
+    backfill = not database.table_exists("host_stats_rollup")
+    migrator.create_table(HostStatsRollup)
+    migrator.run()
+    if backfill:
+        # Fill the rollups from the samples that are already there
+        for resolution in (60, 5 * 60, 60 * 60):
+            database.execute_sql(rollup_sql(resolution))
+    """
+    Write your migrations here.
+    """
+
+
+def rollback(migrator, database, **kwargs):
+    migrator.drop_table("host_stats_rollup")
+    """
+    Write your rollback migrations here.
+    """
@@ -0,0 +1,35 @@
+# Generated by database migrator
+import peewee
+
+
+def is_not_null(database, table, column):
+    return any(
+        row[1] == column and row[3]
+        for row in database.execute_sql(f"PRAGMA table_info({table})").fetchall()
+    )
+
+
+def migrate(migrator, database, **kwargs):
+    # 0 used to stand for the default level, so stored zips couldn't be asked
+    # for. Applied migrations are replayed before new ones run, only move the
+    # old configs over while the column still is NOT NULL
+    convert = is_not_null(database, "backups", "compression_level")
+    migrator.drop_not_null("backups", "compression_level")
+    migrator.run()
+    if convert:
+        database.execute_sql(
+            "UPDATE backups SET compression_level = NULL WHERE compression_level = 0"
+        )
+    """
+    Write your migrations here.
+    """
+
+
+def rollback(migrator, database, **kwargs):
+    database.execute_sql(
+        "UPDATE backups SET compression_level = 0 WHERE compression_level IS NULL"
+    )
+    migrator.add_not_null("backups", "compression_level")
+    """
+    Write your rollback migrations here.
+    """
@@ -0,0 +1,200 @@
+# Generated by database migrator
+import datetime
+import peewee
+
+from app.classes.models.servers import Servers
+
+SAMPLE_COLUMNS = ("running", "cpu", "mem", "mem_percent", "online", "max")
+DETAIL_COLUMNS = (
+    "started",
+    "world_name",
+    "world_size",
+    "server_port",
+    "int_ping_results",
+    "players",
+    "desc",
+    "icon",
+    "version",
+)
+STATE_COLUMNS = ("updating", "waiting_start", "first_run", "crashed", "importing")
+BATCH_SIZE = 500
+
+
+def get_models(db, samples_table):
+    class ServerStatsDetails(peewee.Model):
+        id = peewee.AutoField()
+        created = peewee.DateTimeField(default=datetime.datetime.now)
+        started = peewee.CharField(default="")
+        world_name = peewee.CharField(default="")
+        world_size = peewee.CharField(default="")
+        server_port = peewee.IntegerField(default=25565)
+        int_ping_results = peewee.CharField(default="")
+        players = peewee.CharField(default="")
+        desc = peewee.CharField(default="Unable to Connect")
+        icon = peewee.CharField(null=True)
+        version = peewee.CharField(default="")
+
+        class Meta:
+            table_name = "server_stats_details"
+            database = db
+
+    class ServerStats(peewee.Model):
+        stats_id = peewee.AutoField()
+        created = peewee.DateTimeField(default=datetime.datetime.now, index=True)
+        server_id = peewee.ForeignKeyField(Servers, backref="server", index=True)
+        running = peewee.BooleanField(default=False)
+        cpu = peewee.FloatField(default=0)
+        mem = peewee.FloatField(default=0)
+        mem_percent = peewee.FloatField(default=0)
+        online = peewee.IntegerField(default=0)
+        max = peewee.IntegerField(default=0)
+        details = peewee.ForeignKeyField(ServerStatsDetails, null=True)
+
+        class Meta:
+            table_name = samples_table
+            database = db
+
+    class ServerStatsState(peewee.Model):
+        server_id = peewee.CharField(primary_key=True)
+        updating = peewee.BooleanField(default=False)
+        waiting_start = peewee.BooleanField(default=False)
+        first_run = peewee.BooleanField(default=True)
+        crashed = peewee.BooleanField(default=False)
+        importing = peewee.BooleanField(default=False)
+
+        class Meta:
+            table_name = "server_stats_state"
+            database = db
+
+    return ServerStatsDetails, ServerStats, ServerStatsState
+
+
+def migrate(migrator, database, **kwargs):
+    if database.table_exists("server_stats_details"):
+        # Replayed to rebuild the table list, the data has been split already
+        for model in get_models(database, "server_stats"):
+            migrator.create_table(model)
+        return
+
+    details_model, samples_model, state_model = get_models(database, "server_stats_new")
+    migrator.create_table(details_model)
+    migrator.create_table(samples_model)
+    migrator.create_table(state_model)
+    migrator.run()
+
+    columns = ("stats_id", "created", "server_id") + SAMPLE_COLUMNS
+    cursor = database.execute_sql(
+        "SELECT "
+        + ", ".join(f'"{column}"' for column in columns + DETAIL_COLUMNS)
+        + " FROM server_stats ORDER BY stats_id"
+    )
+    # Consecutive samples with the same descriptive values share a details row
+    current, details_id = None, None
+    batch = []
+    for row in cursor:
+        details = row[len(columns) :]
+        if details != current:
+            details_id = details_model.insert(
+                created=row[1], **dict(zip(DETAIL_COLUMNS, details))
+            ).execute()
+            current = details
+        batch.append(row[: len(columns)] + (details_id,))
+        if len(batch) >= BATCH_SIZE:
+            insert_samples(database, columns, batch)
+            batch = []
+    insert_samples(database, columns, batch)
+
+    # The flags were kept on every row, the oldest one is the one read back
+    state = database.execute_sql(
+        "SELECT server_id, "
+        + ", ".join(STATE_COLUMNS)
+        + " FROM server_stats ORDER BY stats_id LIMIT 1"
+    ).fetchone()
+    if state is not None:
+        state_model.insert(dict(zip(("server_id",) + STATE_COLUMNS, state))).execute()
+
+    migrator.drop_table("server_stats")
+    migrator.rename_table("server_stats_new", "server_stats")
+    """
+    Write your migrations here.
+    """
+
+
+def insert_samples(database, columns, rows):
+    if not rows:
+        return
+    placeholders = ", ".join("?" * (len(columns) + 1))
+    database.cursor().executemany(
+        "INSERT INTO server_stats_new ("
+        + ", ".join(f'"{column}"' for column in columns)
+        + ', "details_id") VALUES ('
+        + placeholders
+        + ")",
+        rows,
+    )
+
+
+def rollback(migrator, database, **kwargs):
+    db = database
+
+    class ServerStatsWide(peewee.Model):
+        stats_id = peewee.AutoField()
+        created = peewee.DateTimeField(default=datetime.datetime.now)
+        server_id = peewee.ForeignKeyField(Servers, backref="server", index=True)
+        started = peewee.CharField(default="")
+        running = peewee.BooleanField(default=False)
+        cpu = peewee.FloatField(default=0)
+        mem = peewee.FloatField(default=0)
+        mem_percent = peewee.FloatField(default=0)
+        world_name = peewee.CharField(default="")
+        world_size = peewee.CharField(default="")
+        server_port = peewee.IntegerField(default=25565)
+        int_ping_results = peewee.CharField(default="")
+        online = peewee.IntegerField(default=0)
+        max = peewee.IntegerField(default=0)
+        players = peewee.CharField(default="")
+        desc = peewee.CharField(default="Unable to Connect")
+        icon = peewee.CharField(null=True)
+        version = peewee.CharField(default="")
+        updating = peewee.BooleanField(default=False)
+        waiting_start = peewee.BooleanField(default=False)
+        first_run = peewee.BooleanField(default=True)
+        crashed = peewee.BooleanField(default=False)
+        importing = peewee.BooleanField(default=False)
+
+        class Meta:
+            table_name = "server_stats_wide"
+            database = db
+
+    migrator.create_table(ServerStatsWide)
+    migrator.run()
+    columns = ("stats_id", "created", "server_id") + SAMPLE_COLUMNS
+    # Servers without a state row had every flag at its default
+    state_defaults = {column: 0 for column in STATE_COLUMNS}
+    state_defaults["first_run"] = 1
+    database.execute_sql(
+        "INSERT INTO server_stats_wide ("
+        + ", ".join(f'"{column}"' for column in columns + DETAIL_COLUMNS)
+        + ", "
+        + ", ".join(STATE_COLUMNS)
+        + ") SELECT "
+        + ", ".join(f's."{column}"' for column in columns)
+        + ", "
+        + ", ".join(f'd."{column}"' for column in DETAIL_COLUMNS)
+        + ", "
+        + ", ".join(
+            f"COALESCE(st.{column}, {default})"
+            for column, default in state_defaults.items()
+        )
+        + " FROM server_stats s"
+        " LEFT JOIN server_stats_details d ON d.id = s.details_id"
+        " LEFT JOIN server_stats_state st ON st.server_id = s.server_id"
+        " ORDER BY s.stats_id"
+    )
+    migrator.drop_table("server_stats")
+    migrator.drop_table("server_stats_details")
+    migrator.drop_table("server_stats_state")
+    migrator.rename_table("server_stats_wide", "server_stats")
+    """
+    Write your rollback migrations here.
+    """
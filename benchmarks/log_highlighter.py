@@ -0,0 +1,97 @@
+"""
+Console log highlighting, the old per line re.sub passes against
+LogHighlighter.
+
+    python benchmarks/log_highlighter.py [--lines 30000]
+"""
+
+import argparse
+import html
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from app.classes.shared.log_highlighter import LogHighlighter
+
+KEYWORDS = ["help", "chunk"]
+SAMPLES = [
+    "[12:34:56] [Server thread/INFO]: Preparing spawn area: 42%",
+    "[12:34:57] [Server thread/WARN]: Can't keep up! Is the server overloaded?",
+    "[12:34:58] [User Authenticator #1/INFO]: UUID of player Steve is 1234",
+    "[12:34:59] [Server thread/INFO]: Steve[/127.0.0.1:51234] logged in",
+    "[2024-01-01 12:00:00:123 ERROR] something broke while loading chunk",
+    "plain line with help text",
+]
+
+
+def old_log_colors(line, user_keywords):
+    # Helpers.log_colors before LogHighlighter, minus the config.json read
+    replacements = [
+        (r"(\[.+?/INFO\])", r'<span class="mc-log-info">\1</span>'),
+        (r"(\[.+?/WARN\])", r'<span class="mc-log-warn">\1</span>'),
+        (r"(\[.+?/ERROR\])", r'<span class="mc-log-error">\1</span>'),
+        (r"(\[.+?/FATAL\])", r'<span class="mc-log-fatal">\1</span>'),
+        (
+            r"(\w+?\[/\d+?\.\d+?\.\d+?\.\d+?\:\d+?\])",
+            r'<span class="mc-log-keyword">\1</span>',
+        ),
+        (r"\[(\d\d:\d\d:\d\d)\]", r'<span class="mc-log-time">[\1]</span>'),
+        (r"(\[.+? INFO\])", r'<span class="mc-log-info">\1</span>'),
+        (r"(\[.+? WARN\])", r'<span class="mc-log-warn">\1</span>'),
+        (r"(\[.+? ERROR\])", r'<span class="mc-log-error">\1</span>'),
+        (r"(\[.+? FATAL\])", r'<span class="mc-log-fatal">\1</span>'),
+    ]
+    for keyword in user_keywords:
+        replacements.append((f"({keyword})", r'<span class="mc-log-keyword">\1</span>'))
+    for old, new in replacements:
+        line = re.sub(old, new, line, flags=re.IGNORECASE)
+    return line
+
+
+def check_line_bounds():
+    # Anchors and patterns matching a line break have to stay within a line
+    highlighter = LogHighlighter(["done$", r"foo\s+bar"])
+    assert highlighter.highlight_lines(["a done", "b done"]) == [
+        'a <span class="mc-log-keyword">done</span>',
+        'b <span class="mc-log-keyword">done</span>',
+    ]
+    assert highlighter.highlight_lines(["x foo", "bar y"]) == ["x foo", "bar y"]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=30000)
+    parser.add_argument("--batch", type=int, default=200)
+    args = parser.parse_args()
+
+    check_line_bounds()
+    samples = [html.escape(line) for line in SAMPLES]
+    lines = (samples * (args.lines // len(samples) + 1))[: args.lines]
+    highlighter = LogHighlighter(KEYWORDS)
+
+    old = timed(lambda: [old_log_colors(line, KEYWORDS) for line in lines])
+    new = timed(lambda: [highlighter.highlight(line) for line in lines])
+    batched = timed(
+        lambda: [
+            highlighter.highlight_lines(lines[i : i + args.batch])
+            for i in range(0, len(lines), args.batch)
+        ]
+    )
+    print(f"{len(lines)} lines")
+    print(f"  old log_colors:           {old:.3f}s")
+    print(f"  LogHighlighter.highlight: {new:.3f}s ({old / new:.1f}x)")
+    print(f"  highlight_lines ({args.batch}):    {batched:.3f}s ({old / batched:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
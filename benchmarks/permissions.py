@@ -0,0 +1,197 @@
+"""
+Per request authorization work of the panel and API handlers, the old
+UserRoles -> Roles -> RoleServers queries against PermissionMatrix, on a
+throwaway SQLite database.
+
+    python benchmarks/permissions.py [--servers 200] [--users 500] [--roles 20]
+        [--requests 500]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import peewee
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from app.classes.models.base_model import database_proxy
+from app.classes.models.roles import Roles
+from app.classes.models.servers import Servers
+from app.classes.models.users import Users, UserRoles
+from app.classes.models.server_permissions import (
+    EnumPermissionsServer,
+    PermissionsServers,
+    RoleServers,
+)
+from app.classes.shared.permission_matrix import PermissionMatrix
+
+ROLES_PER_USER = 3
+
+
+def create_database(path, servers, users, roles, seed):
+    database = peewee.SqliteDatabase(path, pragmas={"foreign_keys": 0})
+    database_proxy.initialize(database)
+    database.create_tables([Users, Roles, UserRoles, Servers, RoleServers], safe=True)
+    rng = random.Random(seed)
+    server_ids = [f"server-{i:04d}" for i in range(servers)]
+    with database.atomic():
+        Servers.insert_many(
+            [
+                {"server_id": server_id, "server_name": server_id}
+                for server_id in server_ids
+            ]
+        ).execute()
+        Roles.insert_many([{"role_name": f"role-{i}"} for i in range(roles)]).execute()
+        Users.insert_many(
+            [
+                # A few superusers, like a real install has
+                {"username": f"user-{i}", "superuser": i % 100 == 0}
+                for i in range(users)
+            ]
+        ).execute()
+        role_servers = []
+        for role_id in range(1, roles + 1):
+            for server_id in rng.sample(server_ids, len(server_ids) // 4):
+                mask = "".join(
+                    rng.choice("01") for _ in range(len(EnumPermissionsServer))
+                )
+                role_servers.append(
+                    {"role_id": role_id, "server_id": server_id, "permissions": mask}
+                )
+        RoleServers.insert_many(role_servers).execute()
+        UserRoles.insert_many(
+            [
+                {"user_id": user_id, "role_id": role_id}
+                for user_id in range(1, users + 1)
+                for role_id in rng.sample(range(1, roles + 1), ROLES_PER_USER)
+            ]
+        ).execute()
+    return database, server_ids
+
+
+# The lookups base_handler.authenticate_user, get_authorized_servers and
+# get_user_permissions_mask did before PermissionMatrix, minus the server
+# instance lookups both paths share
+def old_role_names(user_id):
+    names = set()
+    for user_role in UserRoles.select().where(UserRoles.user_id == user_id):
+        names.add(Roles.get(Roles.role_id == user_role.role_id_id).role_name)
+    return names
+
+
+def old_server_ids(user_id):
+    server_ids = []
+    query = Roles.select().where(Roles.role_id == -1)
+    for user_role in UserRoles.select().where(UserRoles.user_id == user_id):
+        query = query + Roles.select().where(Roles.role_id == user_role.role_id_id)
+    for role in query:
+        for role_server in RoleServers.select().where(
+            RoleServers.role_id == role.role_id
+        ):
+            if role_server.server_id.server_id not in server_ids:
+                server_ids.append(role_server.server_id.server_id)
+    return server_ids
+
+
+def old_mask(user_id, server_id):
+    user = Users.get(Users.user_id == user_id)
+    if user.superuser:
+        return "1" * len(EnumPermissionsServer)
+    roles_list = [
+        user_role.role_id_id
+        for user_role in UserRoles.select().where(UserRoles.user_id == user_id)
+    ]
+    role_server = (
+        RoleServers.select()
+        .where(RoleServers.role_id.in_(roles_list))
+        .where(RoleServers.server_id == server_id)
+        .order_by(RoleServers.role_id)
+        .execute()
+    )
+    try:
+        return role_server[0].permissions
+    except IndexError:
+        return "0" * len(EnumPermissionsServer)
+
+
+def old_request(user_id, server_id):
+    return (
+        old_role_names(user_id),
+        set(old_server_ids(user_id)),
+        old_mask(user_id, server_id),
+    )
+
+
+def new_request(user_id, server_id):
+    matrix = PermissionMatrix()
+    return (
+        matrix.get_role_names(user_id),
+        set(matrix.get_server_ids(user_id)),
+        PermissionsServers.get_user_id_permissions_mask(user_id, server_id),
+    )
+
+
+def run(request, requests):
+    latencies = []
+    for user_id, server_id in requests:
+        start = time.perf_counter()
+        request(user_id, server_id)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(
+        f"  {name:<22} total {sum(latencies):7.3f}s"
+        f"  mean {statistics.mean(latencies) * 1000:7.3f}ms"
+        f"  p50 {statistics.median(latencies) * 1000:7.3f}ms"
+        f"  p99 {p99 * 1000:7.3f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--servers", type=int, default=200)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--roles", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        database, server_ids = create_database(
+            os.path.join(temp_dir, "crafty.sqlite"),
+            args.servers,
+            args.users,
+            args.roles,
+            args.seed,
+        )
+        rng = random.Random(args.seed)
+        requests = [
+            (rng.randint(1, args.users), rng.choice(server_ids))
+            for _ in range(args.requests)
+        ]
+        for user_id, server_id in requests[:200]:
+            assert old_request(user_id, server_id) == new_request(user_id, server_id)
+        PermissionMatrix().invalidate_all()
+
+        print(
+            f"{args.users} users, {args.roles} roles, {args.servers} servers,"
+            f" {args.requests} requests"
+        )
+        report("old queries", run(old_request, requests))
+        report("matrix (cold)", run(new_request, requests))
+        report("matrix (warm)", run(new_request, requests))
+        database.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Console output reading, the old per character TextIOWrapper loop against
+the block reader of ServerOutBuf, on a synthetic console stream piped in
+from a child process.
+
+    python benchmarks/server_console.py [--size-mb 8]
+"""
+
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from app.classes.shared.server_console import ConsoleScrollback, ServerOutBuf
+
+MAX_LINES = 70
+SAMPLES = [
+    "[12:34:56] [Server thread/INFO]: Preparing spawn area: 42%",
+    "[12:34:57] [Server thread/WARN]: Can't keep up! Is the server overloaded?",
+    "[12:34:58] [User Authenticator #1/INFO]: UUID of player Steve is 1234",
+    "[12:34:59] [Server thread/INFO]: <Steve> grüße aus köln ✓",
+    "\033[0;32m[12:35:00] [Server thread/INFO]: Done (12.345s)!\033[m",
+]
+
+
+class OldServerOutBuf:
+    # ServerOutBuf before the block reader, minus the websocket broadcast
+    lines = {}
+
+    def __init__(self, proc, server_id):
+        self.proc = proc
+        self.server_id = str(server_id)
+        self.max_lines = MAX_LINES
+        self.line_buffer = ""
+        OldServerOutBuf.lines[self.server_id] = []
+        self.lsi = 0
+
+    def process_byte(self, char):
+        if char == os.linesep[self.lsi]:
+            self.lsi += 1
+        else:
+            self.lsi = 0
+            self.line_buffer += char
+
+        if self.lsi >= len(os.linesep):
+            self.lsi = 0
+            OldServerOutBuf.lines[self.server_id].append(self.line_buffer)
+
+            self.line_buffer = ""
+            # Limit list length to self.max_lines:
+            if len(OldServerOutBuf.lines[self.server_id]) > self.max_lines:
+                OldServerOutBuf.lines[self.server_id].pop(0)
+
+    def check(self):
+        text_wrapper = io.TextIOWrapper(
+            self.proc.stdout, encoding="UTF-8", errors="ignore", newline=""
+        )
+        while True:
+            if self.proc.poll() is None:
+                char = text_wrapper.read(1)
+                self.process_byte(char)
+            else:
+                flush = text_wrapper.read()
+                for char in flush:
+                    self.process_byte(char)
+                break
+
+
+class NewServerOutBuf(ServerOutBuf):
+    line_count = 0
+
+    def new_lines_handler(self, new_lines):
+        # Only counted, highlighting is measured in log_highlighter.py
+        self.line_count += len(new_lines)
+
+
+def create_stream(path, size):
+    lines = []
+    written = 0
+    index = 0
+    while written < size:
+        line = f"{SAMPLES[index % len(SAMPLES)]} #{index}{os.linesep}"
+        lines.append(line)
+        written += len(line.encode("utf-8"))
+        index += 1
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write("".join(lines))
+    return len(lines), written
+
+
+def start_process(path):
+    # Streams the file to stdout like a chatty server would
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import shutil, sys; shutil.copyfileobj(open(sys.argv[1], 'rb'),"
+            " sys.stdout.buffer)",
+            path,
+        ],
+        stdout=subprocess.PIPE,
+    )
+
+
+def timed(out_buf):
+    start = time.perf_counter()
+    out_buf.check()
+    elapsed = time.perf_counter() - start
+    out_buf.proc.wait()
+    out_buf.proc.stdout.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=float, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "console.log")
+        line_count, size = create_stream(path, int(args.size_mb * 1024 * 1024))
+        size_mb = size / 1024 / 1024
+        print(f"{line_count} lines, {size_mb:.1f} MB")
+
+        old_buf = OldServerOutBuf(start_process(path), 1)
+        old = timed(old_buf)
+        print(f"  read(1) loop:  {old:6.2f}s {size_mb / old:7.1f} MB/s")
+
+        scrollback = ConsoleScrollback(MAX_LINES)
+        new_buf = NewServerOutBuf(None, start_process(path), 1, scrollback)
+        new = timed(new_buf)
+        print(
+            f"  block reader:  {new:6.2f}s {size_mb / new:7.1f} MB/s"
+            f" ({old / new:.0f}x)"
+        )
+
+        assert new_buf.line_count == line_count
+        assert scrollback.get_lines()[0] == OldServerOutBuf.lines["1"][-MAX_LINES:]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Backup archive throughput, the old ZipFile.write() loop of make_backup
+against ParallelZipWriter, on a generated world directory.
+
+    python benchmarks/zip_archiver.py [--size-mb 256] [--workers 1 2 4]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from zipfile import ZipFile, ZIP_DEFLATED
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from app.classes.shared.backup_manifest import ManifestEntry
+from app.classes.shared.zip_archiver import ParallelZipWriter
+
+
+def create_world(world_dir, size, seed):
+    # Region files are the bulk of a world, half incompressible chunk data
+    # and half runs of repeated block ids, next to a lot of small files
+    rng = random.Random(seed)
+    entries = []
+    written = 0
+    index = 0
+    while written < size:
+        if index % 4 == 0:
+            arcname = os.path.join("region", f"r.{index}.0.mca")
+            length = rng.randint(4, 12) * 1024 * 1024
+        else:
+            arcname = os.path.join("playerdata", f"{index:06d}.dat")
+            length = rng.randint(1, 64) * 1024
+        path = os.path.join(world_dir, arcname)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(rng.randbytes(length // 2))
+            f.write(bytes(rng.randrange(16) for _ in range(256)) * (length // 512))
+        stat = os.stat(path)
+        entries.append(ManifestEntry(path, arcname, stat.st_size, stat.st_mtime_ns))
+        written += stat.st_size
+        index += 1
+    return entries, written
+
+
+def old_write(zip_path, entries):
+    # make_backup before ParallelZipWriter
+    with ZipFile(zip_path, "w", ZIP_DEFLATED) as zip_file:
+        for entry in entries:
+            zip_file.write(entry.path, entry.arcname)
+
+
+def parallel_write(zip_path, entries, workers):
+    with ZipFile(zip_path, "w", ZIP_DEFLATED) as zip_file:
+        for _ in ParallelZipWriter(zip_file, workers).write_entries(entries):
+            pass
+
+
+def check_archive(zip_path, entries):
+    with ZipFile(zip_path) as zip_file:
+        assert zip_file.testzip() is None
+        assert zip_file.namelist() == [
+            entry.arcname.replace(os.sep, "/") for entry in entries
+        ]
+        for entry in entries[:8]:
+            with open(entry.path, "rb") as f:
+                assert zip_file.read(entry.arcname.replace(os.sep, "/")) == f.read()
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        entries, size = create_world(
+            os.path.join(temp_dir, "world"), args.size_mb * 1024 * 1024, args.seed
+        )
+        size_mb = size / 1024 / 1024
+        print(f"{len(entries)} files, {size_mb:.0f} MB, {os.cpu_count()} cpus")
+
+        zip_path = os.path.join(temp_dir, "old.zip")
+        old = timed(lambda: old_write(zip_path, entries))
+        check_archive(zip_path, entries)
+        print(f"  ZipFile.write:         {old:6.2f}s {size_mb / old:6.1f} MB/s")
+        os.remove(zip_path)
+
+        for workers in args.workers:
+            zip_path = os.path.join(temp_dir, f"parallel_{workers}.zip")
+            elapsed = timed(lambda: parallel_write(zip_path, entries, workers))
+            check_archive(zip_path, entries)
+            print(
+                f"  ParallelZipWriter({workers}): {elapsed:6.2f}s"
+                f" {size_mb / elapsed:6.1f} MB/s ({old / elapsed:.2f}x)"
+            )
+            os.remove(zip_path)
+
+
+if __name__ == "__main__":
+    main()
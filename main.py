@@ -15,8 +15,10 @@ from app.classes.shared.console import Console
 from app.classes.shared.helpers import Helpers
 from app.classes.models.users import HelperUsers
 from app.classes.models.management import HelpersManagement
+from app.classes.models.server_stats import StatsWriter
 from app.classes.shared.import_helper import ImportHelpers
 from app.classes.shared.websocket_manager import WebSocketManager
+from app.classes.shared.status_snapshot import StatusSnapshotCache
 from app.classes.logging.log_formatter import JsonFormatter
 
 console = Console()
@@ -144,6 +146,9 @@ def tasks_starter():
     # the scheduler officially
     tasks_manager.start_scheduler()
 
+    # keep the server directory sizes up to date
+    tasks_manager.start_dir_size_polling()
+
     # refresh our cache and schedule for every 12 hoursour cache refresh
     # for big bucket.com
     tasks_manager.big_bucket_cache_refresher()
@@ -172,6 +177,11 @@ def do_cleanup():
     except:
         logger.info("Did not find old temp dir.")
     os.mkdir(os.path.join(controller.project_root, "temp"))
+    # Imports and restores that never made it into a server
+    if os.path.isdir(helper.servers_dir):
+        for item in os.listdir(helper.servers_dir):
+            if item.startswith(Helpers.staging_prefix):
+                FileHelpers.del_dirs(os.path.join(helper.servers_dir, item))
 
 
 def do_version_check():
@@ -433,6 +443,9 @@ if __name__ == "__main__":
     # Master config.json in helpers.py
     Console.info("Checking for remote changes to config.json")
     controller.get_config_diff()
+    web_sock.follow_settings(helper)
+    StatsWriter().follow_settings(helper)
+    StatusSnapshotCache().follow_settings(helper)
     # Delete anti-lockout-user
     controller.users.stop_anti_lockout()
     Console.info("Remote change complete.")